@@ -15,6 +15,11 @@ import tempfile
 import argparse
 import sys
 import os
+import multiprocessing
+import resource
+import time
+import hashlib
+import concurrent.futures
 from datetime import datetime
 import resources
 import aotdb
@@ -24,6 +29,18 @@ from init import Init
 from codegen import CodeGen
 from cutoff import CutOff
 from otgenerator import OTGenerator
+from codebuffer import CodeBuffer
+from artifactcache import ArtifactCache
+
+
+# the engine's OTGenerator shared with the workers of the source files analysis pool;
+# the workers are forked so they see a snapshot of all the analysis data
+_worker_otgen = None
+
+
+def _get_src_file_types_worker(job):
+    fid, funcs, globs, stubs = job
+    return _worker_otgen._get_src_file_types(fid, funcs, globs, stubs)
 
 
 class File:
@@ -42,6 +59,9 @@ class Engine:
 
     GLOBAL_HASH_FILE = 'global.hashes'
 
+    MANIFEST_FILE = 'manifest.json'
+    STAGING_DIR_SUFFIX = '.staging'
+
     FUNCTION_POINTER_STUB_FILE_TEMPLATE = "fptr_stub.c.template"
     FUNCTION_POINTER_STUB_FILE_SOURCE = "fptr_stub.c"
     FUNCTION_POINTER_KNOWN_FUNCS_STUB_FILE_TEMPLATE = "fptr_stub_known_funcs.c.template"
@@ -53,16 +73,35 @@ class Engine:
         self.functions = set()
         self.out_dir = Engine.DEFAULT_OUTPUT_DIR
         self.db_frontend = None
+        # in the incremental mode the off-target is generated into a staging directory
+        # and only the changed files are moved to the final output directory
+        self.incremental = False
+        self.final_out_dir = None
+        self.filename_to_fid = {}
 
         # to create
         self.sources_to_types = {}
-        self.file_contents = {}
+        # the generated source files are streamed to the output directory with the sink
+        self.out_sink = None
+        # maps the generated source file name to the name of the file in the output directory
+        self.dst_filenames = {}
+        self.real_names = set()
 
     # -------------------------------------------------------------------------
 
     def init(self, args, db_frontend):
         self.out_dir = args.output_dir
 
+        self.incremental = args.incremental
+        if self.incremental and os.path.isdir(self.out_dir):
+            self.final_out_dir = self.out_dir
+            self.out_dir = f"{self.out_dir}{Engine.STAGING_DIR_SUFFIX}"
+            logging.info(f"Incremental mode: generating the off-target in {self.out_dir}")
+            if os.path.exists(self.out_dir):
+                shutil.rmtree(self.out_dir)
+            # all the modules write to the staging directory
+            args.output_dir = self.out_dir
+
         # create output directory
         # TODO: perhaps it's the job of OTGenerator to prepare the output dir and call the resource manager
         if os.path.exists(self.out_dir):
@@ -113,6 +152,16 @@ class Engine:
         self.load_init = args.load_init
         self.dump_init = args.dump_init
 
+        self.jobs = args.jobs
+        self.format_all = args.format_all
+        self.format_jobs = args.format_jobs
+        self.format_cache = args.format_cache
+
+        self.db = args.db
+        self.common_types_header = args.common_types_header
+        self.common_types = args.common_types
+        self.common_types_threshold = args.common_types_threshold
+
         if args.config:
             logging.info(f"AOT_CONFIG:|{args.config}|")
 
@@ -129,6 +178,18 @@ class Engine:
         self.otgen = OTGenerator(
             self.dbops, self.deps, self.codegen, self.cutoff, self.init, args)
         self.codegen.set_otgen(self.otgen)
+        self.out_sink = self.otgen.out_sink
+        if args.unroll_macro_defs and args.unroll_macro_cache:
+            self.codegen.load_unrolled_macro_cache(args.unroll_macro_cache)
+        if args.artifact_cache:
+            db_identity = ArtifactCache.get_file_identity(args.db)
+            if db_identity is None:
+                logging.warning("The artifact cache requires the --db image file, not using it")
+            else:
+                # the options that change the generated fragments
+                options = [args.dynamic_init, args.stubs_for_klee, args.unroll_macro_defs, args.include_asm,
+                           args.dbjson2, args.used_types_only, args.afl, ArtifactCache.get_file_identity(args.init_file)]
+                self.codegen.set_artifact_cache(ArtifactCache(args.artifact_cache, db_identity, options))
         if args.import_json:
             logging.info("Importing JSON, off-target will not be generated")
             if not all([args.product, args.version, args.build_type]):
@@ -184,6 +245,270 @@ class Engine:
 
     # -------------------------------------------------------------------------
 
+    @staticmethod
+    def _get_file_hash(path):
+        if os.path.islink(path):
+            return hashlib.sha256(os.readlink(path).encode()).hexdigest()
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+    # -------------------------------------------------------------------------
+
+    # Write the manifest of the output directory: for each file its content hash
+    # and the id of the source file it was generated from (see file_to_fid.json)
+    def _create_manifest(self, out_dir):
+        manifest = {}
+        for root, dirs, files in os.walk(out_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                filename = os.path.relpath(path, out_dir)
+                if filename == Engine.MANIFEST_FILE:
+                    continue
+                manifest[filename] = {
+                    "hash": self._get_file_hash(path),
+                    "fid": self.filename_to_fid.get(filename)
+                }
+        return manifest
+
+    # -------------------------------------------------------------------------
+
+    # Select the types for the common types header
+    # @files: ids.json files dumped with --dump-ids (the types used by at least the threshold
+    #         fraction of them are selected) or JSON lists of type ids or names (always selected)
+    def _select_common_types(self, files, threshold):
+        selected = set()
+        type_counts = {}
+        dumps = 0
+        for path in files:
+            with open(path, "r") as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                dumps += 1
+                for t_id in set(data["types"]):
+                    type_counts[t_id] = type_counts.get(t_id, 0) + 1
+                continue
+            for item in data:
+                if isinstance(item, str):
+                    t = self.init.find_type_by_name(item)
+                    if t is None:
+                        logging.warning(f"Common type {item} not found in the db")
+                        continue
+                    item = t["id"]
+                selected.add(item)
+
+        for t_id, count in type_counts.items():
+            if count >= threshold * dumps:
+                selected.add(t_id)
+        logging.info(f"Selected {len(selected)} common types from {len(files)} files")
+        return sorted(selected)
+
+    # -------------------------------------------------------------------------
+
+    # Make aot.h use the common types header; the header is created if it doesn't exist
+    def _prepare_common_types(self):
+        db_identity = ArtifactCache.get_file_identity(self.db)
+        if db_identity is None:
+            logging.warning("The common types header requires the --db image file, not using it")
+            return
+
+        path = self.common_types_header
+        if not os.path.isfile(f"{path}.json"):
+            if len(self.common_types) == 0:
+                logging.warning(f"Common types header {path} doesn't exist and no types were given to create it")
+                return
+            type_ids = self._select_common_types(self.common_types, self.common_types_threshold)
+            self.otgen.create_common_types_header(path, type_ids, db_identity)
+        self.otgen.load_common_types_header(path, db_identity)
+
+    # -------------------------------------------------------------------------
+
+    # Get the directory the off-target ends up in; in the incremental mode that's
+    # the user-supplied output directory rather than the staging one
+    def get_output_dir(self):
+        if self.final_out_dir is not None:
+            return self.final_out_dir
+        return self.out_dir
+
+    # -------------------------------------------------------------------------
+
+    # In the incremental mode, move the files that changed from the staging
+    # directory to the output directory; the unchanged files are left intact
+    # so that their modification times are preserved
+    def sync_incremental_output(self):
+        if self.final_out_dir is None:
+            if self.incremental:
+                with open(f"{self.out_dir}/{Engine.MANIFEST_FILE}", "w") as file:
+                    json.dump(self._create_manifest(self.out_dir), file, indent=1)
+            return
+
+        old_manifest = {}
+        manifest_path = f"{self.final_out_dir}/{Engine.MANIFEST_FILE}"
+        if os.path.isfile(manifest_path):
+            with open(manifest_path, "r") as file:
+                old_manifest = json.load(file)
+
+        manifest = self._create_manifest(self.out_dir)
+        changed = 0
+        for filename, entry in manifest.items():
+            src = os.path.join(self.out_dir, filename)
+            dst = os.path.join(self.final_out_dir, filename)
+            if os.path.lexists(dst) and os.path.islink(src) == os.path.islink(dst):
+                if filename in old_manifest:
+                    old_hash = old_manifest[filename]["hash"]
+                else:
+                    old_hash = self._get_file_hash(dst)
+                if old_hash == entry["hash"]:
+                    continue
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            os.replace(src, dst)
+            changed += 1
+            logging.info(f"Incremental mode: updated {filename}")
+
+        # remove the files we generated previously but not this time
+        removed = 0
+        for filename in old_manifest:
+            if filename not in manifest:
+                path = os.path.join(self.final_out_dir, filename)
+                if os.path.lexists(path):
+                    os.remove(path)
+                    removed += 1
+
+        with open(manifest_path, "w") as file:
+            json.dump(manifest, file, indent=1)
+        shutil.rmtree(self.out_dir)
+        logging.info(
+            f"Incremental mode: {changed} files updated, {len(manifest) - changed} unchanged, {removed} removed")
+        self.out_dir = self.final_out_dir
+
+    # -------------------------------------------------------------------------
+
+    # Stream the generated source file to the output directory
+    # The file is stored under its real name if use_real_filenames is set;
+    # the static globals init markers are recorded so that they can be patched
+    # once the globals init code is generated.
+    def _store_src_file(self, filename, contents, filename_to_fid):
+        base_files = [ "aot.c", "aot.h" ]
+        dst_filename = filename
+        if self.use_real_filenames and filename not in base_files:
+            fid = filename_to_fid[filename]
+
+            real_name = os.path.basename(self.dbops.srcidmap[fid])
+            if "_stub" in filename:
+                suffix = real_name[real_name.rfind("."):]
+                real_name = real_name[:real_name.rfind(".")] + "_stub" + suffix
+
+            suffix_index = real_name.rfind(".")
+            suffix = real_name[suffix_index:]
+            real_name = real_name[:suffix_index] + f"_{fid}" + suffix
+
+            if real_name in self.real_names:
+                i = 2
+                tmp = real_name
+                while (tmp in self.real_names):
+                    tmp = f"{i}_{real_name}"
+                    i += 1
+                real_name = tmp
+            self.real_names.add(real_name)
+            dst_filename = real_name
+            del filename_to_fid[filename]
+            filename_to_fid[dst_filename] = fid
+
+        self.dst_filenames[filename] = dst_filename
+        self.out_sink.write(dst_filename, contents,
+                            [OTGenerator.AOT_STATIC_GLOBS_MARKER, OTGenerator.AOT_STATIC_GLOBS_FPTRS])
+
+    # -------------------------------------------------------------------------
+
+    # Format the given files in the output directory with clang-format
+    # The files are formatted concurrently by up to format_jobs clang-format processes,
+    # the largest files go first so that they don't end up as the tail of the run.
+    # If format_cache is set, the formatted contents are stored there under the hash
+    # of the clang-format version, the style and the unformatted contents and reused on the next runs.
+    def _format_files(self, clang_format, filenames):
+        files = []
+        for filename in filenames:
+            path = f"{self.out_dir}/{filename}"
+            try:
+                file_size = os.path.getsize(path)
+            except FileNotFoundError:
+                continue
+            if file_size <= self.CLANG_FORMAT_SIZE_LIMIT:
+                files.append((file_size, path))
+            else:
+                logging.info(f"Skipping formatting of {filename}: {file_size} bytes is over the limit")
+        files.sort(key=lambda f: f[0], reverse=True)
+
+        version = b""
+        styles = {}
+        if self.format_cache is not None:
+            os.makedirs(self.format_cache, exist_ok=True)
+            # the formatting depends on the clang-format version
+            version = subprocess.run([clang_format, "--version"], capture_output=True).stdout
+            # and on the style resolved for the files, i.e. the .clang-format file found up the directory tree
+            for _, path in files:
+                dirname = os.path.dirname(path)
+                if dirname not in styles:
+                    styles[dirname] = subprocess.run([clang_format, "--dump-config", path],
+                                                     capture_output=True).stdout
+
+        def format_file(path):
+            start = time.time()
+            cache_path = None
+            if self.format_cache is not None:
+                with open(path, "rb") as f:
+                    digest = hashlib.sha256(version + styles[os.path.dirname(path)] + f.read()).hexdigest()
+                cache_path = f"{self.format_cache}/{digest}"
+                if os.path.isfile(cache_path):
+                    shutil.copyfile(cache_path, path)
+                    return path, True, time.time() - start
+            ret = subprocess.run([clang_format, "-i", path])
+            if ret.returncode != 0:
+                # don't store the unformatted contents in the cache
+                logging.warning(f"clang-format failed on {path} with code {ret.returncode}")
+            elif cache_path is not None:
+                shutil.copyfile(path, f"{cache_path}.tmp")
+                os.replace(f"{cache_path}.tmp", cache_path)
+            return path, False, time.time() - start
+
+        logging.info(f"Formatting {len(files)} files with {self.format_jobs} clang-format processes")
+        start = time.time()
+        cache_hits = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.format_jobs) as executor:
+            for path, cached, elapsed in executor.map(format_file, [path for _, path in files]):
+                if cached:
+                    cache_hits += 1
+                logging.info(f"Formatted {path} in {elapsed:.3f}s{' (cached)' if cached else ''}")
+        logging.info(f"Formatting done in {time.time() - start:.3f}s, {cache_hits} files taken from the cache")
+
+    # -------------------------------------------------------------------------
+
+    # Analyze the types required by the source files in a pool of forked workers
+    # @jobs: a list of (fid, functions, globals, stubs) tuples
+    # Returns a map from fid to the file types data expected by _create_src_file;
+    # the map is empty when running with a single job.
+    # The code itself is generated serially afterwards, as the code generator keeps
+    # counters (e.g. for unrolled macros) that make the output order-dependent.
+    def _get_src_files_types(self, jobs):
+        global _worker_otgen
+
+        if self.jobs <= 1 or len(jobs) <= 1:
+            return {}
+
+        logging.info(f"Analyzing {len(jobs)} source files with {self.jobs} processes")
+        _worker_otgen = self.otgen
+        try:
+            with multiprocessing.get_context("fork").Pool(self.jobs) as pool:
+                results = pool.map(_get_src_file_types_worker, jobs, chunksize=1)
+        finally:
+            _worker_otgen = None
+
+        return {job[0]: result for job, result in zip(jobs, results)}
+
+    # -------------------------------------------------------------------------
+
     # @depth: if 0, considers only functions from the same directory as
     #         the function of interest, if 1 consider also functions
     #         from 1 dir up, etc.
@@ -683,18 +1008,24 @@ class Engine:
         self.otgen._generate_static_inline_headers(
             set(self.static_and_inline_funcs.keys()))
 
+        emission_start = time.process_time()
         all_global_ids = set()
         filename_to_fid = {}
+        src_jobs = []
+        for fid, file in files.items():
+            for id in self.otgen.static_inline_headers:
+                if id in file.funcs:
+                    file.funcs.remove(id)
+            if len(file.funcs) != 0 or len(file.globals) != 0:
+                src_jobs.append((fid, file.funcs, file.globals, False))
+        src_files_types = self._get_src_files_types(src_jobs)
+
         for fid, file in files.items():
             logging.info("Generating file {} of {}".format(i, fileno))
             i += 1
             funcs = file.funcs
             globs = file.globals
 
-            for id in self.otgen.static_inline_headers:
-                if id in funcs:
-                    funcs.remove(id)
-
             if len(funcs) == 0 and len(globs) == 0:
                 logging.info("This file is empty: skipping")
                 continue
@@ -704,24 +1035,24 @@ class Engine:
             # generate source file
             if fid in static_files:
                 str_header, str_file, filename, func_ids, globals_ids, types, internal_defs = self.otgen._create_src_file(
-                    fid, funcs, globs, includes, static_files[fid].funcs)
+                    fid, funcs, globs, includes, static_files[fid].funcs, file_types=src_files_types.get(fid))
                 all_global_ids |= globals_ids
                 self.otgen.set_fid_to_filename(fid, filename)
                 self.sources_to_types[filename] = types
-                self.file_contents[filename] = str_file
                 filename_to_fid[filename] = int(fid)
+                self._store_src_file(filename, str_file, filename_to_fid)
                 static_files[fid].types = types
                 static_files[fid].filename = filename
                 static_files[fid].globals = globals_ids
                 static_files[fid].funcs = func_ids
             else:
                 str_header, str_file, filename, func_ids, globals_ids, types, internal_defs = self.otgen._create_src_file(
-                    fid, funcs, globs, includes, [])
+                    fid, funcs, globs, includes, [], file_types=src_files_types.get(fid))
                 all_global_ids |= globals_ids
                 self.otgen.set_fid_to_filename(fid, filename)
                 self.sources_to_types[filename] = types
-                self.file_contents[filename] = str_file
                 filename_to_fid[filename] = int(fid)
+                self._store_src_file(filename, str_file, filename_to_fid)
                 files[fid].types = types
                 files[fid].filename = filename
                 files[fid].globals = globals_ids
@@ -730,6 +1061,13 @@ class Engine:
 
         self.cutoff.external_funcs = self.deps._filter_out_builtin_functions(
             self.cutoff.external_funcs)
+        stub_jobs = []
+        for fid, file in stub_files.items():
+            funcs_copy = [f_id for f_id in file.funcs if f_id not in self.otgen.static_inline_headers]
+            if len(funcs_copy) != 0:
+                stub_jobs.append((f'{fid}', funcs_copy, [], True))
+        stub_files_types = self._get_src_files_types(stub_jobs)
+
         for fid, file in stub_files.items():
             funcs_copy = file.funcs.copy()
             for f_id in file.funcs:
@@ -739,10 +1077,10 @@ class Engine:
                 logging.info("This stub file is empty: skipping")
                 continue
             str_header, str_file, filename, func_ids, globals_ids, types, internal_defs = self.otgen._create_src_file(
-                f'{fid}', funcs_copy, [], [], [], stubs=True)
+                f'{fid}', funcs_copy, [], [], [], stubs=True, file_types=stub_files_types.get(f'{fid}'))
             self.sources_to_types[filename] = types
-            self.file_contents[filename] = str_file
             filename_to_fid[filename] = int(fid)
+            self._store_src_file(filename, str_file, filename_to_fid)
             all_global_ids |= globals_ids
             sources.append(filename)
             stub_files[fid].types = types
@@ -763,7 +1101,7 @@ class Engine:
             str_header, str_file, filename, globals_ids, types, internal_defs = self.otgen._create_test_driver(
                 function_ids, static_functions, all_global_ids)
             self.sources_to_types[filename] = types
-            self.file_contents[filename] = str_file
+            self._store_src_file(filename, str_file, filename_to_fid)
 
             # generate data init for the static globals
             known_type_names = set()
@@ -823,7 +1161,7 @@ class Engine:
                     self.init.add_global_init_data(g['name'], g['id'], init_data)
 
                     if filename not in contents_to_change:
-                        contents_to_change[filename] = ""
+                        contents_to_change[filename] = CodeBuffer()
                     contents_to_change[filename] += tmp_str
 
                     if len(self.init.fpointer_stubs):
@@ -833,20 +1171,17 @@ class Engine:
                             filename_to_fpointer_stubs[filename].append(stub)
 
             for filename in contents_to_change:
-                contents = self.file_contents[filename]
-                _str = contents_to_change[filename]
+                _str = contents_to_change[filename].getvalue()
                 if len(_str) > 0:
-                    _str = _str.replace("\n", "\n\t")
-                    contents = contents.replace(
-                        OTGenerator.AOT_STATIC_GLOBS_MARKER, _str)
+                    replacements = {}
+                    replacements[OTGenerator.AOT_STATIC_GLOBS_MARKER] = _str.replace("\n", "\n\t")
                     if filename in filename_to_fpointer_stubs:
                         _str = ""
                         stubs = filename_to_fpointer_stubs[filename]
                         for stub in stubs:
                             _str += f"{stub}\n\n"
-                        contents = contents.replace(
-                            OTGenerator.AOT_STATIC_GLOBS_FPTRS, _str)
-                    self.file_contents[filename] = contents
+                        replacements[OTGenerator.AOT_STATIC_GLOBS_FPTRS] = _str
+                    self.out_sink.patch(self.dst_filenames[filename], replacements)
 
             self.deps.capture_literals(
                 all_global_ids, self.cutoff.internal_funcs)
@@ -1065,6 +1400,8 @@ class Engine:
         # self.include_std_headers = [ f"<{h}>" for h in self.include_std_headers ]
         self.deps._filter_out_builtin_functions(self.otgen.all_funcs)
         self.deps._filter_out_replacement_functions(self.otgen.all_funcs)
+        if self.common_types_header:
+            self._prepare_common_types()
         str_header, str_file, filename, func_ids, globals_ids, types, internal_defs = self.otgen._create_src_file(
             OTGenerator.AOT_HEADER_ID, self.otgen.all_funcs, all_global_ids, [], static_functions, create_header=True)
         if self.dynamic_init:
@@ -1078,61 +1415,33 @@ class Engine:
 
         # we take the Makefile from resources directory
 
-        # store file contents to disk
-        real_names = set()
-        base_files = [ "aot.c", "aot.h" ]
-        for filename in self.file_contents:
-            contents = self.file_contents[filename]
-            dst_filename = filename
-            if self.use_real_filenames and filename not in base_files:
-                fid = filename_to_fid[filename]
-                
-                real_name = os.path.basename(self.dbops.srcidmap[fid])
-                if "_stub" in filename:
-                    suffix = real_name[real_name.rfind("."):]
-                    real_name = real_name[:real_name.rfind(".")] + "_stub" + suffix
-                
-                suffix_index = real_name.rfind(".")
-                suffix = real_name[suffix_index:]
-                real_name = real_name[:suffix_index] + f"_{fid}" + suffix
-                
-
-                if real_name in real_names:
-                    i = 2
-                    tmp = real_name
-                    while (tmp in real_names):
-                       tmp = f"{i}_{real_name}"
-                       i += 1
-                    real_name = tmp
-                    real_names.add(real_name)
-                else:
-                    real_names.add(real_name)
-                dst_filename = real_name
-                del filename_to_fid[filename]
-                filename_to_fid[dst_filename] = fid
+        # the source files were already stored to disk by the output sink
+        logging.info(f"Output sink: {self.out_sink.get_stats()}")
+        self.codegen.store_unrolled_macro_cache()
+        if self.codegen.artifact_cache is not None:
+            self.codegen.artifact_cache.store()
+            self.codegen.artifact_cache.report()
+        logging.info(
+            f"AOT_EMISSION_CPU_SECONDS: |{time.process_time() - emission_start}|")
+        logging.info(
+            f"AOT_PEAK_RSS_KB: |{resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}|")
 
-            with open(f"{self.out_dir}/{dst_filename}", "a+") as file:
-                file.write(contents)
-        
         with open(f"{self.out_dir}/file_to_fid.json", "w") as file:
             json.dump(filename_to_fid, file)
+        self.filename_to_fid = filename_to_fid
 
         # try to pretty-print the files
         clang_format = shutil.which("clang-format")
         if clang_format is not None:
             logging.info("Will format files with clang-format")
-            to_format = ['aot.c']
-            for filename in to_format:
-                filename = f"{self.out_dir}/{filename}"
-                try:
-                    file_size = os.path.getsize(filename)
-                except FileNotFoundError:
-                    continue
-                if file_size <= self.CLANG_FORMAT_SIZE_LIMIT:
-                    subprocess.run(["clang-format", "-i", filename])
+            if self.format_all:
+                to_format = [f for f in self.out_sink.filenames if f.endswith(".c") or f.endswith(".h")]
+            else:
+                to_format = ['aot.c']
+            self._format_files(clang_format, to_format)
 
         logging.info("Output generated in " + self.out_dir)
-        logging.info(f"AOT_OUT_DIR: {os.path.abspath(self.out_dir)}\n")
+        logging.info(f"AOT_OUT_DIR: {os.path.abspath(self.get_output_dir())}\n")
         if self.smart_init and self.dump_smart_init:
             types = self.dbops.typemap.get_many(self.otgen.all_types)
             # out_name = "smart_init.json"
@@ -1262,8 +1571,7 @@ class Engine:
             with open(os.path.join(self.out_dir, Engine.FUNCTION_POINTER_STUB_FILE_SOURCE), "wt") as f:
                 fstub_decls_out = "\n".join(["extern int (*%s)(void);" % (fstub)
                                             for fstub, fstub_id in self.codegen.function_pointer_stubs.items()])
-                fstubs_out = "\n".join(["  { %s, (void**)&%s }," % (
-                    self.codegen._get_function_kernel_name(fstub, fstub_id), fstub) for fstub, fstub_id in self.codegen.function_pointer_stubs.items()])
+                fstubs_out = "\n".join(self.codegen._get_function_pointer_stub_entries())
                 flib_stubs = "\n".join(
                     ["%s" % (flibstub) for flibstub, flibstub_id in self.codegen.lib_function_pointer_stubs])
                 fstub_init_decls = "\n".join([f" __attribute__((weak)) void init_{x}() {{}}" for x in self.otgen.global_trigger_name_list])
@@ -1316,11 +1624,25 @@ class Engine:
                 f"File with always included functions not found {args.always_inc_funcs_file}")
             return False
 
+        if args.dynamic_init_lazy and args.snapshot_globals:
+            # the lazily initialized globals live in their own section, outside of the snapshot
+            logging.error("--dynamic-init-lazy can't be used together with --snapshot-globals")
+            return False
+
         return True
 
 # ------------------------------------------------------------------------------
 
 
+def _non_negative_int(value):
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"{value} is not a non-negative integer")
+    return number
+
+# ------------------------------------------------------------------------------
+
+
 def prepare_parser(*db_frontends):
     parser = argparse.ArgumentParser(
         description='Auto off-target generator: "Select a function, generate a program, test a subsystem®"', conflict_handler="resolve")
@@ -1399,6 +1721,9 @@ def prepare_parser(*db_frontends):
                         help="When used, initialization code will be generated")
     parser.add_argument("--dynamic-init", action="store_true",
                         help="When used, dynamic initialization code will be generated (this can be used along the '--init' option to improve the static initialization)")
+    parser.add_argument("--dynamic-init-lazy", action="store_true",
+                        help="Used with '--dynamic-init': the globals are initialized from the KFLAT image on their first access " +
+                        "instead of all at once at startup (not compatible with '--snapshot-globals')")
     parser.add_argument("--kflat-img", default=OTGenerator.KFLAT_IMAGE_NAME,
                         help="The name of the KFLAT image file.")
     parser.add_argument("--used-types-only", action='store_true',
@@ -1448,6 +1773,10 @@ def prepare_parser(*db_frontends):
                         help="When the smart init mechanism finds more than one way to initialize, do not generate other options.")
     parser.add_argument("--unroll-macro-defs", action="store_true",
                         help="When generating function code unroll all expanded code that comes from macro invocations")
+    parser.add_argument("--artifact-cache", default=None,
+                        help="A directory in which the generated function stubs are cached across runs on the same database")
+    parser.add_argument("--unroll-macro-cache", default=None,
+                        help="A JSON file in which the function bodies with unrolled macros are cached by the function hash (used with --unroll-macro-defs)")
     parser.add_argument("--use-real-filenames", action="store_true",
                         help="When generating OT code use real file names rather than the file_<ID> scheme.")
     parser.add_argument("--no-main-function-calls", action="store_true",
@@ -1456,6 +1785,35 @@ def prepare_parser(*db_frontends):
                         help="Dump smart init data into the specified JSON file")
     parser.add_argument("--load-init", default=None,
                         help="Load smart init data from the specified JSON file")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="The number of processes used to analyze the types needed by the generated source files")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Allow regenerating the off-target into an existing output directory; only the files that changed are rewritten")
+    parser.add_argument("--format-all", action="store_true",
+                        help="Format all the generated .c and .h files with clang-format, not only aot.c")
+    parser.add_argument("--format-jobs", type=int, default=os.cpu_count(),
+                        help="The number of clang-format processes run concurrently")
+    parser.add_argument("--format-cache", default=None,
+                        help="A directory in which the files formatted with clang-format are cached by their contents hash")
+    parser.add_argument("--max-literals", type=_non_negative_int, default=None,
+                        help=f"The maximum number of the most frequently used literals stored in the {Deps.AOT_LITERALS_FILE} fuzzing dictionary")
+    parser.add_argument("--common-types-header", default=None,
+                        help="A header with the definitions of the types shared by the off-targets generated from the same database; " +
+                        "it is included in aot.h and created if it doesn't exist yet")
+    parser.add_argument("--common-types", nargs="+", default=[],
+                        help="JSON files used to select the types for a new common types header: either ids.json files " +
+                        "dumped with --dump-ids for a batch of off-targets or explicit lists of type ids or type names")
+    parser.add_argument("--common-types-threshold", type=float, default=0.5,
+                        help="The fraction of the ids.json files a type has to be present in to be selected for the common types header")
+    parser.add_argument("--alloc-arena", action="store_true",
+                        help="Allocate the memory for the initialized pointers from an arena that aot_GC resets at once " +
+                        "instead of freeing every allocation (useful in the AFL persistent mode)")
+    parser.add_argument("--libfuzzer", action="store_true",
+                        help="Generate the test driver as the LLVMFuzzerInitialize and LLVMFuzzerTestOneInput functions for " +
+                        "in-process fuzzing with libFuzzer (make libfuzzer)")
+    parser.add_argument("--snapshot-globals", action="store_true",
+                        help="Place the non-const globals in a single section, which is saved once and restored before every " +
+                        "iteration of the persistent fuzzing loop (the globals are then not instrumented by ASAN)")
     return parser
 
 
@@ -1512,9 +1870,7 @@ def main():
         if False == engine.init(args, db_frontend):
             sys.exit(1)
 
-        logging.info(f"AOT_OUTPUT_DIR|{engine.out_dir}|")
-
-        sys.setrecursionlimit(10000)
+        logging.info(f"AOT_OUTPUT_DIR|{engine.get_output_dir()}|")
 
         funs = args.functions
         logging.info("Will generate off-target for functions {}".format(funs))
@@ -1546,6 +1902,9 @@ def main():
         # move the log to the output dir
         shutil.move(logname, f"{args.output_dir}/{Engine.LOGFILE}")
 
+        if retcode == 0:
+            engine.sync_incremental_output()
+
         sys.exit(retcode)
 
 
@@ -39,6 +39,14 @@ class AotDbOps:
     TYPES_REFS = 'types_tree_refs'
     TYPES_USEDREFS = 'types_tree_usedrefs'
     GLOBS_GLOBALREFS = 'globs_tree_globalrefs'
+    FUNCS_FILE_INFO = 'funcs_file_info'
+    SRC_IDS = 'src_ids'
+    DIR_IDS = 'dir_ids'
+    MODS_IDS = 'mods_ids'
+    DIRS = 'dirs'
+    MODS = 'mods'
+    NO_SUCH_FILE = '/tmp/no_such_file'
+    NO_SUCH_MOD = '/tmp/no_such_mod'
 
     # #db: AotDBFrontend instance
     def __init__(self, db, deps, args):
@@ -103,6 +111,15 @@ class AotDbOps:
         # for a given global get all globals (ids) it depends on
         self.globs_tree_globalrefs = None
 
+        # the fourth group are per-function arrays (indexed by function id) with the data
+        # needed by the cut-off; directories and sets of modules are interned, i.e. the arrays
+        # store their indices in dir_names and mod_sets respectively
+        self.fid_to_src_id = None   # get source file id by function id (-1 if unknown)
+        self.fid_to_dir_id = None   # get source directory id by function id
+        self.fid_to_mods_id = None  # get module set id by function id
+        self.dir_names = None
+        self.mod_sets = None
+
         self.graph_dfs_cache = dict()
 
     def __getitem__(self, key):
@@ -282,6 +299,12 @@ class AotDbOps:
         self.globs_tree_globalrefs = self._create_recursive_cache(
             globs, len(globs), "id", "globalrefs", AotDbOps.GLOBS_GLOBALREFS, set())
 
+        bas_data = None
+        if rdm_file is not None:
+            with open(rdm_file, "r") as f:
+                bas_data = json.load(f)
+        self._create_funcs_file_info(json_data, bas_data, funcs_size)
+
         if self.fptr_analysis:
             # preprocess list of all possible functions assigned to function pointers
             logging.info("Pre-procesing function pointers information")
@@ -333,15 +356,12 @@ class AotDbOps:
                 data = [self.init_data[x] for x in self.init_data]
                 self.db.store_many_in_collection("init_data", data)
 
-        if rdm_file is not None:
-            with open(rdm_file, "r") as f:
-                bas_data = json.load(f)
-
-                items = []
-                for loc, entries in bas_data.items():
-                    items.append({"loc": loc, "entries": entries})
+        if bas_data is not None:
+            items = []
+            for loc, entries in bas_data.items():
+                items.append({"loc": loc, "entries": entries})
 
-                self.db.store_many_in_collection("BAS", items)
+            self.db.store_many_in_collection("BAS", items)
 
     def create_indices(self):
         # create db indices as in ctypelib
@@ -462,6 +482,11 @@ class AotDbOps:
             extra_field_name=None, cache_size=100000
         )
 
+        if self.db_type == aotdb.DbType.FTDB and AotDbOps.FUNCS_FILE_INFO in self.db.db:
+            self._load_funcs_file_info()
+        else:
+            logging.info("Functions file info not found in the db - it will be computed on demand")
+
     # -------------------------------------------------------------------------
 
     def get_cache_matrix(self, name):
@@ -547,6 +572,72 @@ class AotDbOps:
 
     # -------------------------------------------------------------------------
 
+    # For each function compute the id of its source file, the id of the source directory and the id
+    # of the set of modules the function is compiled into (according to BAS data); this is static
+    # per database so we do it once, during the import
+    def _create_funcs_file_info(self, json_data, bas_data, size):
+        logging.info("Creating functions file info")
+
+        src_names = {}
+        for item in json_data["sources"]:
+            for name, src_id in item.items():
+                src_names[src_id] = name
+
+        # unresolved functions are neither in any file nor in any module
+        dirs = {AotDbOps.NO_SUCH_FILE: 0}
+        mods = {(AotDbOps.NO_SUCH_MOD,): 0}
+        src_ids = [-1] * size
+        dir_ids = [0] * size
+        mods_ids = [0] * size
+
+        # funcs go last as they take precedence over funcdecls (see _get_function_file)
+        for f in json_data["funcdecls"] + json_data["funcs"]:
+            f_id = f["id"]
+            src_id = f["fid"]
+            src = src_names.get(src_id)
+            loc = f["location"].partition(":")[0]
+
+            entries = []
+            if bas_data is not None and loc in bas_data:
+                entries = bas_data[loc]
+            mods_key = tuple(sorted(set(entries)))
+            if mods_key not in mods:
+                mods[mods_key] = len(mods)
+            mods_ids[f_id] = mods[mods_key]
+
+            if src is not None:
+                src_ids[f_id] = src_id
+                dir = os.path.dirname(src)
+                if dir not in dirs:
+                    dirs[dir] = len(dirs)
+                dir_ids[f_id] = dirs[dir]
+            else:
+                src_ids[f_id] = -1
+                dir_ids[f_id] = 0
+
+        logging.info(f"Functions file info created with {len(dirs)} dirs and {len(mods)} module sets")
+
+        collection_name = AotDbOps.FUNCS_FILE_INFO
+        self.db.store_in_collection(collection_name, {"name": AotDbOps.SRC_IDS, "data": src_ids})
+        self.db.store_in_collection(collection_name, {"name": AotDbOps.DIR_IDS, "data": dir_ids})
+        self.db.store_in_collection(collection_name, {"name": AotDbOps.MODS_IDS, "data": mods_ids})
+        self.db.store_in_collection(collection_name, {"name": AotDbOps.DIRS, "data": list(dirs)})
+        self.db.store_in_collection(collection_name, {"name": AotDbOps.MODS, "data": [list(m) for m in mods]})
+
+    # -------------------------------------------------------------------------
+
+    def _load_funcs_file_info(self):
+        logging.info("Loading functions file info")
+        index = self.db.create_local_index(AotDbOps.FUNCS_FILE_INFO, "name")
+
+        self.fid_to_src_id = np.array(index[AotDbOps.SRC_IDS]["data"], dtype=np.int32)
+        self.fid_to_dir_id = np.array(index[AotDbOps.DIR_IDS]["data"], dtype=np.int32)
+        self.fid_to_mods_id = np.array(index[AotDbOps.MODS_IDS]["data"], dtype=np.int32)
+        self.dir_names = list(index[AotDbOps.DIRS]["data"])
+        self.mod_sets = [frozenset(m) for m in index[AotDbOps.MODS]["data"]]
+
+    # -------------------------------------------------------------------------
+
     @staticmethod
     def _calculate_graph_dfs(csr_matrix, item):
         nodes = depth_first_order(
@@ -841,6 +932,19 @@ class AotDbOps:
 
     # -------------------------------------------------------------------------
 
+    def _get_function_file_id(self, function_id):
+        if self.fid_to_src_id is not None and function_id < len(self.fid_to_src_id):
+            src_id = int(self.fid_to_src_id[function_id])
+            return src_id if src_id != -1 else None
+
+        if function_id in self.fnidmap:
+            return self.fnidmap[function_id]["fid"]
+        elif function_id in self.fdmap:
+            return self.fdmap[function_id]["fid"]
+        return None
+
+    # -------------------------------------------------------------------------
+
     def _get_function_name(self, function_id):
         if function_id in self.fnidmap:
             return self.fnidmap[function_id]["name"]
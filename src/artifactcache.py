@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+# Auto off-target PoC
+###
+# Copyright  Samsung Electronics
+# Samsung Mobile Security Team @ Samsung R&D Poland
+
+#
+# Generated artifacts cache module
+#
+# Off-targets generated from the same database share most of their code: the
+# same function stubs are emitted over and over. The cache stores such code
+# fragments on disk, addressed by the kind of the fragment, the id of the entity
+# it was generated for and any additional generation context. All the fragments
+# generated for the same database and the same code generation options are kept
+# in a single file, which is read once when the cache is first used and written
+# back at the end of the run, so a lookup is just a dictionary access.
+#
+# The function bodies and the type definitions are not cached: they are taken
+# from the database almost as they are (the body is already fetched to check the
+# function exists), so even loading them from a single file is slower than
+# generating them again.
+#
+
+import hashlib
+import json
+import logging
+import os
+
+
+class ArtifactCache:
+
+    # bump whenever the format of the cached fragments changes
+    VERSION = 2
+
+    STUB = "stub"
+
+    def __init__(self, cache_dir, db_identity, options):
+        self.cache_dir = cache_dir
+        digest = hashlib.sha256(json.dumps([ArtifactCache.VERSION, db_identity, options]).encode()).hexdigest()
+        self.path = os.path.join(self.cache_dir, f"{digest}.json")
+        # kind -> key -> fragment; loaded on the first use
+        self.fragments = None
+        # the fragments generated in this run, see store()
+        self.new_fragments = {}
+
+        self.lookups = 0
+        self.hits = 0
+        self.stored = 0
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    # -------------------------------------------------------------------------
+
+    # Get the identity of a file the generated code depends on (e.g. db.img):
+    # it changes whenever the file is modified
+    @staticmethod
+    def get_file_identity(path):
+        if path is None or not os.path.isfile(path):
+            return None
+        path = os.path.realpath(path)
+        st = os.stat(path)
+        return [path, st.st_size, st.st_mtime_ns]
+
+    # -------------------------------------------------------------------------
+
+    @staticmethod
+    def _get_key(entity_id, context):
+        if context is None:
+            return str(entity_id)
+        return f"{entity_id}:{json.dumps(context)}"
+
+    # -------------------------------------------------------------------------
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            logging.warning(f"Ignoring the corrupted artifact cache file {self.path}")
+            return {}
+
+    # -------------------------------------------------------------------------
+
+    # Get the cached fragment or None if there is none
+    # @context: anything (JSON-serializable) apart from the entity id the fragment depends on
+    def get(self, kind, entity_id, context=None):
+        if self.fragments is None:
+            self.fragments = self._load()
+        self.lookups += 1
+        fragment = self.fragments.get(kind, {}).get(ArtifactCache._get_key(entity_id, context))
+        if fragment is not None:
+            self.hits += 1
+        return fragment
+
+    # -------------------------------------------------------------------------
+
+    def put(self, kind, entity_id, value, context=None):
+        if self.fragments is None:
+            self.fragments = self._load()
+        key = ArtifactCache._get_key(entity_id, context)
+        self.fragments.setdefault(kind, {})[key] = value
+        self.new_fragments.setdefault(kind, {})[key] = value
+        self.stored += 1
+
+    # -------------------------------------------------------------------------
+
+    # Write the fragments generated in this run back to the cache file
+    def store(self):
+        if not self.new_fragments:
+            return
+        # merge with the fragments stored by the runs that finished in the meantime
+        fragments = self._load()
+        for kind, values in self.new_fragments.items():
+            fragments.setdefault(kind, {}).update(values)
+        # write to a private file first so that concurrent runs never see partial contents
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(fragments, f)
+        os.replace(tmp_path, self.path)
+        self.new_fragments = {}
+
+    # -------------------------------------------------------------------------
+
+    def get_stats(self):
+        hit_rate = 100 * self.hits / self.lookups if self.lookups else 0
+        return f"{self.hits}/{self.lookups} hits ({hit_rate:.1f}%), {self.stored} fragments stored"
+
+    # -------------------------------------------------------------------------
+
+    def report(self):
+        logging.info(f"Artifact cache: {self.get_stats()}")
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+# Auto off-target PoC
+###
+# Copyright  Samsung Electronics
+# Samsung Mobile Security Team @ Samsung R&D Poland
+
+#
+# Code buffer module
+#
+# The generators build the off-target sources fragment by fragment. Appending
+# to an ever-growing string copies it each time, so the fragments are collected
+# in a list instead and joined once when the code is complete.
+#
+
+
+class CodeBuffer:
+
+    def __init__(self, text=""):
+        self.parts = []
+        self.size = 0
+        self.append(text)
+
+    # -------------------------------------------------------------------------
+
+    def append(self, text):
+        if text:
+            self.parts.append(text)
+            self.size += len(text)
+        return self
+
+    # allows the generators to keep using the 'code += fragment' idiom
+    __iadd__ = append
+
+    # -------------------------------------------------------------------------
+
+    def extend(self, texts):
+        for text in texts:
+            self.append(text)
+        return self
+
+    # -------------------------------------------------------------------------
+
+    # Append a block of code with each of its lines indented by @indent
+    def append_indented(self, text, indent="\t"):
+        return self.append(indent + text.replace("\n", f"\n{indent}"))
+
+    # -------------------------------------------------------------------------
+
+    # Get a position in the buffer that can later be used with insert()
+    def mark(self):
+        return len(self.parts)
+
+    # -------------------------------------------------------------------------
+
+    # Insert text at the position previously returned by mark();
+    # note that this shifts the positions of the marks taken after this one
+    def insert(self, mark, text):
+        if text:
+            self.parts.insert(mark, text)
+            self.size += len(text)
+        return self
+
+    # -------------------------------------------------------------------------
+
+    def __len__(self):
+        return self.size
+
+    # -------------------------------------------------------------------------
+
+    # Join the fragments into the final code; the marks taken so far
+    # are no longer valid afterwards
+    def getvalue(self):
+        if len(self.parts) > 1:
+            self.parts = ["".join(self.parts)]
+        if len(self.parts) == 0:
+            return ""
+        return self.parts[0]
@@ -17,8 +17,11 @@ import collections
 import difflib
 import bson.json_util
 import re
+import json
 
-from typing import Dict, Iterable, Optional
+from typing import Dict, Iterable, List, Optional
+from codebuffer import CodeBuffer
+from artifactcache import ArtifactCache
 
 class CodeGen:
     # this is a special value returned by function stubs returning a pointer
@@ -26,6 +29,8 @@ class CodeGen:
     # the value needs to be in sync with what we set in fuzz_lib
     AOT_SPECIAL_PTR = 0x40710000
     AOT_SPECIAL_PTR_SEPARATOR = 0x1000
+    # a placeholder for the special pointer in the generated stub code
+    STUB_RETURN_PTR_MARKER = "__AOT_STUB_RETURN_PTR__"
 
     VERIFY_STRUCT_LAYOUT_TEMPLATE = "vlayout.c.template"
     VERIFY_STRUCT_LAYOUT_SOURCE = "vlayout.c"
@@ -45,6 +50,14 @@ class CodeGen:
     );
 """
 
+    # kinds of the unrolled macro template entries
+    UNROLLED_MACRO_CALL = 0
+    UNROLLED_MACRO_SIMPLE = 1
+
+    # type classes for which _generate_var_def is able to emit a definition
+    VAR_DEF_CLASSES = set(["builtin", "typedef", "record", "record_forward", "enum", "enum_forward",
+                           "function", "incomplete_array", "const_array", "pointer", "lv_reference", "vector"])
+
     # {0} - function variable name
     # {1} - function trigger basename
     # {2} - extended root pointer name
@@ -67,6 +80,15 @@ class CodeGen:
         self.generated_functions = 0
         self.generated_stubs = 0
         self.unrolled_simple_macro_counter = 0
+        # the persistent cache of the generated code fragments, if enabled
+        self.artifact_cache = None
+        # function id -> template of the body with unrolled macros (see _get_unrolled_macro_template)
+        self.unrolled_macro_templates = {}
+        self.unrolled_macro_cache_hits = 0
+        # the persistent templates cache (function hash -> template), if loaded
+        self.unrolled_macro_store = None
+        self.unrolled_macro_store_path = None
+        self.unrolled_macro_store_updated = False
         self.struct_types = []
         self.stubs_with_asm = set()
         self.stub_to_return_ptr = {}
@@ -93,6 +115,9 @@ class CodeGen:
     def set_otgen(self, otgen):
         self.otgen = otgen
 
+    def set_artifact_cache(self, artifact_cache):
+        self.artifact_cache = artifact_cache
+
     # Using variable type data and name, generate variable definition
 
     def _generate_var_def(self, type, name):
@@ -273,7 +298,7 @@ class CodeGen:
 
     # @belongs: codegen
     def _get_func_decls(self, fid, functions, static_functions=[], section_header=True):
-        str = ""
+        str = CodeBuffer()
         # if section_header:
         #    str += "\n\n/* ----------------------------- */\n" +\
         #        "/* Function declarations section */\n" +\
@@ -345,12 +370,12 @@ class CodeGen:
 
             str += "{}{};\n".format(body, attributes)
             str += self._get_func_clash_endif(f_id, fid)
-        return str
+        return str.getvalue()
 
     # -------------------------------------------------------------------------
 
     def _flush_function_code(self,func_data_list,common_unrolled_macro_map):
-        str = ""
+        str = CodeBuffer()
         # First flush the common unrolled macro definitions for macros with arguments
         for k,v in common_unrolled_macro_map.items():
             str += f"#define {k} {v}\n\n"
@@ -362,8 +387,10 @@ class CodeGen:
                     str += f"#undef {k}\n"
                 str += f"#define {k} {v}\n"
                 used_simple_macros[k] = v
-            str += "\n" + unrolled_fbody_text + "\n\n"
-        return str
+            str += "\n"
+            str += unrolled_fbody_text
+            str += "\n\n"
+        return str.getvalue()
 
     def _get_unique_unrolled_macro_map(self,unrolled_macro_map):
         unique_unrolled_macro_map = {}
@@ -391,61 +418,122 @@ class CodeGen:
     def _get_unrolled_macro_body(self,f_entry,unrolled_macro_map,common_unrolled_macro_map):
         if not self.args.unroll_macro_defs or len(f_entry["macro_expansions"])<=0:
             return None
-        out_body = ""
-        body_loc = list()
+        pieces,macros,count = self._get_unrolled_macro_template(f_entry)
+        base = self.unrolled_simple_macro_counter
+        for kind,name,text,index,extra in macros:
+            if kind==CodeGen.UNROLLED_MACRO_CALL and f"__macrocall__{name}__{base+index}" in common_unrolled_macro_map: # unlikely
+                logging.warning(f"Duplicated entry in the unrolled macro map: __macrocall__{name}__{base+index}")
+                return None
+        out_body = []
+        for piece in pieces:
+            if isinstance(piece,str):
+                out_body.append(piece)
+                continue
+            kind,name,text,index,extra = macros[piece]
+            if kind==CodeGen.UNROLLED_MACRO_CALL:
+                macro_replacement_name = f"__macrocall__{name}__{base+index}"
+                common_unrolled_macro_map[macro_replacement_name] = text
+                out_body.append(f"{macro_replacement_name}/*({extra})*/")
+            else:
+                if name in unrolled_macro_map:
+                    unrolled_macro_map[name].append((text,base+index))
+                else:
+                    unrolled_macro_map[name] = [(text,base+index)]
+                # simple macros with distinct values get the counter appended
+                out_body.append(f"{name}__{base+index}" if extra else name)
+        self.unrolled_simple_macro_counter+=count
+        out_body = "".join(out_body)
+        # Replace function header from preprocessed body
+        body_header_end = f_entry["body"].find("{")
+        header = f_entry["body"][0:body_header_end]
+        out_body_header_end = out_body.find("{")
+        return header + out_body[out_body_header_end:]
+
+    # Gets the counter-independent template of the function body with unrolled macro definitions
+    # The template is a tuple of:
+    # - the list of body pieces: either the original code or an index in the macro list
+    # - the list of [kind,name,text,index,extra] macro entries; index is the offset from the
+    #   current value of the unrolled macro counter, extra holds the arguments of a macro call
+    #   or tells whether a simple macro has distinct values in the function
+    # - the number of counter values used by the function
+    # The templates are cached per function id and, if the persistent cache is loaded, per function hash
+    def _get_unrolled_macro_template(self,f_entry):
+        template = self.unrolled_macro_templates.get(f_entry["id"])
+        if template is not None:
+            self.unrolled_macro_cache_hits+=1
+            return template
+        f_hash = f_entry["hash"] if self.unrolled_macro_store is not None and "hash" in f_entry else None
+        if f_hash is not None and f_hash in self.unrolled_macro_store:
+            template = self.unrolled_macro_store[f_hash]
+            self.unrolled_macro_cache_hits+=1
+        else:
+            template = self._create_unrolled_macro_template(f_entry)
+            if f_hash is not None:
+                self.unrolled_macro_store[f_hash] = template
+                self.unrolled_macro_store_updated = True
+        self.unrolled_macro_templates[f_entry["id"]] = template
+        return template
+
+    def _create_unrolled_macro_template(self,f_entry):
+        body = f_entry["unpreprocessed_body"]
+        pieces = []
+        macros = []
+        values = {}
         pos = 0
         size = 0
-        for i,mexp_entry in enumerate(f_entry["macro_expansions"]):
+        count = 0
+        for mexp_entry in f_entry["macro_expansions"]:
             npos = mexp_entry["pos"]
             if npos<pos+size:
                 # Ignore overlapping macro expansion entries
                 continue
-            out_body+=f_entry["unpreprocessed_body"][pos+size:npos]
+            if npos>pos+size:
+                pieces.append(body[pos+size:npos])
             pos = npos
             size = mexp_entry["len"]
-            macro_str = f_entry["unpreprocessed_body"][pos:pos+size]
+            macro_str = body[pos:pos+size]
             if mexp_entry["text"]=='':
                 # We just remove a part of the original code
                 continue
             u = macro_str.find('(')
             if u>=0:
-                macro_replacement_name = f"__macrocall__{macro_str[:u].strip()}__{self.unrolled_simple_macro_counter}"
-                macro_replacement_call = f"{macro_replacement_name}/*({macro_str[u+1:-1].replace('/*','|*').replace('*/','*|')})*/"
-                if macro_replacement_name in common_unrolled_macro_map: # unlikely
-                    logging.warning(f"Duplicated entry in the unrolled macro map: {macro_replacement_name}")
-                    return None
-                common_unrolled_macro_map[macro_replacement_name] = mexp_entry["text"]
-                self.unrolled_simple_macro_counter+=1
-                out_body+=macro_replacement_call
+                macro_args = macro_str[u+1:-1].replace('/*','|*').replace('*/','*|')
+                macros.append([CodeGen.UNROLLED_MACRO_CALL,macro_str[:u].strip(),mexp_entry["text"],count,macro_args])
             else:
-                if macro_str in unrolled_macro_map:
-                    unrolled_macro_map[macro_str].append((mexp_entry["text"],self.unrolled_simple_macro_counter))
-                else:
-                    unrolled_macro_map[macro_str] = [(mexp_entry["text"],self.unrolled_simple_macro_counter)]
-                self.unrolled_simple_macro_counter+=1
-                # (location of macro in the body, length of macro string, index of macro string in macro vector)
-                body_loc.append((len(out_body),len(macro_str),len(unrolled_macro_map[macro_str])-1))
-                out_body+=macro_str
-        out_body+=f_entry["unpreprocessed_body"][pos+size:]
-        # Replace macro strings in case of simple macros with distinct values
-        body_shift=0
-        for bloc,mlen,mindex in body_loc:
-            k = out_body[bloc+body_shift:bloc+body_shift+mlen]
-            if len(set([x[0] for x in unrolled_macro_map[k]]))>1:
-                text,cntr = unrolled_macro_map[k][mindex]
-                nk = f"{k}__{cntr}"
-                out_body = out_body[:bloc+body_shift]+nk+out_body[bloc+body_shift+mlen:]
-                body_shift+=len(nk)-mlen
-        # Replace function header from preprocessed body
-        body_header_end = f_entry["body"].find("{")
-        header = f_entry["body"][0:body_header_end]
-        out_body_header_end = out_body.find("{")
-        return header + out_body[out_body_header_end:]
-
+                macros.append([CodeGen.UNROLLED_MACRO_SIMPLE,macro_str,mexp_entry["text"],count,False])
+                values.setdefault(macro_str,set()).add(mexp_entry["text"])
+            pieces.append(len(macros)-1)
+            count+=1
+        pieces.append(body[pos+size:])
+        for macro in macros:
+            if macro[0]==CodeGen.UNROLLED_MACRO_SIMPLE and len(values[macro[1]])>1:
+                macro[4] = True
+        return pieces,macros,count
+
+    # Load the persistent cache of unrolled macro templates keyed by function hash
+    def load_unrolled_macro_cache(self, path):
+        self.unrolled_macro_store_path = path
+        self.unrolled_macro_store = {}
+        if os.path.isfile(path):
+            with open(path, "r") as f:
+                self.unrolled_macro_store = json.load(f)
+            logging.info(f"Loaded {len(self.unrolled_macro_store)} unrolled macro templates from {path}")
+
+    def store_unrolled_macro_cache(self):
+        if not self.args.unroll_macro_defs:
+            return
+        logging.info(f"Unrolled macro templates: {len(self.unrolled_macro_templates)} functions, {self.unrolled_macro_cache_hits} cache hits")
+        if self.unrolled_macro_store is None or not self.unrolled_macro_store_updated:
+            return
+        tmp_path = f"{self.unrolled_macro_store_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.unrolled_macro_store, f)
+        os.replace(tmp_path, self.unrolled_macro_store_path)
+        self.unrolled_macro_store_updated = False
 
     # @belongs: codegen
     def _get_func_defs(self, fid, functions, section_header=True, stubs=False, file=""):
-        str = ""
+        str = CodeBuffer()
         # if section_header:
         #    str += "\n\n/* ----------------------------- */\n" +\
         #        "/* Function definitions section  */\n" +\
@@ -501,7 +589,7 @@ class CodeGen:
                 str += self._get_func_clash_endif(f_id, fid)
                 str += "\n\n"
 
-        return str
+        return str.getvalue()
 
     # -------------------------------------------------------------------------
 
@@ -644,7 +732,7 @@ class CodeGen:
 
         name = function["name"]
 
-        str = "\n// Call site for function '{}'\n".format(name)
+        str = CodeBuffer("\n// Call site for function '{}'\n".format(name))
 
         if create_params:
             # put everything in braces to avoid name collision
@@ -957,7 +1045,7 @@ class CodeGen:
         if create_params:
             str += "}\n"
 
-        return str
+        return str.getvalue()
 
     # -------------------------------------------------------------------------
 
@@ -965,6 +1053,56 @@ class CodeGen:
     # @belongs: codegen
     def _generate_function_stub(self, function_id, stubs_file=False, fpointer_stub=False,
                                 stub_name=None):
+        stub = None
+        cache_context = None
+        if self.artifact_cache is not None and not fpointer_stub:
+            cache_context = [stubs_file, function_id in self.dbops.all_funcs_with_asm]
+            stub = self.artifact_cache.get(ArtifactCache.STUB, function_id, cache_context)
+        if stub is None:
+            stub = self._create_function_stub(function_id, stubs_file, fpointer_stub, stub_name)
+            if stub is None:
+                return ""
+            if cache_context is not None:
+                self.artifact_cache.put(ArtifactCache.STUB, function_id, stub, cache_context)
+
+        # apply the effects of the stub on the state of the generator
+        str = stub["code"]
+        func_name = stub["func_name"]
+        if stub["asm"]:
+            self.stubs_with_asm.add(func_name)
+        if stub["ret_ptr"]:
+            counter = len(self.stub_to_return_ptr)
+            # we return an address from a specially mapped memory region -> see aot_fuzz_lib.c for the details
+            # each function stub returns an address separated by a page size (0x1000)
+            # this is used to recognize which function stub caused a failure (as further offsets might be applied to the
+            # original base address returned by the stub, e.g. ptr = stub(); ptr->member = x;
+            val = CodeGen.AOT_SPECIAL_PTR + \
+                (counter * (2*CodeGen.AOT_SPECIAL_PTR_SEPARATOR))
+            self.stub_to_return_ptr[func_name] = val
+            before, sep, after = str.rpartition(CodeGen.STUB_RETURN_PTR_MARKER)
+            str = before + hex(val) + after
+        if stub["fptr"]:
+            function = self.dbops.fnidmap[function_id]
+            if function is None:
+                function = self.dbops.fdmap[function_id]
+            if function is None:
+                function = self.dbops.umap[function_id]
+            fptr_stub = self._get_function_pointer_stub(function)
+            if fptr_stub:
+                str += fptr_stub + "\n"
+        if stubs_file:
+            self.generated_stubs += 1
+        if not fpointer_stub:
+            return str
+        else:
+            return str, func_name
+
+    # Generate the code of a function stub
+    # Returns a dict with the code and the data needed to apply the stub's effects
+    # on the generator state (see _generate_function_stub) or None if no stub is needed;
+    # the code doesn't depend on that state so that it can be cached
+    # @belongs: codegen
+    def _create_function_stub(self, function_id, stubs_file, fpointer_stub, stub_name):
         function = None
         static = False
         name = stub_name
@@ -990,7 +1128,7 @@ class CodeGen:
                     if function is None:
                         logging.error(
                             f"Can't find function with id {function_id}")
-                        return ""
+                        return None
                     else:
                         t = TYPE_UNRESOLVED
                 else:
@@ -1002,7 +1140,7 @@ class CodeGen:
                 static = True
             if not stubs_file and not static:
                 # non-static functions go to stubs file
-                return ""
+                return None
         else:
             # in this mode we wish to generate a function stub for a function pointer
             t = TYPE_FPOINTER
@@ -1139,9 +1277,10 @@ class CodeGen:
         str += " {\n"
 
         str += "\t// stub implementation\n"
+        asm = False
         if function_id in self.dbops.all_funcs_with_asm:
             str += "\t// note: original function's implementation contains assembly\n"
-            self.stubs_with_asm.add(func_name)
+            asm = True
 
         # and function_id not in self.dbops.all_funcs_with_asm:
         if static and inline != 1 and not stubs_file:
@@ -1157,6 +1296,7 @@ class CodeGen:
                 str += original_fbody.replace("\n", "\n//")
                 str += "\n\t // End of function's original body\n"
 
+        ret_ptr = False
         if return_type is not None:
             orig_return_type = return_type
             orig_cl = return_type["class"]
@@ -1165,12 +1305,6 @@ class CodeGen:
                             "const_array", "incomplete_array", "variable_array"]
             cl = return_type["class"]
             if cl in null_pointer:
-                counter = len(self.stub_to_return_ptr)
-                # we return an address from a specially mapped memory region -> see aot_fuzz_lib.c for the details
-                # each function stub returns an address separated by a page size (0x1000)
-                # this is used to recognize which function stub caused a failure (as further offsets might be applied to the
-                # original base address returned by the stub, e.g. ptr = stub(); ptr->member = x;
-
                 if self.args.stubs_for_klee:
                     # NOTE: for KLEE we do  special trick: in order to mark that the failure is caused by
                     # the user data (i.e. lack of stub), we introduce a dummy symbolic object into constraints
@@ -1183,10 +1317,9 @@ class CodeGen:
                     str += "\t}\n"
                     str += "\t#endif\n"
 
-                val = CodeGen.AOT_SPECIAL_PTR + \
-                    (counter * (2*CodeGen.AOT_SPECIAL_PTR_SEPARATOR))
-                self.stub_to_return_ptr[func_name] = val
-                str += f"\treturn ({self._get_typename_from_type(return_type)}){hex(val)}; // returning a special pointer"
+                # the special pointer value is assigned in _generate_function_stub
+                ret_ptr = True
+                str += f"\treturn ({self._get_typename_from_type(return_type)}){CodeGen.STUB_RETURN_PTR_MARKER}; // returning a special pointer"
                 logging.info("Will generate return statement 1")
             elif cl == "builtin":
                 if return_type["str"] != "void":
@@ -1215,17 +1348,11 @@ class CodeGen:
                 logging.info("Will generate return statement 4")
 
         str += "\n}\n"
+        fptr = False
         if self.args.dynamic_init and (not static or not stubs_file):
             if function is not None and ("inline" not in function or function["inline"] is not True):
-                fptr_stub = self._get_function_pointer_stub(function)
-                if fptr_stub:
-                    str += fptr_stub + "\n"
-        if stubs_file:
-            self.generated_stubs += 1
-        if t != TYPE_FPOINTER:
-            return str
-        else:
-            return str, func_name
+                fptr = True
+        return {"code": str, "func_name": func_name, "asm": asm, "ret_ptr": ret_ptr, "fptr": fptr}
 
     # -------------------------------------------------------------------------
 
@@ -1294,6 +1421,22 @@ class CodeGen:
         modules_list = set(modules_names) # filter out duplicates
         return produce_output(symbol_name, modules_list)
 
+    # -------------------------------------------------------------------------
+
+    # Generates the entries of the fptr_stub.c array sorted by the function names
+    # (in the strcmp order), so that fptrstub_search can find them with a binary search;
+    # the entries of the functions with the same name keep the order of the stubs
+    # @belongs: codegen
+    def _get_function_pointer_stub_entries(self) -> List[str]:
+        entries = []
+        for fstub, fstub_id in self.function_pointer_stubs.items():
+            function = self.dbops.fnidmap[fstub_id]
+            name = function["name"] if function is not None else fstub
+            entries.append((name.encode(), len(entries),
+                            "  { %s, (void**)&%s }," % (self._get_function_kernel_name(fstub, fstub_id), fstub)))
+        entries.sort()
+        return [entry for _, _, entry in entries]
+
    # -------------------------------------------------------------------------
 
     # comment out inline assembly code and keep stats
@@ -45,12 +45,27 @@ class CutOff:
         # of what is considered to be an off-target border
         self.external_funcs = set()
 
-        self.fid_to_mods = {}  # map functions -> modules
-        self.fid_to_dirs = {}  # map functions -> source directories
+        self.fid_to_mods = {}  # map functions -> module set ids (see mod_sets)
+        self.fid_to_dirs = {}  # map functions -> source directory ids (see dir_names)
+        self.fid_to_src = {}  # map functions -> source file ids
+
+        # interned directories and module sets; taken from the db if precomputed there
+        # during import, see _init_file_info
+        self.dir_names = None
+        self.dir_ids = None
+        self.mod_sets = None
+        self.mod_set_ids = None
+        self.mods_subset_cache = {}
+        self.co_dir_ids = set()
+        self.co_file_ids = set()
 
         # cache to limit the number of expensive recursive queries
         self.stats_cache = {}
 
+        # caches used while computing the internal / external functions partition
+        self.func_deps_summaries = {}  # map functions -> functions they depend on
+        self.func_ext_cache = {}  # map functions -> is the function external (per _get_function_stats call)
+
     # -------------------------------------------------------------------------
 
     # given a function, find (recursively) all functions that is calls which are inside
@@ -58,27 +73,64 @@ class CutOff:
     # @belongs: cut-off
 
     def _get_internal_funcs(self, f, internal_funcs, external_funcs):
-        base_fid = f["id"]
+        # the functions are explored with a worklist rather than recursively; the dependencies
+        # of each function are taken from the per-function summaries (see _get_func_deps_summary)
+        worklist = [f]
+        explored = set()
+        while worklist:
+            f = worklist.pop()
+            base_fid = f["id"]
+            if base_fid in explored:
+                continue
+            explored.add(base_fid)
 
-        if not self.args.include_asm and base_fid in self.dbops.all_funcs_with_asm:
-            logging.info(
-                f"Skipping further exploration for a function with asm: {self.dbops._get_function_name(base_fid)}")
-            return
-        if base_fid in self.dbops.known_funcs_ids:
-            logging.info("Skipping further exploration for a known function")
-            return
+            if not self.args.include_asm and base_fid in self.dbops.all_funcs_with_asm:
+                logging.info(
+                    f"Skipping further exploration for a function with asm: {self.dbops._get_function_name(base_fid)}")
+                continue
+            if base_fid in self.dbops.known_funcs_ids:
+                logging.info("Skipping further exploration for a known function")
+                continue
+
+            logging.debug("Processing function {}".format(base_fid))
+            for fid in self._get_func_deps_summary(f):
+                logging.debug("checking funref {} ".format(fid))
+                if self._is_external_func(base_fid, fid):
+                    # logging.debug(
+                    #    "Function {} is outside of base module {}".format(fid, base_fid))
+                    external_funcs.add(fid)
+                else:
+                    # logging.debug(
+                    #    "Function {} is inside of base module {}".format(fid, base_fid))
+                    tmp_f = self.dbops.fnidmap[fid]
+                    if tmp_f is None and fid not in self.dbops.known_funcs_ids:
+                        # we've hit an unresolved function or a funcdecl
+                        external_funcs.add(fid)
+                        continue
+                    if fid not in internal_funcs:
+                        internal_funcs.add(fid)
+                        if tmp_f is not None:
+                            worklist.append(tmp_f)
+
+    # -------------------------------------------------------------------------
+
+    # Returns the set of functions that the function f depends on: the functions it calls,
+    # the functions referenced through the types and globals it uses and the possible targets
+    # of the function pointers it calls; the summary only depends on the database, therefore
+    # it is computed once per function
+    # @belongs: cut-off
+    def _get_func_deps_summary(self, f):
+        base_fid = f["id"]
+        if base_fid in self.func_deps_summaries:
+            return self.func_deps_summaries[base_fid]
 
-        logging.debug("Processing function {}".format(base_fid))
         funrefs = set(f["funrefs"])
 
         # in additiom to funrefs, there might be an implicit dependency to other functions
         # coming from globals and types
         internal_defs = set()
         type_refs = self.deps._get_types_in_funcs([base_fid], internal_defs)
-        # skip_list = set(f)
-        # skip_list |= internal_funcs
-        # skip_list |= external_funcs
-        funrefs |= self.deps._get_funcs_from_types(type_refs)  # , skip_list)
+        funrefs |= self.deps._get_funcs_from_types(type_refs)
 
         global_refs = set()
         if "globalrefs" in f:
@@ -94,100 +146,91 @@ class CutOff:
             for expr in fptrs:
                 funrefs.update([f_id for f_id in expr[1]])
 
-        for fid in funrefs:
-            logging.debug("checking funref {} ".format(fid))
-            ext = False  # deciding if the function is external or not
+        self.func_deps_summaries[base_fid] = funrefs
+        return funrefs
 
-            fname = ""
-            f = self.dbops.fnidmap[fid]
-            if f is not None:
-                fname = f['name']
-            if fid in self.dbops.always_inc_funcs_ids:
-                logging.info(f"Including internal func {fid}")
-            elif fid in self.dbops.known_funcs_ids:
-                logging.info(f"{fid} {fname} is a known function")
-            else:
-                if self.args.cut_off == CutOff.CUT_OFF_MODULE:
-                    if fid not in self.fid_to_mods:
-                        ext = True
-                        # fid will not be in fid_to_mods if it's an unresolved function in db.json
-                    else:
-                        # internal functions are the ones residing in the same module
+    # -------------------------------------------------------------------------
 
-                        if base_fid not in self.fid_to_mods:
-                            self._get_mods_and_dirs_for_f(base_fid)
+    # Decide whether the function fid referenced by the function base_fid is outside of the
+    # off-target border; unless the module cut-off is used, the answer doesn't depend on base_fid
+    # and is cached
+    # @belongs: cut-off
+    def _is_external_func(self, base_fid, fid):
+        if self.args.cut_off != CutOff.CUT_OFF_MODULE and fid in self.func_ext_cache:
+            return self.func_ext_cache[fid]
+
+        ext = False  # deciding if the function is external or not
+
+        fname = ""
+        f = self.dbops.fnidmap[fid]
+        if f is not None:
+            fname = f['name']
+        if fid in self.dbops.always_inc_funcs_ids:
+            logging.info(f"Including internal func {fid}")
+        elif fid in self.dbops.known_funcs_ids:
+            logging.info(f"{fid} {fname} is a known function")
+        else:
+            if self.args.cut_off == CutOff.CUT_OFF_MODULE:
+                if fid not in self.fid_to_mods:
+                    ext = True
+                    # fid will not be in fid_to_mods if it's an unresolved function in db.json
+                else:
+                    # internal functions are the ones residing in the same module
 
-                        mods = self.fid_to_mods[fid]
+                    if base_fid not in self.fid_to_mods:
+                        self._get_mods_and_dirs_for_f(base_fid)
 
-                        base_mods = self.fid_to_mods[base_fid]
-                        # let's check if the modules are the same
-                        # in principle we need to make sure that every module the base is compiled in,
-                        # is alos on the function's list of modules
-                        if 0 != len(base_mods.difference(mods)):
-                            ext = True
-                elif self.args.cut_off == CutOff.CUT_OFF_DIRS:
-                    if fid not in self.fid_to_dirs:
-                        ext = True
-                        # fid will not be in fid_to_dirs if it's an unresolved function (see dbops._get_function_file)
-                    else:
-                        # internal functions are the ones residing in the specified dirs
-                        dirs = self.fid_to_dirs[fid]
-                        # it is enough that one of the function's dirs is on the co_dirs list
-                        if len(dirs.difference(self.co_dirs)) == len(dirs):
-                            ext = True
-
-                elif self.args.cut_off == CutOff.CUT_OFF_FUNCTIONS:
-                    # internal functions are the ones with names on the list
-                    name = self.dbops._get_function_name(fid)
-                    if name not in self.co_funcs:
-                        ext = True
+                    mods = self.fid_to_mods[fid]
 
-                elif self.args.cut_off == CutOff.CUT_OFF_FILES:
-                    # internal functions are the ones that reside in the
-                    # specified source files
-                    src, loc = self.dbops._get_function_file(fid)
-                    if src not in self.co_files:
+                    base_mods = self.fid_to_mods[base_fid]
+                    # let's check if the modules are the same
+                    # in principle we need to make sure that every module the base is compiled in,
+                    # is alos on the function's list of modules
+                    if base_mods != mods and not self._is_mods_subset(base_mods, mods):
+                        ext = True
+            elif self.args.cut_off == CutOff.CUT_OFF_DIRS:
+                if fid not in self.fid_to_dirs:
+                    ext = True
+                    # fid will not be in fid_to_dirs if it's an unresolved function (see dbops._get_function_file)
+                else:
+                    # internal functions are the ones residing in the specified dirs
+                    if self.fid_to_dirs[fid] not in self.co_dir_ids:
                         ext = True
 
-                # if the function is external but we specify --co-dirs, --co-files
-                # or --co-funcs, we check if we could pull the function in
-                if ext and self.args.cut_off != CutOff.CUT_OFF_DIRS and len(self.co_dirs) > 0:
-                    if fid in self.fid_to_dirs:
-                        dirs = self.fid_to_dirs[fid]
-                        # it is enough that one of the function's dirs is on the co_dirs list
-                        if len(dirs.difference(self.co_dirs)) != len(dirs):
-                            ext = False
-
-                if ext and self.args.cut_off != CutOff.CUT_OFF_FUNCTIONS and len(self.co_funcs) > 0:
-                    # internal functions are the ones with names on the list
-                    name = self.dbops._get_function_name(fid)
-                    if name in self.co_funcs:
+            elif self.args.cut_off == CutOff.CUT_OFF_FUNCTIONS:
+                # internal functions are the ones with names on the list
+                name = self.dbops._get_function_name(fid)
+                if name not in self.co_funcs:
+                    ext = True
+
+            elif self.args.cut_off == CutOff.CUT_OFF_FILES:
+                # internal functions are the ones that reside in the
+                # specified source files
+                if self._get_src_for_f(fid) not in self.co_file_ids:
+                    ext = True
+
+            # if the function is external but we specify --co-dirs, --co-files
+            # or --co-funcs, we check if we could pull the function in
+            if ext and self.args.cut_off != CutOff.CUT_OFF_DIRS and len(self.co_dirs) > 0:
+                if fid in self.fid_to_dirs:
+                    if self.fid_to_dirs[fid] in self.co_dir_ids:
                         ext = False
 
-                if ext and self.args.cut_off != CutOff.CUT_OFF_FILES and len(self.co_files) > 0:
-                    # internal functions are the ones that reside in the
-                    # specified source files
-                    src, loc = self.dbops._get_function_file(fid)
-                    if src in self.co_files:
-                        ext = False
+            if ext and self.args.cut_off != CutOff.CUT_OFF_FUNCTIONS and len(self.co_funcs) > 0:
+                # internal functions are the ones with names on the list
+                name = self.dbops._get_function_name(fid)
+                if name in self.co_funcs:
+                    ext = False
 
-            if ext:
-                # logging.debug(
-                #    "Function {} is outside of base module {}".format(fid, base_fid))
-                external_funcs.add(fid)
-            else:
-                # logging.debug(
-                #    "Function {} is inside of base module {}".format(fid, base_fid))
-                tmp_f = self.dbops.fnidmap[fid]
-                if tmp_f is None and fid not in self.dbops.known_funcs_ids:
-                    # we've hit an unresolved function or a funcdecl
-                    external_funcs.add(fid)
-                    continue
-                if fid not in internal_funcs:
-                    internal_funcs.add(fid)
-                    if tmp_f is not None:
-                        self._get_internal_funcs(
-                            tmp_f, internal_funcs, external_funcs)
+            if ext and self.args.cut_off != CutOff.CUT_OFF_FILES and len(self.co_files) > 0:
+                # internal functions are the ones that reside in the
+                # specified source files
+                if self._get_src_for_f(fid) in self.co_file_ids:
+                    ext = False
+
+        if self.args.cut_off != CutOff.CUT_OFF_MODULE:
+            self.func_ext_cache[fid] = ext
+        return ext
 
     # -------------------------------------------------------------------------
 
@@ -211,18 +254,71 @@ class CutOff:
 
     # -------------------------------------------------------------------------
 
+    def _init_file_info(self):
+        if self.dir_names is not None:
+            return
+
+        if self.dbops.dir_names is not None:
+            self.dir_names = list(self.dbops.dir_names)
+            self.mod_sets = list(self.dbops.mod_sets)
+        else:
+            self.dir_names = []
+            self.mod_sets = []
+        self.dir_ids = {d: i for i, d in enumerate(self.dir_names)}
+        self.mod_set_ids = {m: i for i, m in enumerate(self.mod_sets)}
+
+        self.co_dir_ids = set([self._get_dir_id(d) for d in self.co_dirs])
+        self.co_file_ids = set()
+        for name in self.co_files:
+            src_ids = self.dbops.srcnmap[name]
+            if src_ids is None:
+                continue
+            if not isinstance(src_ids, list):
+                src_ids = [src_ids]
+            self.co_file_ids |= set(src_ids)
+
+    def _get_dir_id(self, dir):
+        if dir not in self.dir_ids:
+            self.dir_ids[dir] = len(self.dir_names)
+            self.dir_names.append(dir)
+        return self.dir_ids[dir]
+
+    def _get_mod_set_id(self, mods):
+        if mods not in self.mod_set_ids:
+            self.mod_set_ids[mods] = len(self.mod_sets)
+            self.mod_sets.append(mods)
+        return self.mod_set_ids[mods]
+
+    # check if every module in the module set base_mods is also in the module set mods
+    def _is_mods_subset(self, base_mods, mods):
+        key = (base_mods, mods)
+        if key not in self.mods_subset_cache:
+            self.mods_subset_cache[key] = self.mod_sets[base_mods].issubset(self.mod_sets[mods])
+        return self.mods_subset_cache[key]
+
+    def _get_src_for_f(self, fid):
+        if fid not in self.fid_to_src:
+            self.fid_to_src[fid] = self.dbops._get_function_file_id(fid)
+        return self.fid_to_src[fid]
+
     def _get_mods_and_dirs_for_f(self, fid):
         if fid in self.fid_to_mods:
             # this has already been executed for this function
             return
 
+        if self.dbops.fid_to_mods_id is not None and fid < len(self.dbops.fid_to_mods_id):
+            # the data was precomputed during import
+            self.fid_to_mods[fid] = int(self.dbops.fid_to_mods_id[fid])
+            self.fid_to_dirs[fid] = int(self.dbops.fid_to_dir_id[fid])
+            return
+
         src, loc = self.dbops._get_function_file(fid)
         mod_paths = None
 
         # Cut-off based on modules
         if (src is None) and (loc is None):
             # that is for the unresolved functions
-            mod_paths = ["/tmp/no_such_mod"]
+            mod_paths = [self.dbops.NO_SUCH_MOD]
         else:
             data = self.dbops.rdm_data[loc]
 
@@ -232,7 +328,7 @@ class CutOff:
             else:
                 mod_paths = data["entries"]
 
-        self.fid_to_mods[fid] = set(mod_paths)
+        self.fid_to_mods[fid] = self._get_mod_set_id(frozenset(mod_paths))
 
         # cut-off based on the list of function names
         # we don't really need to collect anything in that case - we will filter out
@@ -240,9 +336,9 @@ class CutOff:
 
         # cut-off based on the list of directories
         if src is not None:
-            self.fid_to_dirs[fid] = {os.path.dirname(src)}
+            self.fid_to_dirs[fid] = self._get_dir_id(os.path.dirname(src))
         else:
-            self.fid_to_dirs[fid] = {"/tmp/no_such_file"}
+            self.fid_to_dirs[fid] = self._get_dir_id(self.dbops.NO_SUCH_FILE)
 
     # @base_fids: the ids of the functions we would like to create an off-target for
     # @fids: the ids of all the other functions (that we discovered recursively)
@@ -262,8 +358,12 @@ class CutOff:
 
         logging.info(f"co_dirs is {self.co_dirs}")
 
+        self._init_file_info()
         for fid in fids:
             self._get_mods_and_dirs_for_f(fid)
+        # the verdicts depend on the dirs and modules collected for the functions so far,
+        # a function missing there in an earlier call might be internal now
+        self.func_ext_cache = {}
 
         self.internal_funcs = set()
         self.external_funcs = set()
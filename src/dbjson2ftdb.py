@@ -101,61 +101,54 @@ class FtdbFrontend(AotDbFrontend):
                                    cache_size=cache_size, field_is_unique=unique)
 
     def _query(self, visited, collection_name, base, match_from_field, match_to_field, value_to_return=None, cutoff_list=None):
-        collection = self.db[collection_name]
         returned = []
 
         if base[match_to_field] in visited:
             return returned
+        if not isinstance(base[match_from_field], (list, str)):
+            logging.error("Unsupported field type!")
+            return None
 
         visited.add(base[match_to_field])
-        results = None
-        from_obj = base[match_from_field]
-
-        if isinstance(from_obj, list):
-            for item in from_obj:
-                if item in visited:
-                    continue
-
-                results = self.collections[collection_name].find(
-                    match_to_field, item)
-                for r in results:
-                    if r[match_to_field] in visited:
-                        continue
-                    if cutoff_list is not None and r[match_to_field] in cutoff_list:
-                        visited.add(r[match_to_field])
 
-                        continue
-
-                    returned += self._query(visited, collection_name, r,
-                                            match_from_field, match_to_field, value_to_return, cutoff_list)
+        # the objects are visited depth-first with an explicit stack of (object, matching objects)
+        # pairs; every object is returned after all the objects reachable from it
+        stack = [(base, self._query_matches(visited, collection_name, base, match_from_field, match_to_field))]
+        while stack:
+            obj, matches = stack[-1]
+            r = next(matches, None)
+            if r is None:
+                stack.pop()
+                if stack:
                     if value_to_return is not None:
-                        returned.append(r[value_to_return])
+                        returned.append(obj[value_to_return])
                     else:
-                        returned.append(r)
-        elif isinstance(from_obj, str):
+                        returned.append(obj)
+                continue
 
-            results = self.collections[collection_name].find(
-                match_to_field, from_obj)
-            for r in results:
+            if r[match_to_field] in visited:
+                continue
+            visited.add(r[match_to_field])
+            if cutoff_list is not None and r[match_to_field] in cutoff_list:
+                continue
 
-                if r[match_to_field] in visited:
-                    continue
-                if cutoff_list is not None and r[match_to_field] in cutoff_list:
-                    visited.add(r[match_to_field])
-                    continue
+            stack.append((r, self._query_matches(visited, collection_name, r, match_from_field, match_to_field)))
+
+        return returned
 
-                returned += self._query(visited, collection_name, r,
-                                        match_from_field, match_to_field, value_to_return, cutoff_list)
+    # yields the objects of the collection whose match_to_field matches the match_from_field of base
+    def _query_matches(self, visited, collection_name, base, match_from_field, match_to_field):
+        from_obj = base[match_from_field]
 
-                if value_to_return is not None:
-                    returned.append(r[value_to_return])
-                else:
-                    returned.append(r)
+        if isinstance(from_obj, list):
+            for item in from_obj:
+                if item in visited:
+                    continue
+                yield from self.collections[collection_name].find(match_to_field, item)
+        elif isinstance(from_obj, str):
+            yield from self.collections[collection_name].find(match_to_field, from_obj)
         else:
             logging.error("Unsupported field type!")
-            return None
-
-        return returned
 
     def make_recursive_query(self, collection_name, obj_selector_field, obj_selector_value, match_from_field, match_to_field, value_to_return=None, add_vals=None, cutoff_list=None):
         hash_str = f"{collection_name}{obj_selector_field}{obj_selector_value}" +\
@@ -224,7 +217,8 @@ class FtdbFrontend(AotDbFrontend):
                                  "funcs_tree_funrefs_no_known", "funcs_tree_funrefs_no_known_no_asm",
                                  "globals", "globs_tree_globalrefs", "init_data", "known_data", "modules",
                                  "sources", "static_funcs_map", "types", "types_tree_refs", "types_tree_usedrefs",
-                                 "unresolvedfuncs", "source_info", "module_info", "func_fptrs"]
+                                 "unresolvedfuncs", "source_info", "module_info", "func_fptrs",
+                                 "funcs_file_info"]
         if self.db_file and self.json_file is None:
             logging.info(f"Loading data from {self.db_file} file")
             if not self.db.load(self.db_file, quiet=True):
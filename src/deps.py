@@ -13,10 +13,10 @@
 import logging
 from toposort import toposort, toposort_flatten, CircularDependencyError
 import struct
-import re
 import sys
 import difflib
 import hashlib
+from collections import Counter
 
 from typing import Dict, List, Tuple, Optional
 
@@ -28,19 +28,15 @@ class Deps:
     STRING_LITERAL = 'string'
     AOT_LITERALS_FILE = 'aot_literals'
     MAX_STRING_LITERAL_LEN = 16
+    LITERAL_MASK = 2**64 - 1
+    LITERAL_BYTE_ESCAPES = [f"\\x{b:02x}" for b in range(256)]
 
     # {0} - global variable trigger name
     # {1} - address specifier ('&' or '' in case of global variable array type)
     # {2} - global variable name
     # {3} - trigger name
     DYNAMIC_INIT_GLOBAL_VARIABLE_TEMPLATE = """void init_{3}() {{
-    unsigned long target_size;
-    void* ptr = aot_kflat_root_by_name("{0}", &target_size);
-    if(ptr) {{
-      aot_kflat_replace_variable(ptr, {1}{2}, target_size);
-      memcpy({1}{2} ,ptr, target_size);
-    }} else
-      puts("[Unflatten] Failed to load global {0}");
+    aot_kflat_init_variable("{0}", {1}{2});
 }}"""
 
     def __init__(self, args):
@@ -50,6 +46,9 @@ class Deps:
         self.internal_types = {}
         self.global_types = set()
         self.deps_cache = {}
+        # the data of functions and globals used in the dependency discovery
+        self.func_summaries = {}
+        self.global_summaries = {}
         self.args = args
         # known functions are those that will be provided by the target system/env
         # e.g. printf
@@ -66,11 +65,12 @@ class Deps:
         self.func_clash_counter = 0
         self.function_clashes = {}
 
+        # literal -> the number of its uses
         self.literals = {}
-        self.literals[Deps.INT_LITERAL] = set()
-        self.literals[Deps.FLOAT_LITERAL] = set()
-        self.literals[Deps.CHAR_LITERAL] = set()
-        self.literals[Deps.STRING_LITERAL] = set()
+        self.literals[Deps.INT_LITERAL] = Counter()
+        self.literals[Deps.FLOAT_LITERAL] = Counter()
+        self.literals[Deps.CHAR_LITERAL] = Counter()
+        self.literals[Deps.STRING_LITERAL] = Counter()
 
     def set_dbops(self, ops):
         self.dbops = ops
@@ -540,7 +540,10 @@ class Deps:
     # Get all functions and globals.
     # In C functions can reference other functions and globals and globals can reference other globals and functions.
     # On top of that types can reference functions and globals.
-    # In this function we try to discover all the dependencies
+    # In this function we try to discover all the dependencies: the functions are processed in batches, starting with
+    # @functions; each batch is followed by the functions newly discovered in the globals and types it pulled in,
+    # until no new functions are found. Every function is processed only once and the types are not sorted, as only
+    # the set of them is needed here.
     # @belongs: deps
     def _discover_functions_and_globals(self, functions, globals, all_types, basedirs, internal_defs=None):
         # get a recursive list of all functions called by our functions of choice
@@ -548,75 +551,72 @@ class Deps:
         logging.info("Initial analysis found {} functions".format(
             len(functions)))
 
-        # find all funrefs among the globals
-        logging.info("Getting functions from globals")
-        g_types, global_fwd_str, g_str, globals_ids = self._get_global_types(
-            functions, [], self.global_types, section_header=False, internal_defs=internal_defs)
-        g_funcs = set()
-        logging.info("We have {} globals and {} types".format(
-            len(globals_ids), len(g_types)))
-
-        # collect all types from functions & globals
-        tmp = set()
-        types = set()
-        types = set(self._get_types_in_funcs(functions, tmp))
-        tmp |= internal_defs
-        types |= set(g_types)
-
-        # types can reference globals too (e.g. via construct like typeof(global_var))
-        globals_ids |= self._get_globals_from_types(g_types)
-        globals_ids |= self._get_globals_from_types(types)
-        globals_ids |= self._get_globals_from_types(tmp)
-
-        # globals can reference other globals, so we have to pull them in
-        globals_ids |= set(self.dbops._get_recursive_by_id(
-            "globals", globals_ids, "globalrefs"))
-
-        # note: we don't need to update global types after recrusively
-        # pulling in globals, as the types are already retrieved recursively
-        # in _get_global_types
-        # TODO: consider typeof and sizeof in global types definitions
-        # and initializers
-        # TODO: consider if we have all the types from globals: especially
-        # the refs from globals pulled in recursively
-
-        # collect functions referenced by globals
-        for fid in self._get_funcs_from_globals(globals_ids, globals):
-            if fid not in functions:
-                g_funcs.add(fid)
-
-        # collect functions referenced by types
-        tmp_types = set()
-        tmp_types |= types
-        tmp_types |= tmp
-        for fid in self._get_funcs_from_types(tmp_types, all_types):
-            if fid not in functions:
-                g_funcs.add(fid)
-
-        globals |= globals_ids
-
-        all_types |= types
-
-        if len(self.cutoff.internal_funcs) > 0:
-            tmp = g_funcs.difference(self.cutoff.internal_funcs)
-            # we are only interested in internal functions
-            g_funcs.intersection_update(self.cutoff.internal_funcs)
-            # at the same time, we need to make sure that we update external funcs appropriately
-            # that is to add everything that we've found but which was not in the internal functions
-            # even though we will not generate the bodies of those functions, we would need to have them
-            # beacause they are referenced by globals that we will generate
-            self.cutoff.external_funcs |= tmp
-            self.cutoff.external_funcs = self._filter_out_known_functions(self.cutoff.external_funcs)
-
-        # let's check if new functions were discovered in globals
-        if 0 != len(g_funcs):
-            # we've found that globals reference other functions
+        processed = set()
+        discovered = set()
+        batch = functions
+        while len(batch) != 0:
+            processed |= batch
+
+            # find all funrefs among the globals
+            logging.info("Getting functions from globals")
+            g_types, globals_ids = self._get_globals_in_funcs(batch, internal_defs)
+            g_funcs = set()
+            logging.info("We have {} globals and {} types".format(
+                len(globals_ids), len(g_types)))
+
+            # collect all types from functions & globals
+            tmp = set()
+            types = self._get_types_in_funcs_closure(batch, tmp)
+            tmp |= internal_defs
+            types |= g_types
+
+            # types can reference globals too (e.g. via construct like typeof(global_var));
+            # the types seen in the previous batches were already checked
+            new_types = types.union(tmp)
+            new_types.difference_update(all_types)
+            globals_ids |= self._get_globals_from_types(new_types | tmp)
+
+            # globals can reference other globals, so we have to pull them in
+            globals_ids |= set(self.dbops._get_recursive_by_id(
+                "globals", globals_ids, "globalrefs"))
+
+            # collect functions referenced by globals
+            for g_id in globals_ids:
+                if g_id not in globals:
+                    g_funcs |= self._get_global_summary(g_id)["funrefs"]
+
+            # collect functions referenced by types
+            g_funcs |= self._get_funcs_from_types(new_types)
+            g_funcs.difference_update(batch)
+
+            globals |= globals_ids
 
+            all_types |= types
+
+            if len(self.cutoff.internal_funcs) > 0:
+                tmp = g_funcs.difference(self.cutoff.internal_funcs)
+                # we are only interested in internal functions
+                g_funcs.intersection_update(self.cutoff.internal_funcs)
+                # at the same time, we need to make sure that we update external funcs appropriately
+                # that is to add everything that we've found but which was not in the internal functions
+                # even though we will not generate the bodies of those functions, we would need to have them
+                # beacause they are referenced by globals that we will generate
+                self.cutoff.external_funcs |= tmp
+                self.cutoff.external_funcs = self._filter_out_known_functions(self.cutoff.external_funcs)
+
+            if 0 == len(g_funcs):
+                # that's the easy case - globals were not referencing any new functions
+                logging.info(
+                    "We have found no further functions as a result of global analysis")
+                break
+
+            # we've found that globals reference other functions
             logging.info(
                 "There are {} additional functions in the global initializers".format(len(g_funcs)))
+            discovered |= g_funcs
             to_query = set()
             # we need _some_ function to begin the query; refs will be injected into its funrefs field
-            for f in functions:
+            for f in batch:
                 if f in self.dbops.fnidmap:
                     to_query.add(f)
                     break
@@ -626,7 +626,7 @@ class Deps:
             self._get_called_functions(
                 to_query, additional_refs=g_funcs)
             logging.info(
-                "We added {} functions as a result of globals analysis".format(len(to_query.difference(functions))))
+                "We added {} functions as a result of globals analysis".format(len(to_query.difference(batch))))
 
             # we now have a recursive subtree of functions associated with global
             # in principle we need to repeat the process of globals discovery for them,
@@ -637,26 +637,129 @@ class Deps:
             if len(self.cutoff.internal_funcs) > 0:
                 to_query.intersection_update(self.cutoff.internal_funcs)
 
-            to_query.difference_update(functions)
+            to_query.difference_update(processed)
+            discovered |= to_query
+            batch = to_query
 
-            if len(to_query) > 0:
-                f, g = self._discover_functions_and_globals(
-                    to_query, globals, all_types, basedirs, internal_defs)
-                if len(self.cutoff.internal_funcs) > 0:
-                    f.intersection_update(self.cutoff.internal_funcs)
-                functions |= f
-            functions |= g_funcs
+        if len(discovered) != 0:
+            functions |= discovered
             functions = self._filter_out_known_functions(functions)
-            globals |= self._get_globals_from_types(types)
 
-            return functions, globals
+        return functions, globals
+
+    # -------------------------------------------------------------------------
+
+    # Get the data of a function needed to discover its dependencies
+    # @belongs: deps
+    def _get_func_summary(self, f_id):
+        if f_id in self.func_summaries:
+            return self.func_summaries[f_id]
+
+        summary = None
+        f = self.dbops.fnidmap[f_id]
+        if f is not None:
+            # types defined inside the function are not its dependencies
+            types = set()
+            defs = set()
+            self._discover_type_decls_and_refs(f, defs, types)
+            types |= set(f["types"])
+            summary = {"refs": set(f["refs"]), "types": types, "defs": defs, "globalrefs": set(f["globalrefs"])}
         else:
-            # that's the easy case - globals were not referencing any new functions,
-            # therefore we don't need to recursively call the function again
-            logging.info(
-                "We have found no further functions as a result of global analysis")
+            # assume funcdecls
+            f = self.dbops.fdmap[f_id]
+            if f is None:
+                logging.error(
+                    "Unable to find func or funcdecl for id {}".format(f_id))
+            else:
+                summary = {"refs": set(), "types": set(f["types"]), "defs": set(), "globalrefs": set()}
+
+        self.func_summaries[f_id] = summary
+        return summary
+
+    # -------------------------------------------------------------------------
+
+    # Get the data of a global needed to discover its dependencies
+    # @belongs: deps
+    def _get_global_summary(self, g_id):
+        if g_id in self.global_summaries:
+            return self.global_summaries[g_id]
+
+        g = self.dbops.globalsidmap[g_id]
+        decls = set()
+        if "decls" in g:
+            decls, _ = self.dbops._get_global_decl_types(
+                g["decls"], g["refs"], g["type"])
+        summary = {"type": g["type"], "refs": set(g["refs"]), "decls": decls,
+                   "globalrefs": set(g["globalrefs"]), "funrefs": set(g.get("funrefs", []))}
 
-            return functions, globals
+        self.global_summaries[g_id] = summary
+        return summary
+
+    # -------------------------------------------------------------------------
+
+    # Get the types used by the given functions (and the types they define in @internal_defs);
+    # the same set of types as in _get_types_in_funcs, but not sorted
+    # @belongs: deps
+    def _get_types_in_funcs_closure(self, functions, internal_defs):
+        ftypes = set()
+        defs = set()
+        for f_id in functions:
+            summary = self._get_func_summary(f_id)
+            if summary is None:
+                continue
+            if f_id not in self.cutoff.external_funcs:
+                # if a function is external we don't want to get all
+                # the types used in its body
+                ftypes |= summary["refs"]
+            ftypes |= summary["types"]
+            defs |= summary["defs"]
+        ftypes.difference_update(defs)
+        internal_defs |= defs
+
+        return self._get_types_closure(ftypes, None, internal_defs)
+
+    # -------------------------------------------------------------------------
+
+    # Get the globals used by the given functions along with the types they require;
+    # that is the dependency discovery part of _get_global_types
+    # @belongs: deps
+    def _get_globals_in_funcs(self, functions, internal_defs):
+        globals_ids = set()
+        for f_id in functions:
+            if f_id in self.cutoff.external_funcs or f_id in self.dbops.known_funcs_ids:
+                continue
+            summary = self._get_func_summary(f_id)
+            if summary is not None:
+                globals_ids |= summary["globalrefs"]
+
+        global_types = set()
+        global_type_decls = set()
+        globals_from_inits = set()
+        for g_id in globals_ids:
+            summary = self._get_global_summary(g_id)
+            global_types.add(summary["type"])
+            # globals can reference other types, eg. enums in their initializers
+            global_types |= summary["refs"]
+            global_type_decls |= summary["decls"]
+            globals_from_inits |= summary["globalrefs"]
+
+        globals_from_inits.difference_update(globals_ids)
+        for g_id in globals_from_inits:
+            summary = self._get_global_summary(g_id)
+            global_types.add(summary["type"])
+            global_type_decls |= summary["decls"]
+        internal_defs |= global_type_decls
+
+        global_types.difference_update(self.global_types)
+        if len(global_types) != 0:
+            global_types = self._get_types_closure(
+                global_types, self.global_types, internal_defs)
+            # we can have a duplicate across the known global types and global_types
+            global_types = self._remove_duplicated_types_from(self.global_types, global_types)
+        global_types.difference_update(global_type_decls)
+
+        globals_ids |= globals_from_inits
+        return global_types, globals_ids
 
     # -------------------------------------------------------------------------
 
@@ -953,32 +1056,21 @@ class Deps:
 
     # @belongs: codegen or deps
     def capture_literals(self, global_ids, function_ids):
+        kinds = [Deps.INT_LITERAL, Deps.FLOAT_LITERAL, Deps.CHAR_LITERAL, Deps.STRING_LITERAL]
 
         for g_id in global_ids:
             g = self.dbops.globalsidmap[g_id]
             if "literals" in g:
                 literals = g["literals"]
-                self.literals[Deps.INT_LITERAL] |= set(
-                    literals[Deps.INT_LITERAL])
-                self.literals[Deps.FLOAT_LITERAL] |= set(
-                    literals[Deps.FLOAT_LITERAL])
-                self.literals[Deps.CHAR_LITERAL] |= set(
-                    literals[Deps.CHAR_LITERAL])
-                self.literals[Deps.STRING_LITERAL] |= set(
-                    literals[Deps.STRING_LITERAL])
+                for kind in kinds:
+                    self.literals[kind].update(literals[kind])
 
         for f_id in function_ids:
             f = self.dbops.fnidmap[f_id]
             if f and "literals" in f:
                 literals = f["literals"]
-                self.literals[Deps.INT_LITERAL] |= set(
-                    literals[Deps.INT_LITERAL])
-                self.literals[Deps.FLOAT_LITERAL] |= set(
-                    literals[Deps.FLOAT_LITERAL])
-                self.literals[Deps.CHAR_LITERAL] |= set(
-                    literals[Deps.CHAR_LITERAL])
-                self.literals[Deps.STRING_LITERAL] |= set(
-                    literals[Deps.STRING_LITERAL])
+                for kind in kinds:
+                    self.literals[kind].update(literals[kind])
 
             # in addition to literals, we are going to extract constatnt values from switch info
             if f and "switches" in f:
@@ -986,69 +1078,84 @@ class Deps:
                     for c in s["cases"]:
                         # the int value can be found at c[0]
                         try:
-                            self.literals[Deps.INT_LITERAL].add(int(c[0]))
+                            self.literals[Deps.INT_LITERAL][int(c[0])] += 1
                         except Exception:
                             logging.error(
                                 f"Switch error detected in function {f['name']}")
                         if len(c) == 8:
                             # we have the range-based case - the next value is at c[4]
                             try:
-                                self.literals[Deps.INT_LITERAL].add(int(c[4]))
+                                self.literals[Deps.INT_LITERAL][int(c[4])] += 1
                             except Exception:
                                 logging.error(
                                     f"Switch error detected in function {f['name']}")
 
         # finally, we can generate a dictionary file with literals
+        entries = self._get_literal_entries()
+        if self.args.max_literals is not None and len(entries) > self.args.max_literals:
+            # keep the most frequently used literals; the order of the dictionary is preserved
+            logging.info(f"Limiting the literals dictionary from {len(entries)} to {self.args.max_literals} entries")
+            ranking = sorted(range(len(entries)), key=lambda j: -entries[j][1])
+            selected = sorted(ranking[:self.args.max_literals])
+            entries = [entries[j] for j in selected]
+
         with open(f"{self.args.output_dir}/{Deps.AOT_LITERALS_FILE}", "w") as f:
-            i = 0
-            _str = ""
-            for l in sorted(self.literals[Deps.INT_LITERAL]):
-                # thanks to https://stackoverflow.com/questions/30285849/pythonic-way-to-convert-an-integer-into-a-hex-escaped-string
-                # https://stackoverflow.com/questions/5864271/reverse-a-string-in-python-two-characters-at-a-time-network-byte-order
-                # https://stackoverflow.com/questions/7822956/how-to-convert-negative-integer-value-to-hex-in-python
-                if l < 0:
-                    hex_str = hex(l & (2**64 - 1))
-                else:
-                    hex_str = format(l, '#02x')
-                if len(hex_str) % 2:
-                    hex_str = hex_str.replace("0x", "0x0")
-                hex_str = hex_str.replace("0x", "")
-                # reverse bytes for little-endian
-                hex_str = "".join(
-                    reversed([hex_str[j:j+2] for j in range(0, len(hex_str), 2)]))
-                hex_str = re.sub("(..)", r"\\x\1", hex_str)
-                if len(hex_str) == 0:
-                    continue
-                _str += f"literal{i}=\"{hex_str}\"\n"
-                i += 1
-            for l in sorted(self.literals[Deps.FLOAT_LITERAL]):
-                # thanks to https://stackoverflow.com/questions/23624212/how-to-convert-a-float-into-hex/38879403
-                hex_str = hex(struct.unpack('<Q', struct.pack('<d', l))[0])
-                hex_str = hex_str.replace("L", "")
-                if len(hex_str) % 2:
-                    hex_str = hex_str.replace("0x", "0x0")
-                hex_str = hex_str.replace("0x", "")
-                # reverse bytes for little-endian
-                hex_str = "".join(
-                    reversed([hex_str[j:j+2] for j in range(0, len(hex_str), 2)]))
-                hex_str = re.sub("(..)", r"\\x\1", hex_str)
-                if len(hex_str) == 0:
-                    continue
-                _str += f"literal{i}=\"{hex_str}\"\n"
-                i += 1
-            for l in sorted(self.literals[Deps.CHAR_LITERAL]):
-                if len(str(l)) == 0:
-                    continue
-                _str += f"literal{i}=\"{str(l)}\"\n"
-                i += 1
-            for l in sorted(self.literals[Deps.STRING_LITERAL]):
-                if len(str(l)) <= Deps.MAX_STRING_LITERAL_LEN and len(str(l)) > 0:
-                    raw = repr(l)[1:-1]
-                    if "%" not in raw:
-                        raw = raw.replace("\\", "\\\\")
-                        _str += f"literal{i}=\"" + raw + "\"\n"
-                        i += 1
-            f.write(_str)
+            f.writelines(f"literal{i}=\"{value}\"\n" for i, (value, _) in enumerate(entries))
+
+    # -------------------------------------------------------------------------
+
+    # Get the AFL dictionary entries for the captured literals as a list of
+    # (escaped value, number of uses) in the dictionary order
+    def _get_literal_entries(self):
+        entries = []
+
+        # integers are stored as their 64-bit two's complement (unless they are bigger)
+        # and floats as IEEE 754 doubles, little-endian without the most significant zero bytes
+        ints = sorted(self.literals[Deps.INT_LITERAL])
+        values = [l & Deps.LITERAL_MASK if l < 0 else l for l in ints]
+        small = [v for v in values if v <= Deps.LITERAL_MASK]
+        packed = iter(Deps._get_literal_bytes(struct.pack(f"<{len(small)}Q", *small)))
+        for l, v in zip(ints, values):
+            if v <= Deps.LITERAL_MASK:
+                data = next(packed)
+            else:
+                data = v.to_bytes((v.bit_length() + 7) // 8, "little")
+            entries.append((Deps._escape_literal_bytes(data), self.literals[Deps.INT_LITERAL][l]))
+
+        floats = sorted(self.literals[Deps.FLOAT_LITERAL])
+        packed = Deps._get_literal_bytes(struct.pack(f"<{len(floats)}d", *floats))
+        for l, data in zip(floats, packed):
+            entries.append((Deps._escape_literal_bytes(data), self.literals[Deps.FLOAT_LITERAL][l]))
+
+        for l in sorted(self.literals[Deps.CHAR_LITERAL]):
+            if len(str(l)) == 0:
+                continue
+            entries.append((str(l), self.literals[Deps.CHAR_LITERAL][l]))
+
+        for l in sorted(self.literals[Deps.STRING_LITERAL]):
+            if len(str(l)) <= Deps.MAX_STRING_LITERAL_LEN and len(str(l)) > 0:
+                raw = repr(l)[1:-1]
+                if "%" not in raw:
+                    raw = raw.replace("\\", "\\\\")
+                    entries.append((raw, self.literals[Deps.STRING_LITERAL][l]))
+
+        return entries
+
+    # -------------------------------------------------------------------------
+
+    # Split the packed 64-bit values into bytes with the most significant zero bytes
+    # stripped; at least one byte is left for each value
+    @staticmethod
+    def _get_literal_bytes(packed):
+        for j in range(0, len(packed), 8):
+            data = packed[j:j + 8].rstrip(b"\0")
+            yield data if data else b"\0"
+
+    # -------------------------------------------------------------------------
+
+    @staticmethod
+    def _escape_literal_bytes(data):
+        return "".join([Deps.LITERAL_BYTE_ESCAPES[b] for b in data])
 
     # -------------------------------------------------------------------------
 
@@ -1097,29 +1204,26 @@ class Deps:
 
     # -------------------------------------------------------------------------
 
-    # @belongs: deps or dbops
-    def _get_types_recursive(self, types, base_types=None, internal_defs=None):
-        if self.args.used_types_only:
-            all_types = self.dbops._get_recursive_by_id(
-                "types", types, "usedrefs", base_types)
-        else:
-            all_types = self.dbops._get_recursive_by_id(
-                "types", types, "refs", base_types)
-        logging.debug("Getting type deps for {} types".format(len(all_types)))
-        # since the order is not guaranteed 
-        # we need to perform a topological sort
+    # Get the dependencies of the given types used for their topological sort
+    # along with the types defined inside them
+    # @belongs: deps
+    def _get_type_deps(self, all_types):
         deps = {}
         _internal_defs = set()
-        all_types_data = self.dbops.typemap.get_many(list(all_types))
+        all_types = list(all_types)
+        # the dependencies are cached, so only the types seen for the first time are fetched
+        types_data = {}
+        for t in self.dbops.typemap.get_many([tid for tid in all_types if tid not in self.deps_cache]):
+            types_data[t["id"]] = t
 
-        for t in all_types_data:
-            tid = t["id"]
+        for tid in all_types:
 
             if tid in self.deps_cache:
                 deps[tid] = self.deps_cache[tid]["refs"]
                 _internal_defs |= self.deps_cache[tid]["defs"]
                 continue
 
+            t = types_data[tid]
             _internal_defs_single = set()
 
             cl = t["class"]
@@ -1165,7 +1269,59 @@ class Deps:
 
             _internal_defs |= _internal_defs_single
 
-        del all_types_data
+        del types_data
+        return deps, _internal_defs
+
+    # -------------------------------------------------------------------------
+
+    # Get the same set of types as _get_types_recursive (with the duplicated types removed)
+    # without sorting them; useful when only the set of the types matters
+    # @belongs: deps
+    def _get_types_closure(self, types, base_types=None, internal_defs=None):
+        if self.args.used_types_only:
+            all_types = self.dbops._get_recursive_by_id(
+                "types", types, "usedrefs", base_types)
+        else:
+            all_types = self.dbops._get_recursive_by_id(
+                "types", types, "refs", base_types)
+        deps, _internal_defs = self._get_type_deps(all_types)
+
+        closure = set(deps)
+        for refs in deps.values():
+            closure |= refs
+        # builtin types have no dependencies, but they might be referenced by other types
+        for t in self.dbops.typemap.get_many([tid for tid in closure if tid not in deps]):
+            if t["class"] == "builtin":
+                closure.discard(t["id"])
+        closure.difference_update(_internal_defs)
+        if base_types is not None:
+            closure.difference_update(base_types)
+
+        if internal_defs is not None:
+            internal_defs |= _internal_defs
+
+        # _remove_duplicated_types keeps the first variant of a type in the topological
+        # order, so that order is only needed if more than one variant made it in
+        for t in closure:
+            if t in self.dup_types and any(d != t and d in closure for d in self.dup_types[t]):
+                sorted, _ = self._get_types_recursive(types, base_types)
+                return set(self._remove_duplicated_types(sorted))
+        return closure
+
+    # -------------------------------------------------------------------------
+
+    # @belongs: deps or dbops
+    def _get_types_recursive(self, types, base_types=None, internal_defs=None):
+        if self.args.used_types_only:
+            all_types = self.dbops._get_recursive_by_id(
+                "types", types, "usedrefs", base_types)
+        else:
+            all_types = self.dbops._get_recursive_by_id(
+                "types", types, "refs", base_types)
+        logging.debug("Getting type deps for {} types".format(len(all_types)))
+        # since the order is not guaranteed 
+        # we need to perform a topological sort
+        deps, _internal_defs = self._get_type_deps(all_types)
         logging.debug("Toposort types")
 
         circles = True
@@ -1397,6 +1553,41 @@ class Deps:
 
         return functions
 
+    # With --snapshot-globals the definitions of the globals which can be modified at runtime
+    # are marked with AOT_GLOBAL_STATE, so that they are all placed in a single section whose
+    # contents can be saved and restored at once (see aot_globals_snapshot);
+    # with --dynamic-init-lazy the globals initialized from the kflat image are marked with
+    # AOT_KFLAT_GLOBAL instead, so that they can be initialized on the first access (see dyn_init.c)
+    def _get_global_state_def(self, g, def_str):
+        if self.args.dynamic_init and self.args.dynamic_init_lazy:
+            attribute = "AOT_KFLAT_GLOBAL"
+        elif self.args.snapshot_globals:
+            attribute = "AOT_GLOBAL_STATE"
+        else:
+            return def_str
+        if def_str.startswith("register") or "section(" in def_str or "__thread" in def_str or "_Thread_local" in def_str:
+            return def_str
+        if not self.args.dynamic_init and self._is_const_global(g):
+            # placing const data in a writable section would cause a section type conflict
+            return def_str
+        index = def_str.find("=")
+        if -1 != index:
+            return f"{def_str[:index].rstrip()} {attribute} {def_str[index:]}"
+        return f"{def_str} {attribute}"
+
+    # -------------------------------------------------------------------------
+
+    def _is_const_global(self, g):
+        t = self.dbops.typemap[g["type"]]
+        while True:
+            if "c" in t.get("qualifiers", ""):
+                return True
+            if t["class"] not in ["typedef", "const_array", "incomplete_array"]:
+                return False
+            t = self.dbops.typemap[t["refs"][0]]
+
+    # -------------------------------------------------------------------------
+
     # @types: the types we aleady know about
     # @belongs: codegen/deps
     # @sam (but see todo below)
@@ -1496,8 +1687,8 @@ class Deps:
 
             if local:
                 if self.args.dynamic_init:
-                    def_string = "\n{};\n".format(g["def"].replace(
-                        "extern ", "").replace("const ", ""))
+                    def_string = "\n{};\n".format(self._get_global_state_def(g, g["def"].replace(
+                        "extern ", "").replace("const ", "")))
                     g_trigger_name = "%s" % (g["hash"].replace(
                         "/", "__").replace(".", "____").replace("-", "___"))
                     g_type = self.dbops.typemap[g["type"]]
@@ -1506,8 +1697,8 @@ class Deps:
                     def_string += "\n{};\n".format(Deps.DYNAMIC_INIT_GLOBAL_VARIABLE_TEMPLATE.format(
                         g["hash"], g_address_specifier, g["name"], g_trigger_name))
                 else:
-                    def_string = "\n{};\n".format(
-                        g["def"].replace("extern ", ""))
+                    def_string = "\n{};\n".format(self._get_global_state_def(g,
+                        g["def"].replace("extern ", "")))
                 global_defs_strings[g_id] = def_string
                 globals_from_inits |= set(g["globalrefs"])
 
@@ -57,8 +57,8 @@ class _TreeIterator:
 
     def __init__(self, tree):
         self.tree = tree
-        self.index = 0
-        self.next_iterator = None
+        # [subtree, index] pairs; the last one is the subtree being currently iterated
+        self.stack = [[tree, 0]]
 
     def __iter__(self):
         return self
@@ -69,34 +69,42 @@ class _TreeIterator:
         if id(self.tree) in tree_length_cache:
             return tree_length_cache[id(self.tree)]
 
-        s = 0
-        for v in self.tree:
+        # [subtree, index, length so far] frames
+        stack = [[self.tree, 0, 0]]
+        while True:
+            frame = stack[-1]
+            tree, index, s = frame
+            if index == len(tree):
+                tree_length_cache[id(tree)] = s
+                stack.pop()
+                if not stack:
+                    return s
+                stack[-1][2] += s
+                continue
+
+            frame[1] += 1
+            v = tree[index]
             if not isinstance(v, list):
-                s += 1
+                frame[2] += 1
+            elif id(v) in tree_length_cache:
+                frame[2] += tree_length_cache[id(v)]
             else:
-                s += _TreeIterator(v).len(tree_length_cache)
-
-        tree_length_cache[id(self.tree)] = s
-        return s
+                stack.append([v, 0, 0])
 
     def __next__(self):
-        if self.index >= len(self.tree):
-            raise StopIteration
-
-        if not isinstance(self.tree[self.index], list):
-            r = self.tree[self.index]
-            self.index += 1
-            return r
+        while self.stack:
+            frame = self.stack[-1]
+            tree, index = frame
+            if index >= len(tree):
+                self.stack.pop()
+                continue
 
-        if not self.next_iterator:
-            self.next_iterator = _TreeIterator(self.tree[self.index])
+            frame[1] += 1
+            if not isinstance(tree[index], list):
+                return tree[index]
+            self.stack.append([tree[index], 0])
 
-        try:
-            return self.next_iterator.__next__()
-        except StopIteration:
-            self.next_iterator = None
-            self.index += 1
-            return self.__next__()
+        raise StopIteration
 
 
 class _DerefsEntry:
@@ -133,6 +141,17 @@ class Init:
     CAST_PTR_NO_MEMBER = -1
     MAX_RECURSION_DEPTH = 50
 
+    # substrings of variable names that make _could_be_an_index_var return True
+    INDEX_VAR_NAMES = [ "cnt", "count", "index", "ind", "idx", "size", "num", "number" ]
+    # member names that receive special treatment in _generate_var_init (see get_names_after_extraction)
+    LIST_MEMBER_NAMES = set([ "prev", "next", "pprev" ])
+    # the name under which memoized var init code templates are generated
+    VAR_INIT_NAME_PLACEHOLDER = "__aot_init_var__"
+
+    # kinds of items in the derefs trace, see _collect_derefs_trace
+    TRACE_DEREF = "deref"
+    TRACE_CALL = "call"
+
     INIT_CL_NONPTR = "nonptr"
     INIT_CL_PTR = "ptr"
     INIT_CL_FPTR = "fptr"
@@ -158,6 +177,12 @@ class Init:
         self.init_data = {}
         self.init_data["globals"] = []
         self.init_data["funcs"] = []
+        self.typename_to_tid = None  # lazily created by find_type_by_name
+        # memoized var init code templates, see _generate_var_init
+        self.var_init_cache = {}
+        self.var_init_seen = set()
+        self.var_init_side_effects = 0
+        self.var_init_cache_hits = 0
 
     # -------------------------------------------------------------------------
 
@@ -535,6 +560,7 @@ class Init:
     # - ['index']      : upper limit for members used as an index in a const array (any), e.g. array[s->index], where array is of size 20
     # @belongs: init
     def _generate_member_size_info(self, funcs, types):
+        self._invalidate_var_init_cache()
         logging.info(f"will generate size info")
 
         for func in funcs:
@@ -822,6 +848,7 @@ class Init:
 
     # @belongs: init
     def _get_tagged_var_name(self):
+        self.var_init_side_effects += 1
         self.tagged_vars_count += 1
         return f"\"aot_var_{self.tagged_vars_count}\""
     
@@ -993,14 +1020,36 @@ class Init:
     
     # -------------------------------------------------------------------------
 
-    # Function takes name of type, iterates through data base with types and returns the type with given name (the one not being const).
+    # Function takes name of type and returns the type with given name (the one not being const).
+    # The lookup goes through a typename -> type id index which is built once, on first use.
     # @belongs: init
     def find_type_by_name(self, typename):
-        for type in self.dbops.typemap:
-            tmp_name = self.codegen._get_typename_from_type(type)
-            if tmp_name == typename and ("qualifiers" not in type or 'c' not in type["qualifiers"]):
-                return type
-        return None
+        if self.typename_to_tid is None:
+            self.typename_to_tid = self._create_typename_index()
+        t_id = self.typename_to_tid.get(typename)
+        if t_id is None:
+            return None
+        return self.dbops.typemap[t_id]
+
+    # -------------------------------------------------------------------------
+
+    # Create a map of type names (as generated by codegen) to the ids of non-const types.
+    # In case of name duplicates the first type found in the db wins, just like in the
+    # linear search this index replaces.
+    # @belongs: init
+    def _create_typename_index(self):
+        logging.info("Creating typename index")
+        index = {}
+        for t in self.dbops.db["types"]:
+            if t["class"] not in self.codegen.VAR_DEF_CLASSES:
+                continue
+            if "qualifiers" in t and 'c' in t["qualifiers"]:
+                continue
+            name = self.codegen._get_typename_from_type(t)
+            if name not in index:
+                index[name] = t["id"]
+        logging.info(f"Typename index created with {len(index)} entries")
+        return index
 
     # -------------------------------------------------------------------------
     
@@ -1185,14 +1234,12 @@ class Init:
     # -------------------------------------------------------------------------
 
     def _could_be_an_index_var(self, name, type):
-        index_names = [ "cnt", "count", "index", "ind", "idx", "size", "num", "number" ]
-        
         t = self.dbops._get_typedef_dst(type)
         
         if t["class"] != "builtin":
             return False
          
-        for n in index_names:
+        for n in Init.INDEX_VAR_NAMES:
             if n in name:
                 return True
 
@@ -1248,7 +1295,116 @@ class Init:
                 any memory was allocated for the current entity (NOTE: remove, as it is only changed within recursive
                 calls, but not read anywhere?), brk is a boolean that is True iff maximal recursion depth was reached
                 and is used to break out of the recursion loop
+
+        The init code does not depend on the name of the entity as long as no user-provided init data, tagging, function
+        pointer stubs or offsetof tricks are involved. For such entities the code is generated once per type (and
+        recursion context) using a placeholder name and the resulting template is reused for subsequent inits.
         """
+        key = self._get_var_init_cache_key(name, type, pointers, level, skip_init, known_type_names, cast_str, new_types,
+                                           entity_name, init_obj, fuse, count, data, is_subitem, subitems_names, hidden_members,
+                                           is_hidden, always_init)
+        if key is None:
+            return self._generate_var_init_code(name, type, pointers, level, skip_init, known_type_names, cast_str, new_types,
+                                                entity_name, init_obj, fuse, fid, count, data, is_subitem, subitems_names,
+                                                hidden_members, is_hidden, always_init)
+
+        if key not in self.var_init_cache:
+            if key not in self.var_init_seen:
+                # first time we see this key: generate the code in place and only remember whether it is
+                # safe to create a template for it
+                side_effects = self.var_init_side_effects
+                str, alloc, brk = self._generate_var_init_code(name, type, pointers, level, skip_init, known_type_names,
+                                                               cast_str, new_types, entity_name, init_obj, fuse, fid, count,
+                                                               data, is_subitem, subitems_names, hidden_members, is_hidden,
+                                                               always_init)
+                if not brk and side_effects == self.var_init_side_effects:
+                    self.var_init_seen.add(key)
+                return str, alloc, brk
+
+            side_effects = self.var_init_side_effects
+            tmpl_pointers = pointers[:]
+            tmpl_new_types = set() if new_types is not None else None
+            tmpl_data = {}
+            str, alloc, brk = self._generate_var_init_code(Init.VAR_INIT_NAME_PLACEHOLDER, type, tmpl_pointers, level,
+                                                           skip_init, known_type_names, cast_str, tmpl_new_types, None,
+                                                           init_obj, fuse, fid, count, tmpl_data)
+            if brk or side_effects != self.var_init_side_effects:
+                # should not happen as the generation is deterministic, but let's not risk a bad template
+                logging.warning(f"Unable to create var init template for type {type['id']}")
+                self.var_init_seen.discard(key)
+                return self._generate_var_init_code(name, type, pointers, level, skip_init, known_type_names, cast_str,
+                                                    new_types, entity_name, init_obj, fuse, fid, count, data, is_subitem,
+                                                    subitems_names, hidden_members, is_hidden, always_init)
+            # keep a reference to known_type_names so that its id stays unique while the entry exists
+            self.var_init_cache[key] = (str, alloc, tmpl_data, tmpl_new_types, tmpl_pointers[len(pointers):],
+                                        known_type_names)
+        else:
+            self.var_init_cache_hits += 1
+
+        str, alloc, tmpl_data, tmpl_new_types, tmpl_pointers, _ = self.var_init_cache[key]
+        data.update(self._instantiate_var_init_template(tmpl_data, name))
+        if new_types is not None:
+            new_types |= tmpl_new_types
+        pointers += tmpl_pointers
+        return str.replace(Init.VAR_INIT_NAME_PLACEHOLDER, name), alloc, False
+
+    # Returns the key under which the init code template for the given _generate_var_init arguments is memoized
+    # or None if the code depends on the name of the initialized entity (and therefore cannot be memoized).
+    # Please note that user init data is matched by name; we assume here that its keys do not contain member
+    # accesses, i.e. only the top-level names are checked.
+    # @belongs: init
+    def _get_var_init_cache_key(self, name, type, pointers, level, skip_init, known_type_names, cast_str, new_types,
+                                entity_name, init_obj, fuse, count, data, is_subitem, subitems_names, hidden_members,
+                                is_hidden, always_init):
+        if not self.args.init or type is None or data is None:
+            return None
+        if is_subitem or is_hidden or subitems_names is not None or hidden_members is not None or always_init is not None:
+            return None
+        # the data dict is filled in by the init code; we can only merge a template into it if it doesn't
+        # contain anything that the init code extends
+        if 'members' in data or 'offsetof' in data:
+            return None
+        if "__!" in name:
+            return None
+        for n in Init.INDEX_VAR_NAMES:
+            if n in name:
+                return None
+        if self.get_names_after_extraction(name, backwards=True)[2] in Init.LIST_MEMBER_NAMES or \
+                name in Init.LIST_MEMBER_NAMES:
+            return None
+        if self.dbops.init_data is not None:
+            if name.split("[")[0] in self.dbops.init_data:
+                return None
+            if entity_name is not None and entity_name.split("[")[0] in self.dbops.init_data:
+                return None
+
+        return (type["id"], level, skip_init, id(known_type_names), cast_str, new_types is None, init_obj, fuse, count,
+                tuple(pointers))
+
+    # Returns a copy of the data dict of a memoized init code template with the placeholder name replaced.
+    # @belongs: init
+    def _instantiate_var_init_template(self, item, name):
+        if isinstance(item, dict):
+            return {k: self._instantiate_var_init_template(v, name) for k, v in item.items()}
+        if isinstance(item, list):
+            return [self._instantiate_var_init_template(v, name) for v in item]
+        if isinstance(item, str):
+            return item.replace(Init.VAR_INIT_NAME_PLACEHOLDER, name)
+        return item
+
+    # Drops all memoized init code templates; needs to be called whenever the data the init code depends
+    # on (e.g. used types data or cast information) changes.
+    # @belongs: init
+    def _invalidate_var_init_cache(self):
+        self.var_init_side_effects += 1
+        self.var_init_cache = {}
+        self.var_init_seen = set()
+
+    # The actual implementation of _generate_var_init, see the description there.
+    # @belongs: init
+    def _generate_var_init_code(self, name, type, pointers, level=0, skip_init=False, known_type_names=None, cast_str=None,
+                                new_types=None, entity_name=None, init_obj=None, fuse=None, fid=None, count=None, data=None,
+                                is_subitem=False, subitems_names=None, hidden_members=None, is_hidden=False, always_init=None):
         if entity_name is None:
             entity_name = name
         # in case of typedefs we need to get the first non-typedef type as a point of
@@ -1257,6 +1413,7 @@ class Init:
         if fuse is not None:
             fuse += 1
             if fuse > Init.MAX_RECURSION_DEPTH:
+                self.var_init_side_effects += 1
                 logging.error("Max recursion depth reached")
                 with open(self.args.output_dir + "/aot_recursion_error.txt", "w") as file:
                     file.write(
@@ -1454,6 +1611,7 @@ class Init:
                         stub_name = stub_name.strip()
                         stub_name = f"aotstub_{stub_name.split()[-1]}"
 
+                        self.var_init_side_effects += 1
                         if stub_name not in self.stub_names:
                             self.stub_names.add(stub_name)
                         else:
@@ -1759,6 +1917,7 @@ class Init:
                             # case2: we add the member usage info to an entire type of the member
                             # this works but at the disadvantage of having to initialize all instances 
                             # whenever the member is used 
+                            self._invalidate_var_init_cache()
                             if _dst_t['id'] not in self.used_types_data:
                                 self.used_types_data[_dst_t['id']] = _dst_t
                             self.used_types_data[_dst_t['id']]['usedrefs'][member_number] = self.used_types_data[_dst_t['id']]['refs'][member_number] 
@@ -2645,13 +2804,65 @@ class Init:
         # this is supposed to resemble normal sequential execution of a program
         # within each of the functions we need to establish the right order of derefs and function calls
         # since function calls can preceed certain derefs and we operate in a DFS-like way
-
-        DEREF = "deref"
-        CALL = "call"
+        # the DFS is driven by an explicit stack of [f_id, f, functions, ordered, index, derefs_trace] frames
+        # so that deep call chains do not hit the recursion limit
 
         f = self.dbops.fnidmap[f_id]
         if f is None:
             return []
+
+        stack = [[f_id, f, functions, self._get_ordered_derefs_and_calls(f, functions), 0, []]]
+        derefs_trace = None
+        while stack:
+            frame = stack[-1]
+            f_id, f, functions, ordered, index, derefs_trace = frame
+
+            if index == len(ordered):
+                stack.pop()
+                logging.info(f"Collected trace for function {f['name']}")
+                if self.args.debug_derefs:
+                    for deref_entry, _f in _TreeIterator(derefs_trace):
+                        logging.info(f"{_f['id']} : {deref_entry.deref}")
+                if stack:
+                    # return to the caller
+                    self.trace_cache[f_id] = derefs_trace
+                    stack[-1][5].append(derefs_trace)
+                continue
+
+            item = ordered[index]
+            frame[4] += 1
+            if item["type"] == Init.TRACE_DEREF:
+                deref = item["obj"]
+                deref_entry = self.derefs_cache[id(deref)]
+                if deref_entry.no_data():
+                    self.debug_derefs(f"Deref {deref} skipped")
+                else:
+                    derefs_trace.append((deref_entry, f))
+            elif item["type"] == Init.TRACE_CALL:
+                _f_id = item["obj"]
+                _functions = set(functions)
+                if f_id in _functions:
+                    # mark that we processed the current function already
+                    _functions.remove(f_id)
+                if _f_id in self.trace_cache:
+                    derefs_trace.append(self.trace_cache[_f_id])
+                    continue
+                _f = self.dbops.fnidmap[_f_id]
+                if _f is None:
+                    self.trace_cache[_f_id] = []
+                    derefs_trace.append(self.trace_cache[_f_id])
+                    continue
+                stack.append([_f_id, _f, _functions, self._get_ordered_derefs_and_calls(_f, _functions), 0, []])
+
+        return derefs_trace
+
+    # Establish the local order of derefs and calls (to functions in the 'functions' set) in the function f.
+    # Returns a list of {"type": Init.TRACE_DEREF | Init.TRACE_CALL, "id": ord, "obj": deref | call id} items.
+    # @belongs: init
+    def _get_ordered_derefs_and_calls(self, f, functions):
+        DEREF = Init.TRACE_DEREF
+        CALL = Init.TRACE_CALL
+
         self.debug_derefs(f"Collecting derefs for function {f['name']}")
         # first we need to establish a local order of funcs and derefs
         ordered = []
@@ -2945,35 +3156,7 @@ class Init:
 
         logging.debug(f"ordered trace is {ordered}")
 
-        derefs_trace = []
-
-        for item in ordered:
-            if item["type"] == DEREF:
-                deref = item["obj"]
-                deref_entry = self.derefs_cache[id(deref)]
-                if deref_entry.no_data():
-                    self.debug_derefs(f"Deref {deref} skipped")
-                else:
-                    derefs_trace.append((deref_entry, f))
-            elif item["type"] == CALL:
-                _f_id = item["obj"]
-                _functions = set(functions)
-                if f_id in _functions:
-                    # mark that we processed the current function already
-                    _functions.remove(f_id)
-                if _f_id in self.trace_cache:
-                    derefs_trace.append(self.trace_cache[_f_id])
-                else:
-                    ftrace = self._collect_derefs_trace(_f_id, _functions)
-                    self.trace_cache[_f_id] = ftrace
-                    derefs_trace.append(ftrace)
-
-        logging.info(f"Collected trace for function {f['name']}")
-        if self.args.debug_derefs:
-            for deref_entry, f in _TreeIterator(derefs_trace):
-                logging.info(f"{f['id']} : {deref_entry.deref}")
-
-        return derefs_trace
+        return ordered
 
     # -------------------------------------------------------------------------
 
@@ -3881,6 +4064,7 @@ class Init:
     # case of structural types).
     # @belongs: init
     def _discover_casts(self, functions):
+        self._invalidate_var_init_cache()
 
         for f_id in functions:
 
@@ -3946,6 +4130,7 @@ class Init:
 
     # @belongs: init
     def _get_used_types_data(self):
+        self._invalidate_var_init_cache()
         self.used_types_data = {}
         # at this point we know all the functions that are going to be a part of the off-target
         # based on that information let's find out which members of the structural types (records and unions) are used
@@ -12,6 +12,10 @@
 import logging
 import os
 import copy
+import hashlib
+import json
+from outsink import OutputSink
+from codebuffer import CodeBuffer
 
 class OTGenerator:
 
@@ -23,6 +27,9 @@ class OTGenerator:
 
     KFLAT_IMAGE_NAME = "flat.img"
 
+    # the make variables describing the common types header used by the off-target
+    AOT_COMMON_TYPES_MAKEFILE = "aot_common_types.mk"
+
     def __init__(self, dbops, deps, codegen, cutoff, init, args):
         self.dbops = dbops
         self.deps = deps
@@ -31,6 +38,7 @@ class OTGenerator:
         self.init = init
         self.args = args
         self.out_dir = args.output_dir
+        self.out_sink = OutputSink(self.out_dir)
         # mapping original location of a header to the generated header
         self.location_to_header = {}
         self.header_to_location = {}
@@ -53,6 +61,10 @@ class OTGenerator:
 
         self.ot_funcs = set()
 
+        # the shared header with the definitions of the types common to many off-targets
+        self.common_types_header = None
+        self.common_types = []
+
     # -------------------------------------------------------------------------
 
     def set_fid_to_filename(self, fid, filename):
@@ -89,6 +101,8 @@ class OTGenerator:
         # str += Generator.AOT_INCLUDE_MARKER
         str_header, str, name, func_ids, globals_id, types, internal_defs = self._create_src_file(-1, entry_points, all_global_ids, [], static_functions,
                                                                                                   stubs=False, test_driver=True)
+        str = CodeBuffer(str)
+        str_header = CodeBuffer(str_header)
         name = "aot.c"
         # types = set()
         # internal_defs = set()
@@ -137,29 +151,65 @@ class OTGenerator:
                 else:
                     str += f"void aot_init_globals_file_{id}(void);\n"
 
-        main_start = len(str)
+        main_start = str.mark()
 
         str += "\n\n/* ----------------------------- */\n" +\
             "/* Main test driver section      */\n" +\
-            "/* ----------------------------- */\n" +\
-            "int main(int AOT_argc, char* AOT_argv[]) {\n"
+            "/* ----------------------------- */\n"
+        if self.args.libfuzzer:
+            # the one-time setup goes to LLVMFuzzerInitialize and every input is handled
+            # by a separate call to LLVMFuzzerTestOneInput
+            str += "int LLVMFuzzerInitialize(int* AOT_argc, char*** AOT_argv) {\n"
+        else:
+            str += "int main(int AOT_argc, char* AOT_argv[]) {\n"
 
         if self.args.verify_struct_layout:
             str += self.codegen._load_snippet("verify_layout")
             str += "\n\n"
 
         str += "\taot_log_init();\n"
+        if self.args.alloc_arena:
+            str += "\taot_memory_arena_enable(0);\n"
+
+        if self.args.dynamic_init and not self.args.libfuzzer:
+            # with the deferred fork server the image is loaded only once, in the parent process
+            str += "\t#if !defined AFL_PERSISTENT && defined __AFL_HAVE_MANUAL_CONTROL\n"
+            str += f"\taot_kflat_load(\"{self._get_kflat_image()}\");\n"
+            str += "\t__AFL_INIT();\n"
+            str += "\t#endif\n"
 
+        if self.args.libfuzzer:
+            if self.args.init:
+                str += "\tinit_fuzzing(*AOT_argc, *AOT_argv);\n"
+            if self.args.dynamic_init:
+                str += f"\taot_kflat_init(\"{self._get_kflat_image()}\");\n"
+            if self.args.snapshot_globals:
+                str += "\taot_globals_snapshot();\n"
+            str += "\treturn 0;\n"
+            str += "}\n\n"
+            str += "int LLVMFuzzerTestOneInput(const unsigned char* AOT_data, unsigned long AOT_size) {\n"
+            if self.args.snapshot_globals:
+                str += "\taot_globals_restore();\n"
+            if self.args.init:
+                # the input is used in place
+                str += "\tread_fuzzing_data_direct((unsigned char*)AOT_data, AOT_size);\n"
+                str += "\tchar* tmpname = 0;\n"
 
-        if self.args.init:
+        elif self.args.init:
             str += "\tinit_fuzzing(AOT_argc, AOT_argv);\n"
             str += "\t#if defined AFL_PERSISTENT && defined __AFL_HAVE_MANUAL_CONTROL\n"
+            if self.args.snapshot_globals:
+                # every iteration starts with the globals in their initial state
+                str += "\taot_globals_snapshot();\n"
             str += "\tunsigned char *fuzzbuff = __AFL_FUZZ_TESTCASE_BUF;\n"
             str += "\twhile (__AFL_LOOP(10000)) {\n"
+            if self.args.snapshot_globals:
+                str += "\taot_globals_restore();\n"
             str += "\tint len = __AFL_FUZZ_TESTCASE_LEN;\n"
             str += "\tread_fuzzing_data_direct(fuzzbuff, len);\n"
             str += "\t#else\n"
-            str += "\tread_fuzzing_data_file(AOT_argc, AOT_argv);\n"
+            str += "\tif (read_fuzzing_data_shm())\n"
+            str += "\t\tread_fuzzing_data_file(AOT_argc, AOT_argv);\n"
             str += "\t#endif\n"
             str += "\tchar* tmpname = 0;\n"
 
@@ -297,7 +347,7 @@ class OTGenerator:
                         g["name"], self.dbops.typemap[g["type"]], pointers, known_type_names=known_type_names, new_types=new_types,
                         entity_name=g['name'], fuse=0, init_obj=init_obj, data=init_data[g['id']])
                     self.init.add_global_init_data(g['name'], g['id'], init_data)
-                    str += "\t" + tmp_str.replace("\n", "\n\t")
+                    str.append_indented(tmp_str)
 
                 str += "\n"
                 for id in self.fid_to_filename:
@@ -320,11 +370,12 @@ class OTGenerator:
                     obj = _init_data
                     self.init._debug_print_typeuse_obj(obj)
 
-        if self.args.dynamic_init:
-            if self.args.kflat_img:
-                str += "\n\taot_kflat_init(\"%s\");\n" % self.args.kflat_img
-            else:
-                str += "\n\taot_kflat_init(\"%s\");\n" % OTGenerator.KFLAT_IMAGE_NAME
+        if self.args.dynamic_init and not self.args.libfuzzer:
+            str += f"\n\taot_kflat_init(\"{self._get_kflat_image()}\");\n"
+        elif self.args.dynamic_init and globalsInit:
+            # the image was loaded in LLVMFuzzerInitialize, the globals initialized above
+            # get the values from the image again
+            str += "\n\taot_kflat_reinit();\n"
 
         # that is the place we generate function call sites
         # if generate_params is true (default), the function call site is enclosed within braces -> this has to change for the multi-function mode;
@@ -336,16 +387,21 @@ class OTGenerator:
 	        str += "\n\n\t".join([self.codegen._generate_function_call(x, static=(x in static_functions), known_type_names=known_type_names, new_types=new_types, init_vars=init_vars).replace("\n", "\n\t")
                               for x in entry_points]) + "\n"
 
-        if self.args.dynamic_init:
+        if self.args.dynamic_init and not self.args.libfuzzer:
             str += "\taot_kflat_fini();\n\n"
 
         str += "\taot_GC();\n"
-        str += "\t#if defined AFL_PERSISTENT && defined __AFL_HAVE_MANUAL_CONTROL\n"
-        str += "\t}\n"
-        str += "\t#endif\n"
+        if not self.args.libfuzzer:
+            str += "\t#if defined AFL_PERSISTENT && defined __AFL_HAVE_MANUAL_CONTROL\n"
+            str += "\t}\n"
+            str += "\t#endif\n"
         str += "    return 0;\n"
         str += " }\n"
 
+        if self.args.libfuzzer:
+            str += self._get_libfuzzer_main()
+
+        logging.info(f"Var init templates: {len(self.init.var_init_cache)} created, {self.init.var_init_cache_hits} reused")
         logging.info(f"We have the following new types: {new_types}")
         # internal_defs = set()
         additional_types, _ = self.deps._get_types_recursive(
@@ -359,10 +415,7 @@ class OTGenerator:
         for t_id in tmp_str:
             str_header += tmp_str[t_id]
 
-        tmp = str[:main_start]
-        for stub in self.init.fpointer_stubs:
-            tmp += stub
-        str = tmp + str[main_start:]
+        str.insert(main_start, "".join(self.init.fpointer_stubs))
 
         if self.args.init:
             logging.info("We didn't initialize the following globals (static or anonymous type):")
@@ -372,7 +425,32 @@ class OTGenerator:
         for t_id in additional_types:
             types.append(t_id)
 
-        return str_header, str, name, globals_id, types, internal_defs
+        return str_header.getvalue(), str.getvalue(), name, globals_id, types, internal_defs
+
+    # -------------------------------------------------------------------------
+
+    def _get_kflat_image(self):
+        if self.args.kflat_img:
+            return self.args.kflat_img
+        return OTGenerator.KFLAT_IMAGE_NAME
+
+    # -------------------------------------------------------------------------
+
+    # With --libfuzzer the test driver has no main function of its own: libFuzzer provides it.
+    # The variants built without libFuzzer get a main that runs the driver on a single input.
+    def _get_libfuzzer_main(self):
+        str = "\n#ifndef AOT_LIBFUZZER\n"
+        str += "int main(int AOT_argc, char* AOT_argv[]) {\n"
+        str += "\tLLVMFuzzerInitialize(&AOT_argc, &AOT_argv);\n"
+        if self.args.init:
+            str += "\tif (read_fuzzing_data_shm())\n"
+            str += "\t\tread_fuzzing_data_file(AOT_argc, AOT_argv);\n"
+            str += "\treturn LLVMFuzzerTestOneInput(aot_fuzz_buffer, aot_fuzz_buffer_capacity);\n"
+        else:
+            str += "\treturn LLVMFuzzerTestOneInput(0, 0);\n"
+        str += "}\n"
+        str += "#endif\n"
+        return str
 
     # -------------------------------------------------------------------------
 
@@ -407,9 +485,8 @@ class OTGenerator:
 
     # @belongs: otgenerator?
     def _store_item_in_header(self, filename, contents):
-        file_path = f"{self.out_dir}/{filename}"
         _str = ""
-        if not os.path.isfile(file_path):
+        if not self.out_sink.exists(filename):
             _str += self._get_header_guard(filename) + "\n"
             if filename != OTGenerator.AOT_HEADER:
                 _str += f"// Original location of this header: {self.header_to_location[filename]}\n"
@@ -420,8 +497,7 @@ class OTGenerator:
 
         _str += contents
 
-        with open(f"{self.out_dir}/{filename}", "a+") as file:
-            file.write(_str)
+        self.out_sink.write(filename, _str)
 
     # -------------------------------------------------------------------------
 
@@ -461,8 +537,10 @@ class OTGenerator:
 
     # -------------------------------------------------------------------------
 
+    # Get the types, globals and additional declarations required by the given source file;
+    # that doesn't modify any state, so it's safe to run it in a worker process
     # @belongs: otgenerator
-    def _create_src_file(self, fid, functions, globs, includes, static_funcs, stubs=False, test_driver=False, create_header=False):
+    def _get_src_file_types(self, fid, functions, globs, stubs=False):
 
         internal_defs = set()
         if stubs is False:
@@ -488,7 +566,6 @@ class OTGenerator:
         additional_decls = set()
         additional_decls_fdecls = set()
         types = []
-        failed_count = 0
 
         if stubs is False:
             # globals
@@ -565,57 +642,6 @@ class OTGenerator:
         types = self.deps._remove_duplicated_types_from(
             global_types, types_tmp)
 
-        # generate code: types first, then functions
-        failed_count = 0
-
-        str = self.codegen._get_file_header(fid)
-        str_header = self.codegen._get_file_header(fid)
-
-        for h in self.args.include_std_headers:
-            str_header += f"#include {h}\n"
-
-        # before we include headers, lets introduce a define for this file
-        # the define might be used in the header files
-        str += f"#define {self._get_file_define(fid)}\n"
-
-        if test_driver is False:
-            str += "\n\n/* ----------------------------- */\n" +\
-                "/* Includes section              */\n" +\
-                "/* ----------------------------- */\n" +\
-                "#include \"aot_log.h\"\n"
-
-            # "#include <stdio.h>\n" +\
-            # "#include <stdlib.h>\n" +\
-            # "#include <string.h>"
-
-        for i in includes:
-            str += "#include " + i + "\n"
-
-        # str += Generator.AOT_INCLUDE_MARKER + "\n"
-        str += f"#include \"{OTGenerator.AOT_HEADER}\"\n"
-
-        # check if we need to add the replacements include
-        replacements_added = False
-        for f in functions:
-            func = self.dbops.fnidmap[f]
-            if func is not None and replacements_added is False:
-                if "__replacement" in func["body"]:
-                    str += "#include \"aot_replacements.h\"\n"
-                    replacements_added = True
-
-        if fid == OTGenerator.AOT_HEADER_ID:
-            str_header += "\n\n// func decls which might be useful\n"
-            str_header += "void* memset(void* dst, int ch, typeof(sizeof(int)) count);\n"
-            str_header += "void* memcpy(void* dst, const void* src, typeof(sizeof(int)) n);\n"
-            str_header += "void* malloc(typeof(sizeof(int)) size);\n"
-            str_header += "int puts(const char* s);\n"
-            str_header += "int strcmp(const char* a, const char* b);\n"
-
-        logging.debug("name = {}, functions = {}, types = {}".format(
-            name, functions, types))
-
-        # generate code: types first, then functions
-        inserted_funcs = set()
         if stubs is False:
             # in addition, we need to check all functions referenced in the file
             # as they might be defined in other file;
@@ -722,10 +748,85 @@ class OTGenerator:
             # "internal_defs" set should store all the types defined inside other types
             self._filter_internal_types(types, internal_defs)
 
+        return types, global_types, global_fwd_str, global_defs_str, globals_ids, internal_defs, global_type_decls, \
+            add_types, additional_decls, additional_decls_fdecls
+
+    # -------------------------------------------------------------------------
+
+    # @belongs: otgenerator
+    def _create_src_file(self, fid, functions, globs, includes, static_funcs, stubs=False, test_driver=False, create_header=False,
+                         file_types=None):
+
+        if stubs is False:
+            name = "file_{}.c".format(fid)
+        else:
+            name = "file_stub_{}.c".format(fid)
+
+        # file_types can be computed upfront (e.g. in a worker process) with _get_src_file_types
+        if file_types is None:
+            file_types = self._get_src_file_types(fid, functions, globs, stubs)
+        types, global_types, global_fwd_str, global_defs_str, globals_ids, internal_defs, global_type_decls, \
+            add_types, additional_decls, additional_decls_fdecls = file_types
+
+        # generate code: types first, then functions
+        failed_count = 0
+
+        str = CodeBuffer(self.codegen._get_file_header(fid))
+        str_header = CodeBuffer(self.codegen._get_file_header(fid))
+
+        for h in self.args.include_std_headers:
+            str_header += f"#include {h}\n"
+
+        # before we include headers, lets introduce a define for this file
+        # the define might be used in the header files
+        str += f"#define {self._get_file_define(fid)}\n"
+
+        if test_driver is False:
+            str += "\n\n/* ----------------------------- */\n" +\
+                "/* Includes section              */\n" +\
+                "/* ----------------------------- */\n" +\
+                "#include \"aot_log.h\"\n"
+
+            # "#include <stdio.h>\n" +\
+            # "#include <stdlib.h>\n" +\
+            # "#include <string.h>"
+
+        for i in includes:
+            str += "#include " + i + "\n"
+
+        # str += Generator.AOT_INCLUDE_MARKER + "\n"
+        str += f"#include \"{OTGenerator.AOT_HEADER}\"\n"
+
+        # check if we need to add the replacements include
+        replacements_added = False
+        for f in functions:
+            func = self.dbops.fnidmap[f]
+            if func is not None and replacements_added is False:
+                if "__replacement" in func["body"]:
+                    str += "#include \"aot_replacements.h\"\n"
+                    replacements_added = True
+
+        if fid == OTGenerator.AOT_HEADER_ID:
+            str_header += "\n\n// func decls which might be useful\n"
+            str_header += "void* memset(void* dst, int ch, typeof(sizeof(int)) count);\n"
+            str_header += "void* memcpy(void* dst, const void* src, typeof(sizeof(int)) n);\n"
+            str_header += "void* malloc(typeof(sizeof(int)) size);\n"
+            str_header += "int puts(const char* s);\n"
+            str_header += "int strcmp(const char* a, const char* b);\n"
+
+        logging.debug("name = {}, functions = {}, types = {}".format(
+            name, functions, types))
+
+        # generate code: types first, then functions
+        inserted_funcs = set()
+        if stubs is False:
             if self.args.dynamic_init:
                 str_header += "\n/* Dynamic init decls */\n"
                 str_header += "#include \"dyn_init.h\"\n"
 
+            if create_header and self.common_types_header is not None:
+                str_header += self._get_common_types_include(types, internal_defs)
+
             str_header += "\n/* Type decls */\n"
             tmp = []
             tmp += types
@@ -853,7 +954,7 @@ class OTGenerator:
                     t_id, fid, ifgenerated)
             failed_count += failed
 
-        globals_defs = "\n\n// Global vars definitions\n\n"
+        globals_defs = CodeBuffer("\n\n// Global vars definitions\n\n")
         globs_with_typedef = []
         # globals forward
         str_header += "\n/* Forward decls of global vars */\n"
@@ -936,7 +1037,7 @@ class OTGenerator:
                     "/", "__").replace(".", "____").replace("-", "___")))
 
 
-            str += globals_defs
+            str += globals_defs.getvalue()
 
         if stubs == False:
             str_header += "\n/*Static inline headers*/\n"
@@ -989,8 +1090,7 @@ class OTGenerator:
                     str += "\n}\n"
 
             if 0 != failed_count:
-                logging.warning("Code generation failed for " +
-                                str(failed_count) + " types")
+                logging.warning(f"Code generation failed for {failed_count} types")
             types_cnt = len(types) + len(add_types) + len(global_types)
             f_cnt = len(functions)
             self.stats[name] = {}
@@ -1033,7 +1133,7 @@ class OTGenerator:
         ret_funcs |= set(additional_decls)
         ret_funcs |= set(additional_decls_fdecls)
 
-        return str_header, str, name, ret_funcs, globals_ids, list(ret_types), internal_defs
+        return str_header.getvalue(), str.getvalue(), name, ret_funcs, globals_ids, list(ret_types), internal_defs
 
     # --------------------------------------------------------------------------
 
@@ -1092,3 +1192,184 @@ class OTGenerator:
             if f is not None and "inline" in f and f["inline"]:
                 filename = self._create_static_inline_header(f)
                 logging.info(f"Created static / inline header {filename}")
+
+    # -------------------------------------------------------------------------
+
+    # Get the names under which the given type is visible in the C code;
+    # used to detect clashes between the common types and the off-target types
+    def _get_type_names(self, t):
+        names = set()
+        cl = t["class"]
+        if cl == "record_forward" or cl == "enum_forward":
+            # forward declarations never clash
+            return names
+        if cl == "typedef":
+            name = t["name"]
+        else:
+            name = t["str"]
+        if len(name) > 0 and name not in ["*", "typedef", "[N]", "()", "[]"]:
+            names.add(name)
+        if cl == "enum":
+            # enums might clash on their values too
+            for identifier in t["identifiers"]:
+                names.add(f"enum value {identifier}")
+        return names
+
+    # -------------------------------------------------------------------------
+
+    # Create a header with the definitions of the types shared by many off-targets
+    # generated from the same database (e.g. "struct list_head" and its closure)
+    # @path: the path of the header; the description of its contents is stored next to it
+    #        in a JSON file (see load_common_types_header)
+    # @type_ids: the ids of the types the header should be built for; all their dependencies
+    #            are added to the header
+    # @db_identity: the identity of the database the header is valid for
+    # Returns the number of types defined in the header.
+    def create_common_types_header(self, path, type_ids, db_identity):
+        logging.info(f"Creating common types header {path} for {len(type_ids)} types")
+
+        internal_defs = set()
+        types, _ = self.deps._get_types_recursive(list(type_ids), None, internal_defs)
+        types = self.deps._remove_duplicated_types(types)
+        self._filter_internal_types(types, internal_defs)
+
+        # the types that refer to globals or functions need declarations which are specific
+        # to an off-target, so they can't be shared; neither can the types which depend on them
+        excluded = set()
+        common_types = []
+        for t in self.dbops.typemap.get_many(types):
+            t_id = t["id"]
+            defs = set()
+            refs = set()
+            self.deps._discover_type_decls_and_refs(t, defs, refs)
+            uses_globals = "globalrefs" in t
+            for subt in self.dbops.typemap.get_many(list(defs)):
+                if "globalrefs" in subt:
+                    uses_globals = True
+            if uses_globals or len(self.deps._get_funcs_from_types([t_id])) != 0 or \
+                    len(refs & excluded) != 0:
+                excluded.add(t_id)
+                continue
+            common_types.append({"id": t_id, "defs": sorted(defs), "refs": sorted(refs)})
+        # pointers to records are not taken into account by the topological sort, so the types
+        # might refer to the types excluded later on
+        changed = True
+        while changed:
+            changed = False
+            for item in common_types:
+                if item["id"] not in excluded and len(excluded.intersection(item["refs"])) != 0:
+                    excluded.add(item["id"])
+                    changed = True
+        common_types = [item for item in common_types if item["id"] not in excluded]
+        logging.info(f"{len(excluded)} types can't be shared between off-targets")
+
+        type_ids = [item["id"] for item in common_types]
+        version = hashlib.sha256(json.dumps([db_identity, type_ids]).encode()).hexdigest()[:16]
+        guard = f"AOT_COMMON_TYPES_{version.upper()}"
+
+        str = CodeBuffer(self.codegen._get_file_header())
+        str += f"// Common types header version {version}\n"
+        str += f"// Generated for database {db_identity}\n"
+        str += f"#ifndef {guard}\n"
+        str += f"#define {guard}\n"
+        str += "\n/* Type decls */\n"
+        str += self.codegen._get_type_decls(type_ids)
+        types_str, failed = self.codegen._get_type_defs(type_ids)
+        if failed != 0:
+            logging.warning(f"Failed to generate {failed} common type definitions")
+        str += "\n/* Global type defs */\n"
+        for t_id in types_str:
+            str += types_str[t_id]
+        str += f"\n#endif /* {guard} */\n"
+
+        # other generators might be using the header at the same time
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        for filename, contents in [(path, str.getvalue()),
+                                   (f"{path}.json", json.dumps({"version": version, "db": db_identity, "types": common_types}))]:
+            tmp_path = f"{filename}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(contents)
+            os.replace(tmp_path, filename)
+
+        return len(common_types)
+
+    # -------------------------------------------------------------------------
+
+    # Use the common types header created with create_common_types_header in aot.h
+    # Returns False if the header can't be used with the current database
+    def load_common_types_header(self, path, db_identity):
+        try:
+            with open(f"{path}.json", "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            logging.warning(f"Common types header {path} has no valid description, not using it")
+            return False
+        if data["db"] != db_identity:
+            logging.warning(f"Common types header {path} was created for a different database, not using it")
+            return False
+        if not os.path.isfile(path):
+            logging.warning(f"Common types header {path} not found, not using it")
+            return False
+
+        self.common_types_header = os.path.abspath(path)
+        self.common_types = data["types"]
+        logging.info(f"Using common types header {path} version {data['version']} with {len(self.common_types)} types")
+        return True
+
+    # -------------------------------------------------------------------------
+
+    # Get the code including the common types header in aot.h
+    # The header is included as it is, so that it can be precompiled once for all the off-targets.
+    # If some of the common types can't be used in this off-target (e.g. because of name clashes
+    # with the types of the off-target), the header is not used at all and the off-target
+    # defines all its types itself (guarded against the clashes as usual).
+    # The types provided by the header are removed from @types.
+    def _get_common_types_include(self, types, internal_defs):
+
+        def with_dups(ids):
+            result = set()
+            for t_id in ids:
+                result.add(t_id)
+                if t_id in self.deps.dup_types:
+                    result |= set(self.deps.dup_types[t_id])
+            return result
+
+        common_defs = {}
+        for item in self.common_types:
+            common_defs[item["id"]] = with_dups([item["id"]] + item["defs"])
+        all_common_defs = set()
+        for defs in common_defs.values():
+            all_common_defs |= defs
+
+        types_dups = with_dups(types)
+        target_names = set()
+        for t in self.dbops.typemap.get_many(list(set(types) | internal_defs)):
+            if t["id"] not in all_common_defs:
+                target_names |= self._get_type_names(t)
+
+        clashes = 0
+        for item in self.common_types:
+            t_id = item["id"]
+            defs = common_defs[t_id]
+            if len(defs.intersection(self.deps.clash_type_to_file)) != 0:
+                # clashing types are guarded per file in aot.h
+                clashes += 1
+            elif len(defs & internal_defs) != 0 and t_id not in types_dups:
+                # the off-target defines some of the types inside another type
+                clashes += 1
+            else:
+                for t in self.dbops.typemap.get_many(list(defs)):
+                    if len(self._get_type_names(t) & target_names) != 0:
+                        clashes += 1
+                        break
+        if clashes != 0:
+            logging.warning(f"{clashes} common types clash with the off-target types, not using the common types header")
+            return ""
+
+        types[:] = [t_id for t_id in types if t_id not in all_common_defs]
+        logging.info(f"Common types header provides {len(self.common_types)} types")
+
+        self.out_sink.write(OTGenerator.AOT_COMMON_TYPES_MAKEFILE,
+                            f"AOT_COMMON_TYPES_HEADER := {self.common_types_header}\n")
+        return f"\n/* Common types */\n#include \"{self.common_types_header}\"\n"
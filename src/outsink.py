@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+# Auto off-target PoC
+###
+# Copyright  Samsung Electronics
+# Samsung Mobile Security Team @ Samsung R&D Poland
+
+#
+# Output sink module
+#
+# Generated files are streamed to the output directory as soon as they are
+# final instead of being accumulated in memory until the end of the generation.
+# Files that still need to be patched later (e.g. with the static globals
+# initialization code) are written with their markers in place; the sink records
+# the byte offsets of the markers and patches the file on disk when the
+# replacement text becomes known.
+#
+
+import logging
+import os
+import shutil
+
+
+class OutputSink:
+
+    ENCODING = "utf-8"
+    COPY_CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        # the names of all the files written so far, in the order of creation
+        self.filenames = {}
+        # filename -> list of [offset, marker] for the markers still present in the file
+        self.markers = {}
+        self.files_written = 0
+        self.bytes_written = 0
+        self.bytes_patched = 0
+
+    # -------------------------------------------------------------------------
+
+    def _get_path(self, filename):
+        return os.path.join(self.out_dir, filename)
+
+    # -------------------------------------------------------------------------
+
+    def exists(self, filename):
+        return os.path.isfile(self._get_path(filename))
+
+    # -------------------------------------------------------------------------
+
+    # Append contents to the given file in the output directory
+    # @markers: the placeholders that might be patched later on with patch();
+    #           the offsets of all their occurrences in contents are recorded
+    def write(self, filename, contents, markers=None):
+        data = contents.encode(OutputSink.ENCODING)
+        with open(self._get_path(filename), "ab") as file:
+            base = file.tell()
+            file.write(data)
+        self.filenames[filename] = True
+        self.files_written += 1
+        self.bytes_written += len(data)
+
+        if markers:
+            offsets = self.markers.setdefault(filename, [])
+            for marker in markers:
+                _marker = marker.encode(OutputSink.ENCODING)
+                index = data.find(_marker)
+                while index != -1:
+                    offsets.append([base + index, marker])
+                    index = data.find(_marker, index + len(_marker))
+            offsets.sort()
+
+    # -------------------------------------------------------------------------
+
+    # Replace the markers recorded for the given file with the new text
+    # @replacements: a map from the marker to its replacement text
+    # The file is rewritten in a single pass: the parts between the markers are
+    # copied in chunks, so the file contents are never loaded into memory as a whole.
+    def patch(self, filename, replacements):
+        offsets = self.markers.get(filename)
+        if not offsets:
+            logging.warning(f"No markers to patch in file {filename}")
+            return
+
+        path = self._get_path(filename)
+        tmp_path = f"{path}.tmp"
+        remaining = []
+        delta = 0
+        with open(path, "rb") as src, open(tmp_path, "wb") as dst:
+            pos = 0
+            for offset, marker in offsets:
+                if marker not in replacements:
+                    remaining.append([offset + delta, marker])
+                    continue
+                self._copy(src, dst, offset - pos)
+                _marker = marker.encode(OutputSink.ENCODING)
+                src.seek(len(_marker), os.SEEK_CUR)
+                data = replacements[marker].encode(OutputSink.ENCODING)
+                dst.write(data)
+                pos = offset + len(_marker)
+                delta += len(data) - len(_marker)
+                self.bytes_patched += len(data)
+            shutil.copyfileobj(src, dst, OutputSink.COPY_CHUNK_SIZE)
+        os.replace(tmp_path, path)
+
+        self.markers[filename] = remaining
+        self.bytes_written += delta
+
+    # -------------------------------------------------------------------------
+
+    def _copy(self, src, dst, size):
+        while size > 0:
+            chunk = src.read(min(size, OutputSink.COPY_CHUNK_SIZE))
+            if not chunk:
+                break
+            dst.write(chunk)
+            size -= len(chunk)
+
+    # -------------------------------------------------------------------------
+
+    def get_stats(self):
+        return f"{self.files_written} writes, {self.bytes_written} bytes written, {self.bytes_patched} bytes patched"
@@ -13,6 +13,9 @@
 #include <stdlib.h>
 #include <string.h>
 #include <sys/mman.h>
+#ifndef KLEE
+#include <sys/shm.h>
+#endif
 #ifdef DFSAN
 #include <sanitizer/dfsan_interface.h>
 #include <unistd.h>
@@ -32,16 +35,55 @@ FILE* aot_dfsan_logf;
 
 
 int read_fuzzing_data_direct(unsigned char* fuzzbuff, int len) {
+    // the data is only ever read from the buffer, so it's used in place
     aot_file_present = 1;
-    aot_fuzz_buffer = malloc(len);
+    aot_fuzz_buffer = fuzzbuff;
     aot_fuzz_buffer_ptr = aot_fuzz_buffer;
-    memcpy(aot_fuzz_buffer, fuzzbuff, len);
     aot_fuzz_buffer_capacity = len;
     return 0;
 }
 
 
 
+// Read the fuzzer data from a shared memory segment instead of a file.
+// The id of the System V shared memory segment is taken from the AOT_FUZZ_SHM_ID
+// environment variable. Just like the AFL++ shared memory test case delivery
+// the segment starts with the 32-bit length of the test case followed by its data.
+// The data is used in place - there is no file I/O and no copy of the input.
+// Returns -1 if there is no shared memory segment to read from.
+int read_fuzzing_data_shm(void) {
+    #ifndef KLEE
+    const char* shm_id = getenv(AOT_FUZZ_SHM_ENV);
+    if (shm_id == NULL) {
+        return -1;
+    }
+
+    int id = atoi(shm_id);
+    struct shmid_ds info;
+    if (shmctl(id, IPC_STAT, &info)) {
+        printf("Failed to get the shared memory segment %d (%d:%s)\n", id, errno, strerror(errno));
+        exit(1);
+    }
+    unsigned char* shm = shmat(id, NULL, SHM_RDONLY);
+    if (shm == (void*)-1) {
+        printf("Failed to attach the shared memory segment %d (%d:%s)\n", id, errno, strerror(errno));
+        exit(1);
+    }
+
+    unsigned int len;
+    memcpy(&len, shm, sizeof(len));
+    if (info.shm_segsz < sizeof(len) || len > info.shm_segsz - sizeof(len)) {
+        printf("Invalid test case length %u in the shared memory segment %d\n", len, id);
+        exit(1);
+    }
+    return read_fuzzing_data_direct(shm + sizeof(len), len);
+    #else
+    return -1;
+    #endif
+}
+
+
+
 int read_fuzzing_data_file(int argc, char* argv[]) {
     if (argc<2) {
         return 0;
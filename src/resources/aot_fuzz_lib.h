@@ -14,6 +14,8 @@
 
 #define AOT_PROTECTED_PTR 0x04071000 // the start of the mem region used for protecting pointers
 
+#define AOT_FUZZ_SHM_ENV "AOT_FUZZ_SHM_ID" // the id of the shared memory segment with the fuzzer data
+
 
 extern unsigned char* aot_fuzz_buffer;         // buffer stores the data from the fuzzer received as the program input
 extern unsigned char* aot_fuzz_buffer_ptr;     // stores where we currently are in the buffer
@@ -22,6 +24,7 @@ extern unsigned long aot_fuzz_buffer_capacity; // stores the number of bytes rea
 int init_fuzzing(int argc, char* argv[]);
 int read_fuzzing_data_direct(unsigned char* fuzzbuff, int len);
 int read_fuzzing_data_file(int argc, char* argv[]);
+int read_fuzzing_data_shm(void);
 int fuzz_that_data(void* ptr, void* src, unsigned long size, const char* name);
 
 // getting fuzzer data to initialize a bitfield
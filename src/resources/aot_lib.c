@@ -82,15 +82,14 @@ void* krealloc(const void* p, unsigned long new_size, unsigned long flags) {
 #ifdef UNFLATTEN_MARK_FREED
         aot_kflat_mark_freed(p);
 #endif /* UNFLATTEN_MARK_FREED */
-        aot_ptrs_remove(p);
-        free(p);
+        aot_memory_free(p);
 
         return (void*)0x10;
     }
     if (new_size > AOT_MEMDUP_USER_MAX_SIZE) 
         return (void *)(-12);
 
-    return realloc(p, new_size);
+    return aot_memory_realloc(p, new_size);
 }
 #endif
 
@@ -218,8 +217,7 @@ void free_percpu(void* ptr) {
 #ifdef UNFLATTEN_MARK_FREED
     aot_kflat_mark_freed(ptr);
 #endif /* UNFLATTEN_MARK_FREED */
-    aot_ptrs_remove(ptr);
-    free(ptr);
+    aot_memory_free(ptr);
 }
 #endif
 
@@ -231,8 +229,7 @@ void kfree(const void* ptr) {
 #ifdef UNFLATTEN_MARK_FREED
     aot_kflat_mark_freed(ptr);
 #endif /* UNFLATTEN_MARK_FREED */
-    aot_ptrs_remove(ptr);
-    free(ptr);
+    aot_memory_free(ptr);
 }
 #endif
 
@@ -244,8 +241,7 @@ void kvfree(const void *addr) {
 #ifdef UNFLATTEN_MARK_FREED
     aot_kflat_mark_freed(addr);
 #endif /* UNFLATTEN_MARK_FREED */
-    aot_ptrs_remove(addr);
-    free(addr);
+    aot_memory_free(addr);
 }
 #endif
 
@@ -446,8 +442,7 @@ void vfree(void* mem) {
 #ifdef UNFLATTEN_MARK_FREED
     aot_kflat_mark_freed(mem);
 #endif /* UNFLATTEN_MARK_FREED */
-    aot_ptrs_remove(mem);
-    free(mem);
+    aot_memory_free(mem);
 }
 #endif
 
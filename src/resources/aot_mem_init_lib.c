@@ -6,102 +6,382 @@
 
 #include <string.h>
 #include <stdlib.h>
+#include <sys/mman.h>
+#include <unistd.h>
 #include "aot_mem_init_lib.h"
 #include "aot_fuzz_lib.h"
 
+#if defined(__has_feature)
+#if __has_feature(address_sanitizer)
+#define AOT_ASAN
+#endif
+#endif
+#if defined(__SANITIZE_ADDRESS__) && !defined(AOT_ASAN)
+#define AOT_ASAN
+#endif
+
+#ifdef AOT_ASAN
+#include <sanitizer/asan_interface.h>
+#define AOT_POISON(addr, size) ASAN_POISON_MEMORY_REGION(addr, size)
+#define AOT_UNPOISON(addr, size) ASAN_UNPOISON_MEMORY_REGION(addr, size)
+#else
+#define AOT_POISON(addr, size) ((void)(addr), (void)(size))
+#define AOT_UNPOISON(addr, size) ((void)(addr), (void)(size))
+#endif
+
 void* memset(void* dst, int ch, size_t count);
 void* malloc(size_t size);
 void free(void* ptr);
 int printf(const char* format, ...);
 
-struct aot_ptr_node* aot_ptrs_head = 0; // points to the beginning of the aot pointers list
-struct aot_ptr_node* aot_ptrs_tail = 0; // points to the current tail of the aot pointers list
-struct aot_ptr_node* aot_init_vars_head = 0;
-struct aot_ptr_node* aot_init_vars_tail = 0;
+/* ----------------------------- */
+/* Allocation arena */
+/* ----------------------------- */
 
-void _aot_ptrs_append(void* ptr, struct aot_ptr_node** head, struct aot_ptr_node** tail, char* name) {
-	if (!ptr) {
-		return;
+// With the arena enabled (aot_memory_arena_enable) the memory allocated by aot_memory_init_ptr
+// is carved out of large mmapped chunks instead of being allocated one object at a time.
+// aot_GC doesn't free the objects, it just rewinds the chunks so that the next iteration
+// of the persistent fuzzing loop reuses the same memory.
+// Every object is preceded by a 64-byte header (which keeps the objects 64-byte aligned).
+// Under ASAN the headers and the unused parts of the chunks stay poisoned, so they act as
+// redzones between the objects, and each chunk is followed by an inaccessible guard page.
+#define AOT_ARENA_ALIGN 64
+#define AOT_ARENA_MIN_CHUNK_SIZE (16UL * 1024 * 1024)
+
+struct aot_arena_chunk {
+	struct aot_arena_chunk* next;
+	unsigned long size; // the number of bytes available for the objects
+	unsigned long used;
+};
+
+struct aot_arena_object {
+	unsigned long size;
+};
+
+static int aot_arena_enabled = 0;
+static unsigned long aot_arena_chunk_size = AOT_ARENA_MIN_CHUNK_SIZE;
+static struct aot_arena_chunk* aot_arena_head = 0;
+static struct aot_arena_chunk* aot_arena_current = 0;
+
+static char* _aot_arena_chunk_data(struct aot_arena_chunk* chunk) {
+	return (char*)chunk + AOT_ARENA_ALIGN;
+}
+
+static struct aot_arena_chunk* _aot_arena_new_chunk(unsigned long min_size) {
+	unsigned long page_size = sysconf(_SC_PAGESIZE);
+	unsigned long size = aot_arena_chunk_size;
+	while (size < min_size) {
+		size *= 2;
+	}
+	unsigned long map_size = (AOT_ARENA_ALIGN + size + page_size - 1) & ~(page_size - 1);
+#ifdef AOT_ASAN
+	map_size += page_size;
+#endif
+	char* mem = mmap(0, map_size, PROT_READ | PROT_WRITE, MAP_PRIVATE | MAP_ANONYMOUS, -1, 0);
+	if (mem == MAP_FAILED) {
+		return 0;
 	}
+#ifdef AOT_ASAN
+	mprotect(mem + map_size - page_size, page_size, PROT_NONE);
+	map_size -= page_size;
+#endif
+	struct aot_arena_chunk* chunk = (struct aot_arena_chunk*)mem;
+	chunk->next = 0;
+	chunk->size = map_size - AOT_ARENA_ALIGN;
+	chunk->used = 0;
+	AOT_POISON(_aot_arena_chunk_data(chunk), chunk->size);
+	return chunk;
+}
 
-	struct aot_ptr_node* new_node = (struct aot_ptr_node*)malloc(sizeof(struct aot_ptr_node));
-	new_node->ptr = ptr;
-    new_node->next = 0;
-	new_node->name = name;
+static void* _aot_arena_alloc(unsigned long size) {
+	unsigned long needed = AOT_ARENA_ALIGN + ((size + AOT_ARENA_ALIGN - 1) & ~(unsigned long)(AOT_ARENA_ALIGN - 1));
+	struct aot_arena_chunk* chunk = aot_arena_current;
+	// the chunks after the current one are empty, either fresh or rewound by aot_GC
+	while (chunk && chunk->size - chunk->used < needed) {
+		if (!chunk->next) {
+			chunk->next = _aot_arena_new_chunk(needed);
+			if (!chunk->next) {
+				return 0;
+			}
+		}
+		chunk = chunk->next;
+	}
+	if (!chunk) {
+		// the first allocation in the arena
+		chunk = _aot_arena_new_chunk(needed);
+		if (!chunk) {
+			return 0;
+		}
+		aot_arena_head = chunk;
+	}
+	aot_arena_current = chunk;
+
+	char* mem = _aot_arena_chunk_data(chunk) + chunk->used;
+	chunk->used += needed;
+	// the header stays poisoned, we only need to access it when the object is reallocated
+	struct aot_arena_object* header = (struct aot_arena_object*)mem;
+	AOT_UNPOISON(header, sizeof(struct aot_arena_object));
+	header->size = size;
+	AOT_POISON(header, sizeof(struct aot_arena_object));
+	AOT_UNPOISON(mem + AOT_ARENA_ALIGN, size);
+	return mem + AOT_ARENA_ALIGN;
+}
+
+static int _aot_arena_contains(const void* ptr) {
+	for (struct aot_arena_chunk* chunk = aot_arena_head; chunk; chunk = chunk->next) {
+		char* data = _aot_arena_chunk_data(chunk);
+		if ((const char*)ptr >= data && (const char*)ptr < data + chunk->size) {
+			return 1;
+		}
+	}
+	return 0;
+}
+
+static unsigned long _aot_arena_object_size(const void* ptr) {
+	struct aot_arena_object* header = (struct aot_arena_object*)((const char*)ptr - AOT_ARENA_ALIGN);
+	AOT_UNPOISON(header, sizeof(struct aot_arena_object));
+	unsigned long size = header->size;
+	AOT_POISON(header, sizeof(struct aot_arena_object));
+	return size;
+}
 
-	if (!(*head)) { // this is the first item in the list
-		*head = new_node;
-		*tail = new_node;
-	} else {
-		(*tail)->next = new_node;
-		*tail = new_node;
+static void _aot_arena_reset() {
+	for (struct aot_arena_chunk* chunk = aot_arena_head; chunk; chunk = chunk->next) {
+		// under ASAN the use of the objects after aot_GC is detected
+		AOT_POISON(_aot_arena_chunk_data(chunk), chunk->used);
+		chunk->used = 0;
 	}
+	aot_arena_current = aot_arena_head;
 }
 
-int _aot_ptrs_remove(void* ptr, struct aot_ptr_node** head, struct aot_ptr_node** tail){
-	if (!ptr) {
+void aot_memory_arena_enable(unsigned long chunk_size) {
+	aot_arena_enabled = 1;
+	if (chunk_size) {
+		aot_arena_chunk_size = chunk_size;
+	}
+}
+
+/* ----------------------------- */
+/* Pointer tracking */
+/* ----------------------------- */
+
+// The tracked pointers and the init vars are stored in arenas: dense arrays of entries that
+// grow as needed and are never freed, only reset by aot_GC. The entries are indexed with
+// open-addressing hash tables. Every slot of a table is stamped with the generation it was
+// filled in; aot_GC starts a new generation, which empties the tables in O(1).
+#define AOT_TABLE_MIN_SIZE 1024
+#define AOT_SLOT_DELETED ((unsigned long)-1)
+
+struct aot_table_slot {
+	unsigned long index; // the index of the entry in the arena or AOT_SLOT_DELETED
+	unsigned int gen;
+};
+
+struct aot_table {
+	struct aot_table_slot* slots;
+	unsigned long size; // always a power of 2
+	unsigned long used; // the number of slots used in the current generation (including deleted)
+	unsigned int gen;
+};
+
+struct aot_init_var {
+	void* ptr;
+	const char* name;
+};
+
+// the pointers allocated by aot_memory_init_ptr; the removed pointers are set to 0
+static void** aot_ptrs = 0;
+static unsigned long aot_ptrs_count = 0;
+static unsigned long aot_ptrs_capacity = 0;
+static unsigned long aot_ptrs_live = 0;
+static struct aot_table aot_ptrs_table = { 0 };
+
+static struct aot_init_var* aot_init_vars = 0;
+static unsigned long aot_init_vars_count = 0;
+static unsigned long aot_init_vars_capacity = 0;
+static struct aot_table aot_init_vars_table = { 0 };
+
+static unsigned long _aot_hash_ptr(void* ptr) {
+	unsigned long long h = (unsigned long long)ptr;
+	h ^= h >> 33;
+	h *= 0xff51afd7ed558ccdULL;
+	h ^= h >> 33;
+	return (unsigned long)h;
+}
+
+static unsigned long _aot_hash_name(const char* name) {
+	// FNV-1a
+	unsigned long long h = 0xcbf29ce484222325ULL;
+	while (*name) {
+		h ^= (unsigned char)*name++;
+		h *= 0x100000001b3ULL;
+	}
+	return (unsigned long)h;
+}
+
+static int _aot_grow_arena(void** arena, unsigned long* capacity, unsigned long count, unsigned long entry_size) {
+	if (count < *capacity) {
 		return 0;
 	}
+	unsigned long new_capacity = *capacity ? 2 * *capacity : AOT_TABLE_MIN_SIZE;
+	void* tmp = realloc(*arena, new_capacity * entry_size);
+	if (!tmp) {
+		return -1;
+	}
+	*arena = tmp;
+	*capacity = new_capacity;
+	return 0;
+}
+
+static void _aot_table_reset(struct aot_table* table) {
+	table->gen++;
+	table->used = 0;
+	if (!table->gen) {
+		// the generations wrapped around: the old stamps could be mistaken for the current ones
+		memset(table->slots, 0, table->size * sizeof(struct aot_table_slot));
+		table->gen = 1;
+	}
+}
+
+static int _aot_table_slot_used(struct aot_table* table, unsigned long i) {
+	return table->slots[i].gen == table->gen;
+}
 
-	if (!(*head)) {
-		// the list is empty
+// make sure there is room for one more entry; when the table is rehashed the deleted slots
+// are dropped and the live entries are re-inserted using hash_entry on their arena indices
+static int _aot_table_reserve(struct aot_table* table, unsigned long (*hash_entry)(unsigned long)) {
+	if (table->gen == 0) {
+		table->gen = 1;
+	}
+	if (table->slots && 4 * (table->used + 1) <= 3 * table->size) {
 		return 0;
 	}
-	struct aot_ptr_node* tmp = *head;
-	struct aot_ptr_node* prev_tmp = 0;
-	while (tmp) {
-		if (tmp->ptr == ptr) {
-			if (tmp == *head) {
-				*head = tmp->next;
-			}
-			else if (tmp == *tail) {
-				*tail = prev_tmp;
-				(*tail)->next = 0;
-			}
-			else {
-				prev_tmp->next = tmp->next;
-			}
-			// free the node
-			free(tmp);
-			return 0;
+
+	struct aot_table old = *table;
+	unsigned long new_size = old.size ? old.size : AOT_TABLE_MIN_SIZE;
+	unsigned long live = 0;
+	for (unsigned long i = 0; i < old.size; ++i) {
+		if (old.slots[i].gen == old.gen && old.slots[i].index != AOT_SLOT_DELETED) {
+			live++;
+		}
+	}
+	while (4 * (live + 1) > 2 * new_size) {
+		new_size *= 2;
+	}
+
+	struct aot_table_slot* slots = (struct aot_table_slot*)calloc(new_size, sizeof(struct aot_table_slot));
+	if (!slots) {
+		return -1;
+	}
+	table->slots = slots;
+	table->size = new_size;
+	table->used = 0;
+	table->gen = 1;
+	for (unsigned long i = 0; i < old.size; ++i) {
+		if (old.slots[i].gen != old.gen || old.slots[i].index == AOT_SLOT_DELETED) {
+			continue;
 		}
-		prev_tmp = tmp;
-		tmp = tmp->next;
+		unsigned long j = hash_entry(old.slots[i].index) & (new_size - 1);
+		while (_aot_table_slot_used(table, j)) {
+			j = (j + 1) & (new_size - 1);
+		}
+		table->slots[j].index = old.slots[i].index;
+		table->slots[j].gen = table->gen;
+		table->used++;
 	}
-	return 1;
+	free(old.slots);
+	return 0;
 }
 
+static unsigned long _aot_hash_ptr_entry(unsigned long index) {
+	return _aot_hash_ptr(aot_ptrs[index]);
+}
+
+static unsigned long _aot_hash_init_var_entry(unsigned long index) {
+	return _aot_hash_name(aot_init_vars[index].name);
+}
+
+// returns the slot holding the pointer or the slot to insert it into
+static unsigned long _aot_ptrs_find(void* ptr, int* found) {
+	unsigned long mask = aot_ptrs_table.size - 1;
+	unsigned long i = _aot_hash_ptr(ptr) & mask;
+	unsigned long insert_at = AOT_SLOT_DELETED;
+	*found = 0;
+	while (_aot_table_slot_used(&aot_ptrs_table, i)) {
+		unsigned long index = aot_ptrs_table.slots[i].index;
+		if (index == AOT_SLOT_DELETED) {
+			if (insert_at == AOT_SLOT_DELETED) {
+				insert_at = i;
+			}
+		} else if (aot_ptrs[index] == ptr) {
+			*found = 1;
+			return i;
+		}
+		i = (i + 1) & mask;
+	}
+	return insert_at != AOT_SLOT_DELETED ? insert_at : i;
+}
 
 void aot_ptrs_append(void* ptr) {
-	_aot_ptrs_append(ptr, &aot_ptrs_head, &aot_ptrs_tail, 0);
+	if (!ptr) {
+		return;
+	}
+	if (_aot_grow_arena((void**)&aot_ptrs, &aot_ptrs_capacity, aot_ptrs_count, sizeof(void*)) ||
+		_aot_table_reserve(&aot_ptrs_table, _aot_hash_ptr_entry)) {
+		printf("Failed to track pointer %p\n", ptr);
+		return;
+	}
+
+	int found;
+	unsigned long i = _aot_ptrs_find(ptr, &found);
+	if (found) {
+		return;
+	}
+	if (!_aot_table_slot_used(&aot_ptrs_table, i)) {
+		aot_ptrs_table.used++;
+	}
+	aot_ptrs[aot_ptrs_count] = ptr;
+	aot_ptrs_table.slots[i].index = aot_ptrs_count++;
+	aot_ptrs_table.slots[i].gen = aot_ptrs_table.gen;
+	aot_ptrs_live++;
 }
 
 int aot_ptrs_remove(void* ptr) {
-	return _aot_ptrs_remove(ptr, &aot_ptrs_head, &aot_ptrs_tail);
+	if (!ptr) {
+		return 0;
+	}
+
+	if (!aot_ptrs_live) {
+		// no pointers are tracked
+		return 0;
+	}
+	int found;
+	unsigned long i = _aot_ptrs_find(ptr, &found);
+	if (!found) {
+		return 1;
+	}
+	aot_ptrs[aot_ptrs_table.slots[i].index] = 0;
+	aot_ptrs_table.slots[i].index = AOT_SLOT_DELETED;
+	aot_ptrs_live--;
+	return 0;
 }
 
 void aot_GC() {
-	// iterate through the pointers list and free the memory
-	while (aot_ptrs_head) {
-		// free the pointer
-		if (aot_ptrs_head->ptr) {
-			free(aot_ptrs_head->ptr);
+	// free the memory in the order of allocation
+	for (unsigned long i = 0; i < aot_ptrs_count; ++i) {
+		if (aot_ptrs[i]) {
+			free(aot_ptrs[i]);
 		}
-		// free the node
-		struct aot_ptr_node* tmp = aot_ptrs_head;
-		aot_ptrs_head = tmp->next;
-		free(tmp);		
 	}
-	aot_ptrs_head = 0;
-	aot_ptrs_tail = 0;
-	while (aot_init_vars_head) {
-		// free the node
-		struct aot_ptr_node* tmp = aot_init_vars_head;
-		aot_init_vars_head = tmp->next;
-		free(tmp);		
+	// the arenas and the tables are kept for the next iteration
+	aot_ptrs_count = 0;
+	aot_ptrs_live = 0;
+	_aot_table_reset(&aot_ptrs_table);
+	aot_init_vars_count = 0;
+	_aot_table_reset(&aot_init_vars_table);
+	if (aot_arena_enabled) {
+		_aot_arena_reset();
 	}
-	aot_init_vars_head = 0;
-	aot_init_vars_tail = 0;
 }
 
 /* ----------------------------- */
@@ -119,13 +399,21 @@ int aot_memory_init(void* ptr, unsigned long long size, int fuzz, const char* na
 
 int aot_memory_init_ptr(void** ptr, unsigned long size, unsigned long count, int fuzz, const char* name) {
 	unsigned total_size = size * count;
-	// make UBSAN happy by requesting the allocated pointers to be 64bytes aligned
-	int ret = posix_memalign(ptr, 64, total_size);
-	if (ret)
-		return -1;
+	if (aot_arena_enabled) {
+		// the arena objects are 64bytes aligned too and are released by aot_GC all at once
+		*ptr = _aot_arena_alloc(total_size);
+		if (!*ptr)
+			return -1;
+	}
+	else {
+		// make UBSAN happy by requesting the allocated pointers to be 64bytes aligned
+		int ret = posix_memalign(ptr, 64, total_size);
+		if (ret)
+			return -1;
 
-    // add the allocated pointer to the list
-	aot_ptrs_append(*ptr);
+		// add the allocated pointer to the list
+		aot_ptrs_append(*ptr);
+	}
 
     if (!fuzz) {
         memset(*ptr, 0, total_size);
@@ -158,10 +446,46 @@ int aot_protect_ptr(void** ptr) {
 
 void aot_memory_free_ptr(void** ptr) {
 	if (0 != *ptr)
-		free(*ptr);
+		aot_memory_free(*ptr);
 	*ptr = 0;
 }
 
+void aot_memory_free(const void* ptr) {
+	if (aot_arena_enabled && _aot_arena_contains(ptr)) {
+		// the memory is reused after aot_GC, until then any access to it is reported by ASAN
+		AOT_POISON((void*)ptr, _aot_arena_object_size(ptr));
+		return;
+	}
+	// make sure aot_GC doesn't free it again
+	aot_ptrs_remove((void*)ptr);
+	free((void*)ptr);
+}
+
+void* aot_memory_realloc(const void* ptr, unsigned long size) {
+	if (aot_arena_enabled && ptr && _aot_arena_contains(ptr)) {
+		unsigned long old_size = _aot_arena_object_size(ptr);
+		void* new_ptr = _aot_arena_alloc(size);
+		if (new_ptr) {
+			memcpy(new_ptr, ptr, old_size < size ? old_size : size);
+			AOT_POISON((void*)ptr, old_size);
+		}
+		return new_ptr;
+	}
+	int found = 0;
+	if (ptr && aot_ptrs_live) {
+		_aot_ptrs_find((void*)ptr, &found);
+	}
+	if (found) {
+		aot_ptrs_remove((void*)ptr);
+	}
+	void* new_ptr = realloc((void*)ptr, size);
+	if (found) {
+		// keep tracking the memory that was allocated by aot_memory_init_ptr
+		aot_ptrs_append(new_ptr ? new_ptr : (void*)ptr);
+	}
+	return new_ptr;
+}
+
 
 /* this function was added to make it possible to set pointers regardless 
 of their const qualifiers */
@@ -183,22 +507,75 @@ int aot_check_init_status(char* name, int status) {
 }
 
 void aot_register_init_var(void* ptr, const char* name) {
-	_aot_ptrs_append(ptr, &aot_init_vars_head, &aot_init_vars_tail, name);
+	if (!ptr || !name) {
+		return;
+	}
+	if (_aot_grow_arena((void**)&aot_init_vars, &aot_init_vars_capacity, aot_init_vars_count, sizeof(struct aot_init_var)) ||
+		_aot_table_reserve(&aot_init_vars_table, _aot_hash_init_var_entry)) {
+		printf("Failed to register init var %s\n", name);
+		return;
+	}
+
+	unsigned long mask = aot_init_vars_table.size - 1;
+	unsigned long i = _aot_hash_name(name) & mask;
+	while (_aot_table_slot_used(&aot_init_vars_table, i)) {
+		if (!strcmp(aot_init_vars[aot_init_vars_table.slots[i].index].name, name)) {
+			// the var registered first is the one fetched
+			return;
+		}
+		i = (i + 1) & mask;
+	}
+	aot_init_vars[aot_init_vars_count].ptr = ptr;
+	aot_init_vars[aot_init_vars_count].name = name;
+	aot_init_vars_table.slots[i].index = aot_init_vars_count++;
+	aot_init_vars_table.slots[i].gen = aot_init_vars_table.gen;
+	aot_init_vars_table.used++;
 }
 
 void* aot_fetch_init_var(const char* name) {
-	// iterate through the pointers list and find the pointer by name
-	struct aot_ptr_node* node = aot_init_vars_head;
-
-	if (!node) {
-		// the list is empty
+	if (!aot_init_vars_count) {
+		// no vars registered
 		return 0;
 	}
-	while (node) {
-		if (node->name && !strcmp(node->name, name)) {
-			return node->ptr;
+
+	unsigned long mask = aot_init_vars_table.size - 1;
+	unsigned long i = _aot_hash_name(name) & mask;
+	while (_aot_table_slot_used(&aot_init_vars_table, i)) {
+		struct aot_init_var* var = &aot_init_vars[aot_init_vars_table.slots[i].index];
+		if (!strcmp(var->name, name)) {
+			return var->ptr;
 		}
-		node = node->next;
+		i = (i + 1) & mask;
+	}
+	return 0;
+}
+
+/* ----------------------------- */
+/* Global state snapshots */
+/* ----------------------------- */
+
+// The bounds of the section with the AOT_GLOBAL_STATE globals are provided by the linker;
+// they are weak so that they are null when there are no such globals
+extern char __start_aot_globals[] __attribute__((weak));
+extern char __stop_aot_globals[] __attribute__((weak));
+static char* aot_globals_data = 0;
+
+void aot_globals_snapshot(void) {
+	unsigned long size = __stop_aot_globals - __start_aot_globals;
+	if (!size) {
+		return;
 	}
+	free(aot_globals_data);
+	aot_globals_data = malloc(size);
+	if (!aot_globals_data) {
+		printf("Failed to take a snapshot of the globals (%lu bytes)\n", size);
+		return;
+	}
+	memcpy(aot_globals_data, __start_aot_globals, size);
 }
 
+void aot_globals_restore(void) {
+	if (aot_globals_data) {
+		memcpy(__start_aot_globals, aot_globals_data, __stop_aot_globals - __start_aot_globals);
+	}
+}
@@ -8,11 +8,14 @@
 #ifndef AOT_MEM_INIT_LIB_H
 #define AOT_MEM_INIT_LIB_H
 
-struct aot_ptr_node {
-    struct aot_ptr_node* next;
-    void* ptr;
-    char* name;
-};
+// The globals generated with --snapshot-globals are placed in a single section, so that their
+// state can be saved once and restored before each iteration of the persistent fuzzing loop.
+// ASAN would put redzones between them, so they are not instrumented.
+#if defined(__clang__)
+#define AOT_GLOBAL_STATE __attribute__((section("aot_globals"), no_sanitize("address")))
+#else
+#define AOT_GLOBAL_STATE __attribute__((section("aot_globals")))
+#endif
 
 int aot_memory_init(void* ptr, unsigned long long size, int fuzz, const char* name);
 int aot_memory_init_ptr(void** ptr, unsigned long size, unsigned long count, int fuzz, const char* name);
@@ -20,6 +23,9 @@ unsigned long long aot_memory_init_bitfield(unsigned int bitcount, int fuzz, con
 int aot_memory_init_func_ptr(void** dst, void* src);
 int aot_protect_ptr(void** ptr);
 void aot_memory_free_ptr(void** ptr);
+void aot_memory_free(const void* ptr);
+void* aot_memory_realloc(const void* ptr, unsigned long size);
+void aot_memory_arena_enable(unsigned long chunk_size);
 void aot_ptrs_append(void* ptr);
 int aot_ptrs_remove(void* ptr);
 void aot_GC();
@@ -28,4 +34,6 @@ void aot_memory_setint(void* ptr, unsigned long int val, unsigned size);
 int aot_check_init_status(char* name, int status);
 void aot_register_init_var(void* ptr, const char* name);
 void* aot_fetch_init_var(const char* name);
+void aot_globals_snapshot(void);
+void aot_globals_restore(void);
 #endif
\ No newline at end of file
@@ -14,8 +14,10 @@
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
+#include <stddef.h>
 #include <sys/mman.h>
 #include <sys/ioctl.h>
+#include <sys/stat.h>
 #include <unistd.h>
 
 #include "aot_recall.h"
@@ -33,6 +35,13 @@
 // Global handler to opened file
 static FILE* file;
 
+// Records written to the recall file are accumulated in memory and written out
+//  in large chunks. The buffer is flushed with plain write() calls, so that it
+//  can be done from the signal and ASAN error handlers too.
+#define FL_BUFFER_SIZE (1024 * 1024)
+static char flBuffer[FL_BUFFER_SIZE];
+static size_t flBufferUsed;
+
 // File structure
 struct FL_file_header {
     long long magic;
@@ -67,6 +76,10 @@ struct FL_file_field {
     };
 };
 
+// The data that doesn't fit in the field directly follows it in the file
+_Static_assert(offsetof(struct FL_file_field, data.data) + sizeof(((struct FL_file_data*)0)->data) == sizeof(struct FL_file_field),
+    "the data of the data field has to be stored at the end of the field");
+
 // User interface
 struct FL_data {
     void* dst;
@@ -95,6 +108,40 @@ struct FL_content {
 static void fl_close_atexit(void);
 static void fl_close(int);
 
+static int fl_write_all(FILE* f, const void* data, size_t size) {
+    const char* ptr = data;
+    while(size > 0) {
+        ssize_t ret = write(fileno(f), ptr, size);
+        if(ret < 0) {
+            if(errno == EINTR)
+                continue;
+            return -1;
+        }
+        ptr += ret;
+        size -= ret;
+    }
+    return 0;
+}
+
+static int fl_flush(FILE* f) {
+    int ret = fl_write_all(f, flBuffer, flBufferUsed);
+    flBufferUsed = 0;
+    return ret;
+}
+
+static int fl_write(const void* data, size_t size) {
+    if(flBufferUsed + size > FL_BUFFER_SIZE) {
+        if(fl_flush(file))
+            return -1;
+        // Big chunks of data aren't worth copying
+        if(size > FL_BUFFER_SIZE / 2)
+            return fl_write_all(file, data, size);
+    }
+    memcpy(flBuffer + flBufferUsed, data, size);
+    flBufferUsed += size;
+    return 0;
+}
+
 static int fl_file_open(const char* filename, const char* mode) {
     int ret;
     
@@ -121,8 +168,9 @@ int fl_create(const char* filename) {
     ret = fl_file_open(filename, "wb");
     if(ret) return ret;
 
-    ret = fwrite(&hdr, sizeof(hdr), 1, file);
-    if(!ret) {
+    flBufferUsed = 0;
+    ret = fl_write(&hdr, sizeof(hdr));
+    if(ret) {
         AOT_RECALL_ERR("failed to write file header (%d)%s", errno, strerror(errno));
         return -1;
     }
@@ -167,73 +215,81 @@ static int fl_open(const char* filename) {
     return 0;
 }
 
+// Append an element to the growable array, doubling its capacity when needed
+static void* fl_grow(void* array, size_t* capacity, size_t count, size_t elemSize) {
+    if(count < *capacity)
+        return array;
+
+    size_t newCapacity = *capacity ? *capacity * 2 : 64;
+    void* tmp = realloc(array, newCapacity * elemSize);
+    if(tmp == NULL) {
+        AOT_RECALL_ERR("failed to allocate memory (%d)%s", errno, strerror(errno));
+        free(array);
+        return NULL;
+    }
+    *capacity = newCapacity;
+    return tmp;
+}
+
 static int fl_load(struct FL_content* content) {
-    int ret = 1;
-    int dataLen = 0, argsLen = 0, othersLen = 0;
+    struct stat st;
     struct FL_file_field field;
+    size_t argsCap = 0, dataCap = 0, othersCap = 0;
+    size_t offset = sizeof(struct FL_file_header);
 
-    // Count number of elements
-    while(ret) {
-        ret = fread(&field, sizeof(field), 1, file);
-        if(!ret) continue;
-
-        if(field.type == FL_FIELD_ARG)
-            argsLen++;
-        else if(field.type == FL_FIELD_OTHER)
-            othersLen++;
-        else if(field.type == FL_FIELD_DATA) {
-            int remSize = field.data.size - sizeof(field.data.data);
-            if(remSize > 0)
-                fseek(file, remSize, SEEK_CUR);
-            dataLen++;
-        } else {
-            AOT_RECALL_ERR("input isn't a correct FL file (unknown field type %d)", field.type);
-            return -1;
-        }
-    }
-    fseek(file, sizeof(struct FL_file_header), SEEK_SET);
+    memset(content, 0, sizeof(*content));
 
-    // Read elements to user memory
-    int argCnt = 0, dataCnt = 0, otherCnt = 0;
-    ret = 1;
-    content->argsLen = argsLen;
-    content->dataLen = dataLen;
-    content->othersLen = othersLen;
-    content->args = malloc(sizeof(struct FL_args) * argsLen);
-    content->data = malloc(sizeof(struct FL_data) * dataLen);
-    content->others = malloc(sizeof(struct FL_other) * othersLen);
+    // Map the whole file at once - the data of the fields is used in place
+    //  instead of being copied out of the file
+    if(fstat(fileno(file), &st)) {
+        AOT_RECALL_ERR("failed to stat FL file (%d)%s", errno, strerror(errno));
+        return -1;
+    }
+    size_t fileSize = st.st_size;
+    char* image = mmap(NULL, fileSize, PROT_READ, MAP_PRIVATE, fileno(file), 0);
+    if(image == MAP_FAILED) {
+        AOT_RECALL_ERR("failed to map FL file (%d)%s", errno, strerror(errno));
+        return -1;
+    }
 
-    while(ret) {
-        ret = fread(&field, sizeof(field), 1, file);
-        if(!ret) continue;
+    // Index all elements in a single pass
+    while(offset + sizeof(field) <= fileSize) {
+        memcpy(&field, image + offset, sizeof(field));
 
         if(field.type == FL_FIELD_ARG) {
-            content->args[argCnt].ptr = field.arg.ptr;
-            strncpy(content->args[argCnt].name, field.arg.name, sizeof(field.arg.name));
-            argCnt++;
+            content->args = fl_grow(content->args, &argsCap, content->argsLen, sizeof(struct FL_args));
+            if(content->args == NULL) return -1;
+            struct FL_args* args = &content->args[content->argsLen++];
+            args->ptr = field.arg.ptr;
+            strncpy(args->name, field.arg.name, sizeof(field.arg.name));
         } else if(field.type == FL_FIELD_OTHER) {
-            content->others[otherCnt].type = field.other.type;
-            memcpy(content->others[otherCnt].value, field.other.value, sizeof(field.other.value));
-            otherCnt++;
+            content->others = fl_grow(content->others, &othersCap, content->othersLen, sizeof(struct FL_other));
+            if(content->others == NULL) return -1;
+            struct FL_other* other = &content->others[content->othersLen++];
+            other->type = field.other.type;
+            memcpy(other->value, field.other.value, sizeof(field.other.value));
         } else if(field.type == FL_FIELD_DATA) {
-            struct FL_data* data = &content->data[dataCnt];
+            // The first bytes of data are stored in the field, the rest directly follows it
+            size_t dataOffset = offset + offsetof(struct FL_file_field, data.data);
+            size_t remSize = field.data.size > sizeof(field.data.data) ? field.data.size - sizeof(field.data.data) : 0;
+            if(offset + sizeof(field) + remSize > fileSize) {
+                AOT_RECALL_ERR("input isn't a correct FL file (truncated file)");
+                return -1;
+            }
+
+            content->data = fl_grow(content->data, &dataCap, content->dataLen, sizeof(struct FL_data));
+            if(content->data == NULL) return -1;
+            struct FL_data* data = &content->data[content->dataLen++];
             data->dst = field.data.dst;
             data->src = field.data.src;
             data->size = field.data.size;
-            data->data = malloc(field.data.size);
-
-            if(field.data.size <= 16) {
-                memcpy(data->data, field.data.data, field.data.size);
-            } else {
-                memcpy(data->data, field.data.data, 16);
-                ret = fread(data->data + 16, field.data.size - 16, 1, file);
-                if(!ret) {
-                    AOT_RECALL_ERR("input isn't a correct FL file (truncated file)");
-                    return -1;
-                }
-            }
-            dataCnt++;
+            data->data = image + dataOffset;
+            offset += remSize;
+        } else {
+            AOT_RECALL_ERR("input isn't a correct FL file (unknown field type %d)", field.type);
+            return -1;
         }
+        offset += sizeof(field);
     }
 
     return 0;
@@ -261,16 +317,14 @@ int fl_add(void* dst, void* src, unsigned long long size, void* data) {
     else 
         memcpy(field.data.data, data, 16);
     
-    ret = fwrite(&field, sizeof(field), 1, file);
-    if(!ret) goto failed_write;
+    ret = fl_write(&field, sizeof(field));
+    if(ret) goto failed_write;
 
     if(size > 16) {
-        ret = fwrite(data + 16, size - 16, 1, file);
-        if(!ret) goto failed_write;
+        ret = fl_write(data + 16, size - 16);
+        if(ret) goto failed_write;
     }
 
-    fflush(file);
-
     return 0;
 
 failed_write:
@@ -294,13 +348,11 @@ int fl_save_arg(void* ptr, const char* name) {
     strncpy(field.arg.name, name, sizeof(field.arg.name));
 
     AOT_RECALL_INFO("ptr = %p, name=%s", ptr, name);
-    ret = fwrite(&field, sizeof(field), 1, file);
-    if(!ret) {
+    ret = fl_write(&field, sizeof(field));
+    if(ret) {
         AOT_RECALL_ERR("failed to write arg to FL file (%d)%s", errno, strerror(errno));
     }
 
-    fflush(file);
-
     return 0;
 }
 
@@ -319,13 +371,11 @@ int fl_save_other(int type, const char* value) {
         return 0;
 
     AOT_RECALL_INFO("type = %d, value=%p", type, value);
-    ret = fwrite(&field, sizeof(field), 1, file);
-    if(!ret) {
+    ret = fl_write(&field, sizeof(field));
+    if(ret) {
         AOT_RECALL_ERR("failed to write param to FL file (%d)%s", errno, strerror(errno));
     }
 
-    fflush(file);
-
     return 0;
 }
 
@@ -363,6 +413,9 @@ static void _fl_close_file() {
     if(fcopy == NULL)
         return;
 
+    // Write out the records still kept in memory
+    if(fl_flush(fcopy))
+        AOT_RECALL_ERR("failed to write FL file (%d)%s", errno, strerror(errno));
     fclose(fcopy);
     AOT_RECALL_INFO("closed recall file");
 }
@@ -385,27 +438,62 @@ static void fl_close_atexit(void) {
 /****************************
  * AoT Recall simple data types
  ****************************/
-struct stupid_hashmap {
+struct ptr_hashmap_entry {
     void* key;
     void* value;
+    bool used;
 };
-static const size_t max_ptrs = 1000000;
-static struct stupid_hashmap ptrs[max_ptrs];
+static struct ptr_hashmap_entry* ptrs;
+static size_t ptrsCapacity;     // always a power of 2
 static size_t ptrsCnt;
 
+static size_t hashPtr(void* ptr) {
+    unsigned long long h = (unsigned long long) ptr;
+    h ^= h >> 33;
+    h *= 0xff51afd7ed558ccdULL;
+    h ^= h >> 33;
+    return h;
+}
+
+// Returns the entry with the given key or the empty entry it should be inserted into
+static struct ptr_hashmap_entry* findPtr(struct ptr_hashmap_entry* map, size_t capacity, void* orig) {
+    size_t i = hashPtr(orig) & (capacity - 1);
+    while(map[i].used && map[i].key != orig)
+        i = (i + 1) & (capacity - 1);
+    return &map[i];
+}
+
 static void* getPtr(void* orig) {
-    for(int i = 0; i < ptrsCnt; i++)
-        if(ptrs[i].key == orig)
-            return ptrs[i].value;
-    return NULL;
+    if(ptrsCnt == 0)
+        return NULL;
+
+    struct ptr_hashmap_entry* entry = findPtr(ptrs, ptrsCapacity, orig);
+    return entry->used ? entry->value : NULL;
 }
 static void addPtr(void* orig, void* ptr) {
-    if(ptrsCnt >= max_ptrs) {
-        AOT_RECALL_ERR("failed to load recall image - too many memory fragments");
-        exit(1);
+    // Keep the load factor below 1/2
+    if(2 * (ptrsCnt + 1) > ptrsCapacity) {
+        size_t newCapacity = ptrsCapacity ? ptrsCapacity * 2 : 1024;
+        struct ptr_hashmap_entry* newPtrs = calloc(newCapacity, sizeof(struct ptr_hashmap_entry));
+        if(newPtrs == NULL) {
+            AOT_RECALL_ERR("failed to load recall image - too many memory fragments");
+            exit(1);
+        }
+        for(size_t i = 0; i < ptrsCapacity; i++)
+            if(ptrs[i].used)
+                *findPtr(newPtrs, newCapacity, ptrs[i].key) = ptrs[i];
+        free(ptrs);
+        ptrs = newPtrs;
+        ptrsCapacity = newCapacity;
     }
-    ptrs[ptrsCnt].key = orig;
-    ptrs[ptrsCnt].value = ptr;
+
+    // The first fragment recorded for the given address wins
+    struct ptr_hashmap_entry* entry = findPtr(ptrs, ptrsCapacity, orig);
+    if(entry->used)
+        return;
+    entry->key = orig;
+    entry->value = ptr;
+    entry->used = true;
     ptrsCnt++;
 }
 
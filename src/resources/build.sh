@@ -20,15 +20,20 @@ function compile_fail {
     exit 1
 }
 
-make clean &>/dev/null && make asan   &>asan_build.log   || compile_fail "asan"
-make clean &>/dev/null && make ubsan  &>ubsan_build.log  || compile_fail "ubsan"
-make clean &>/dev/null && make dfsan  &>dfsan_build.log  || compile_fail "dfsan"
-make clean &>/dev/null && make gcov   &>gcov_build.log   || compile_fail "gcov"
-make clean &>/dev/null && make afl    &>afl_build.log    || compile_fail "afl"
-make clean &>/dev/null && make afl-persistent    &>afl_build.log    || compile_fail "afl-persistent"
-make clean &>/dev/null && make klee   &>klee_build.log   || compile_fail "klee"
-make clean &>/dev/null && make symcc  &>symcc.log 	 || compile_fail "symcc"
-make clean &>/dev/null && make debug  &>debug_build.log  || compile_fail "debug" 
-make clean &>/dev/null && make fanalyzer &>fanalyzer_build.log
-make clean &>/dev/null && make fanalyzer-taint &>fanalyzer_taint_build.log
-make clean &>/dev/null && make native &>native_build.log || compile_fail "native"
+# the number of concurrent compilation jobs shared by all the variants
+JOBS=${JOBS:-$(nproc)}
+
+# the variants are built out of tree (in build/<variant>), so they don't have to be cleaned
+# in between and can be built concurrently; the compilation errors are caught once upfront
+make clean &>/dev/null
+make check &>check_build.log || compile_fail "check"
+make -k -j"$JOBS" variants &>/dev/null
+
+# fanalyzer builds are not required to succeed
+for target in asan ubsan dfsan gcov afl afl-persistent klee symcc debug native; do
+    [ -f "build/$target.ok" ] || compile_fail "$target"
+done
+# the libFuzzer variant is only built for the off-targets generated with --libfuzzer
+if grep -q LLVMFuzzerTestOneInput aot.c; then
+    [ -f "build/libfuzzer.ok" ] || compile_fail "libfuzzer"
+fi
@@ -6,10 +6,15 @@
 
 
 #include <assert.h>
+#include <signal.h>
 #include <stdio.h>
 #include <stdint.h>
 #include <stdlib.h>
 #include <string.h>
+#include <sys/mman.h>
+#include <unistd.h>
+
+#include "dyn_init.h"
 
 /* Despite the name, this header supports C as well */
 #include <unflatten.hpp>
@@ -26,16 +31,126 @@ static uintptr_t get_fpointer_test_function_address(const char* fsym) {
 
 /* KFLAT library wrappers */
 static CUnflatten unflatten = NULL;
+static int globals_initialized = 0;
 
-void aot_kflat_init(const char* imgpath) {
-	int ret;
+/* Lazy initialization of globals
+ *  The off-targets generated with --dynamic-init-lazy place the globals initialized from the image
+ *  in the aot_kflat_globals section. The pages entirely inside of that section are protected and
+ *  the contents of the globals are copied from the image on the first access to their pages
+ *  (the parts of the globals on the edge pages of the section are copied eagerly).
+ *  The pointers in the image are redirected to the globals upfront, so all accesses go through
+ *  the protected pages. */
+extern char __start_aot_kflat_globals[] __attribute__((weak));
+extern char __stop_aot_kflat_globals[] __attribute__((weak));
 
-	if(unflatten != NULL) {
-		fprintf(stderr, "Stay where you are! For some reason aot_kflat_init was invoked twice.\n");
-		fprintf(stderr, "Such scenario is impossible to happen in non-modified off-target!\n");
-		fprintf(stderr, "\nWhatever you're doing, please remember to call aot_kflat_fini!!\n");
-		assert(unflatten != NULL);
+struct lazy_variable {
+	char* addr;
+	void* src;
+	unsigned long size;
+};
+static struct lazy_variable* lazy_variables = NULL;
+static unsigned long lazy_variables_count = 0, lazy_variables_capacity = 0;
+static char* lazy_start = NULL, *lazy_end = NULL;
+static unsigned long page_size;
+static struct sigaction old_segv_action;
+
+static char* page_floor(const char* addr) {
+	return (char*)((uintptr_t)addr & ~(uintptr_t)(page_size - 1));
+}
+
+static char* page_ceil(const char* addr) {
+	return page_floor(addr + page_size - 1);
+}
+
+/* Copy the contents of all the pending globals on the pages around addr. The globals can span
+ *  multiple pages, so the range is extended until no pending global crosses its boundaries */
+static void lazy_materialize(char* addr) {
+	char* lo = page_floor(addr), *hi = lo + page_size;
+	int changed = 1;
+	while(changed) {
+		changed = 0;
+		for(unsigned long i = 0; i < lazy_variables_count; i++) {
+			struct lazy_variable* var = &lazy_variables[i];
+			if(var->src == NULL || var->addr >= hi || var->addr + var->size <= lo)
+				continue;
+			if(page_floor(var->addr) < lo) {
+				lo = page_floor(var->addr);
+				changed = 1;
+			}
+			if(page_ceil(var->addr + var->size) > hi) {
+				hi = page_ceil(var->addr + var->size);
+				changed = 1;
+			}
+		}
+	}
+	if(lo < lazy_start)
+		lo = lazy_start;
+	if(hi > lazy_end)
+		hi = lazy_end;
+
+	mprotect(lo, hi - lo, PROT_READ | PROT_WRITE);
+	for(unsigned long i = 0; i < lazy_variables_count; i++) {
+		struct lazy_variable* var = &lazy_variables[i];
+		if(var->src == NULL || var->addr >= hi || var->addr + var->size <= lo)
+			continue;
+		memcpy(var->addr, var->src, var->size);
+		var->src = NULL;
 	}
+}
+
+static void lazy_segv_handler(int sig, siginfo_t* info, void* context) {
+	char* addr = (char*)info->si_addr;
+	if(addr >= lazy_start && addr < lazy_end) {
+		lazy_materialize(addr);
+		return;
+	}
+
+	/* Not our fault - pass it on (e.g. to ASAN) */
+	if(old_segv_action.sa_flags & SA_SIGINFO) {
+		old_segv_action.sa_sigaction(sig, info, context);
+	} else if(old_segv_action.sa_handler != SIG_DFL && old_segv_action.sa_handler != SIG_IGN) {
+		old_segv_action.sa_handler(sig);
+	} else {
+		/* The faulting instruction is executed again and crashes the program as usual */
+		sigaction(SIGSEGV, &old_segv_action, NULL);
+	}
+}
+
+static void lazy_init(void) {
+	page_size = sysconf(_SC_PAGESIZE);
+	lazy_start = page_ceil(__start_aot_kflat_globals);
+	lazy_end = page_floor(__stop_aot_kflat_globals);
+	if(lazy_start >= lazy_end) {
+		/* There are no pages to protect - the globals are initialized eagerly */
+		lazy_start = lazy_end = NULL;
+		return;
+	}
+
+	struct sigaction action;
+	memset(&action, 0, sizeof(action));
+	action.sa_sigaction = lazy_segv_handler;
+	action.sa_flags = SA_SIGINFO | SA_NODEFER;
+	sigemptyset(&action.sa_mask);
+	sigaction(SIGSEGV, &action, &old_segv_action);
+}
+
+static void lazy_fini(void) {
+	if(lazy_start == NULL)
+		return;
+	/* The image is gone, the globals that haven't been accessed so far are left uninitialized */
+	mprotect(lazy_start, lazy_end - lazy_start, PROT_READ | PROT_WRITE);
+	sigaction(SIGSEGV, &old_segv_action, NULL);
+	lazy_variables_count = 0;
+	lazy_start = lazy_end = NULL;
+}
+
+/* Load the image once; with AFL's deferred fork server it's done in the parent process,
+ *  so that the children only have to initialize the globals */
+void aot_kflat_load(const char* imgpath) {
+	int ret;
+
+	if(unflatten != NULL)
+		return;
 
 	FILE* in = fopen(imgpath, "r");
 	if(in == NULL) {
@@ -52,15 +167,84 @@ void aot_kflat_init(const char* imgpath) {
 	ret = unflatten_load(unflatten, in, get_fpointer_test_function_address);
 	assert(ret == 0);
 
+	fclose(in);
+}
+
+void aot_kflat_init(const char* imgpath) {
+	if(globals_initialized) {
+		fprintf(stderr, "Stay where you are! For some reason aot_kflat_init was invoked twice.\n");
+		fprintf(stderr, "Such scenario is impossible to happen in non-modified off-target!\n");
+		fprintf(stderr, "\nWhatever you're doing, please remember to call aot_kflat_fini!!\n");
+		assert(!globals_initialized);
+	}
+
+	aot_kflat_load(imgpath);
+
 	/* Setup globals after flattened image with their content has been loaded */
+	lazy_init();
 	aot_kflat_initialize_global_variables();
+	if(lazy_start != NULL)
+		mprotect(lazy_start, lazy_end - lazy_start, PROT_NONE);
+	globals_initialized = 1;
+}
 
-	fclose(in);
+/* Initialize the global variable with the contents of the named root of the image
+ *  (used by the init_<trigger> functions generated for the globals) */
+void aot_kflat_init_variable(const char* name, void* var) {
+	unsigned long size;
+	void* ptr = aot_kflat_root_by_name(name, &size);
+	if(ptr == NULL) {
+		printf("[Unflatten] Failed to load global %s\n", name);
+		return;
+	}
+	/* The image pointers are redirected once, aot_kflat_reinit only copies the contents again */
+	if(!globals_initialized)
+		aot_kflat_replace_variable(ptr, var, size);
+
+	char* lo = (char*)var, *hi = (char*)var + size;
+	if(lazy_start == NULL || hi <= lazy_start || lo >= lazy_end) {
+		memcpy(var, ptr, size);
+		return;
+	}
+
+	/* The parts of the global on the edge pages of the section aren't protected, copy them now */
+	if(lo < lazy_start) {
+		memcpy(lo, ptr, lazy_start - lo);
+		ptr = (char*)ptr + (lazy_start - lo);
+		lo = lazy_start;
+	}
+	if(hi > lazy_end) {
+		memcpy(lazy_end, (char*)ptr + (lazy_end - lo), hi - lazy_end);
+		hi = lazy_end;
+	}
+
+	if(lazy_variables_count == lazy_variables_capacity) {
+		lazy_variables_capacity = lazy_variables_capacity ? 2 * lazy_variables_capacity : 256;
+		lazy_variables = realloc(lazy_variables, lazy_variables_capacity * sizeof(struct lazy_variable));
+		assert(lazy_variables != NULL);
+	}
+	lazy_variables[lazy_variables_count].addr = lo;
+	lazy_variables[lazy_variables_count].src = ptr;
+	lazy_variables[lazy_variables_count].size = hi - lo;
+	lazy_variables_count++;
+}
+
+/* Initialize the globals from the already loaded image again, e.g. after they were overwritten
+ *  by the per-input initialization in the libFuzzer driver */
+void aot_kflat_reinit(void) {
+	assert(globals_initialized);
+
+	lazy_variables_count = 0;
+	aot_kflat_initialize_global_variables();
+	if(lazy_start != NULL)
+		mprotect(lazy_start, lazy_end - lazy_start, PROT_NONE);
 }
 
 void aot_kflat_fini(void) {
+	lazy_fini();
 	unflatten_deinit(unflatten);
 	unflatten = NULL;
+	globals_initialized = 0;
 }
 
 void* aot_kflat_root_by_name(const char* name, unsigned long* size) {
@@ -8,9 +8,15 @@
 #ifndef __DYN_INIT_H__
 #define __DYN_INIT_H__
 
+void aot_kflat_load(const char* imgpath);
 void aot_kflat_init(const char* imgpath);
+void aot_kflat_init_variable(const char* name, void* var);
+void aot_kflat_reinit(void);
 void aot_kflat_fini(void);
 void* aot_kflat_root_by_name(const char* name, unsigned long* size);
 long aot_kflat_replace_variable(void* old_mem, void* new_mem, unsigned long size);
 void aot_kflat_mark_freed(void* mptr);
+
+/* The globals initialized lazily from the image (--dynamic-init-lazy) */
+#define AOT_KFLAT_GLOBAL __attribute__((section("aot_kflat_globals")))
 #endif /* __DYN_INIT_H__ */
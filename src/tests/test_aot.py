@@ -0,0 +1,74 @@
+# Auto off-target PoC
+###
+# Copyright Samsung Electronics
+# Samsung Mobile Security Team @ Samsung R&D Poland
+
+import os
+import stat
+import tempfile
+import unittest
+from aot import Engine, prepare_parser
+
+
+class TestEngine(unittest.TestCase):
+
+    def test_incremental_output_dir(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            out_dir = os.path.join(tmp_dir, "out")
+            os.makedirs(out_dir)
+            engine = Engine()
+            engine.incremental = True
+            engine.final_out_dir = out_dir
+            engine.out_dir = f"{out_dir}{Engine.STAGING_DIR_SUFFIX}"
+            os.makedirs(engine.out_dir)
+            with open(os.path.join(engine.out_dir, "aot.c"), "w") as f:
+                f.write("int main() { return 0; }\n")
+
+            # the directory is logged before the staging directory is synced
+            logged_dir = engine.get_output_dir()
+            engine.sync_incremental_output()
+
+            self.assertEqual(out_dir, logged_dir)
+            self.assertTrue(os.path.isfile(os.path.join(logged_dir, "aot.c")))
+            self.assertFalse(os.path.exists(f"{out_dir}{Engine.STAGING_DIR_SUFFIX}"))
+
+    def test_format_cache_style(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # a stand-in for clang-format which marks the files with the style it finds
+            clang_format = os.path.join(tmp_dir, "clang-format")
+            with open(clang_format, "w") as f:
+                f.write("#!/bin/sh\n"
+                        "[ \"$1\" = --version ] && echo 1.0 && exit 0\n"
+                        "style=$(cat \"$(dirname \"$2\")/../.clang-format\")\n"
+                        "[ \"$1\" = --dump-config ] && echo \"$style\" && exit 0\n"
+                        "echo \"/* $style */\" >> \"$2\"\n")
+            os.chmod(clang_format, os.stat(clang_format).st_mode | stat.S_IXUSR)
+
+            engine = Engine()
+            engine.out_dir = os.path.join(tmp_dir, "out")
+            engine.format_cache = os.path.join(tmp_dir, "cache")
+            engine.format_jobs = 1
+            os.makedirs(engine.out_dir)
+            path = os.path.join(engine.out_dir, "aot.c")
+
+            def format(style):
+                with open(os.path.join(tmp_dir, ".clang-format"), "w") as f:
+                    f.write(style)
+                with open(path, "w") as f:
+                    f.write("int main() { return 0; }\n")
+                engine._format_files(clang_format, ["aot.c"])
+                with open(path, "r") as f:
+                    return f.read()
+
+            self.assertIn("/* LLVM */", format("LLVM"))
+            self.assertIn("/* Google */", format("Google"))
+            # the files formatted with the first style are still taken from the cache
+            self.assertIn("/* LLVM */", format("LLVM"))
+            self.assertEqual(2, len(os.listdir(engine.format_cache)))
+
+    def test_max_literals(self) -> None:
+        parser = prepare_parser()
+        self.assertEqual(0, parser.parse_args(["--max-literals", "0"]).max_literals)
+        self.assertEqual(10, parser.parse_args(["--max-literals", "10"]).max_literals)
+        with self.assertRaises(SystemExit):
+            parser.parse_args(["--max-literals", "-1"])
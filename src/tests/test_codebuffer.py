@@ -0,0 +1,24 @@
+# Auto off-target PoC
+###
+# Copyright Samsung Electronics
+# Samsung Mobile Security Team @ Samsung R&D Poland
+
+import unittest
+from codebuffer import CodeBuffer
+
+
+class TestCodeBuffer(unittest.TestCase):
+
+    def test_code_buffer(self) -> None:
+        str = CodeBuffer("int main() {\n")
+        start = str.mark()
+        str += "\tint x = 0;\n"
+        str.append_indented("if (x)\n\treturn 1;\n")
+        str += ""
+        str += "return 0;\n}\n"
+        str.insert(start, "\t/* body */\n")
+
+        expected = "int main() {\n\t/* body */\n\tint x = 0;\n\tif (x)\n\t\treturn 1;\n\treturn 0;\n}\n"
+        self.assertEqual(len(expected), len(str))
+        self.assertEqual(expected, str.getvalue())
+        self.assertEqual(expected, str.getvalue())
@@ -0,0 +1,92 @@
+# Auto off-target PoC
+###
+# Copyright Samsung Electronics
+# Samsung Mobile Security Team @ Samsung R&D Poland
+
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from codegen import CodeGen
+from artifactcache import ArtifactCache
+
+
+class TestCodeGen(unittest.TestCase):
+
+    def _get_func(self) -> dict:
+        body = "int f(int a) {\n\tx = VAL;\n\ty = MAX(a, 1);\n\tz = VAL;\n\tDEBUG;\n}\n"
+        expansions = []
+        for macro, text in [("VAL", "1"), ("MAX(a, 1)", "((a)>(1)?(a):(1))"), ("VAL", "2"), ("DEBUG", "")]:
+            expansions.append({"pos": body.index(macro, expansions[-1]["pos"] + 1 if expansions else 0),
+                               "len": len(macro), "text": text})
+        return {"id": 7, "hash": "7:f", "body": "int f(int a) { ... }",
+                "unpreprocessed_body": body, "macro_expansions": expansions}
+
+    def test_unrolled_macro_body(self) -> None:
+        f = self._get_func()
+        codegen = CodeGen(None, None, None, SimpleNamespace(unroll_macro_defs=True))
+        codegen.unrolled_simple_macro_counter = 5
+
+        unrolled_macro_map = {}
+        common_unrolled_macro_map = {}
+        body = codegen._get_unrolled_macro_body(f, unrolled_macro_map, common_unrolled_macro_map)
+
+        self.assertEqual("int f(int a) {\n\tx = VAL__5;\n\ty = __macrocall__MAX__6/*(a, 1)*/;\n\tz = VAL__7;\n\t;\n}\n", body)
+        self.assertEqual({"VAL": [("1", 5), ("2", 7)]}, unrolled_macro_map)
+        self.assertEqual({"__macrocall__MAX__6": "((a)>(1)?(a):(1))"}, common_unrolled_macro_map)
+        self.assertEqual(8, codegen.unrolled_simple_macro_counter)
+
+        # the cached template gets the next counter values
+        body = codegen._get_unrolled_macro_body(f, {}, common_unrolled_macro_map)
+        self.assertIn("__macrocall__MAX__9", body)
+        self.assertEqual(1, codegen.unrolled_macro_cache_hits)
+
+    def test_unrolled_macro_cache(self) -> None:
+        f = self._get_func()
+        args = SimpleNamespace(unroll_macro_defs=True)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "unrolled.json")
+            codegen = CodeGen(None, None, None, args)
+            codegen.load_unrolled_macro_cache(path)
+            expected = codegen._get_unrolled_macro_body(f, {}, {})
+            codegen.store_unrolled_macro_cache()
+
+            codegen = CodeGen(None, None, None, args)
+            codegen.load_unrolled_macro_cache(path)
+            body = codegen._get_unrolled_macro_body(f, {}, {})
+
+        self.assertEqual(expected, body)
+        self.assertEqual(1, codegen.unrolled_macro_cache_hits)
+
+    def test_artifact_cache(self) -> None:
+        stub = {"code": "int f(void) {\n\treturn 0;\n}\n", "func_name": "f", "asm": False, "ret_ptr": False, "fptr": False}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache = ArtifactCache(tmp_dir, ["db.img", 1, 1], [])
+            self.assertIsNone(cache.get(ArtifactCache.STUB, 7, [True, False]))
+            cache.put(ArtifactCache.STUB, 7, stub, [True, False])
+            cache.store()
+
+            cache = ArtifactCache(tmp_dir, ["db.img", 1, 1], [])
+            result = cache.get(ArtifactCache.STUB, 7, [True, False])
+
+            # a different context or database doesn't share the fragments
+            self.assertIsNone(cache.get(ArtifactCache.STUB, 7, [False, False]))
+            other_cache = ArtifactCache(tmp_dir, ["db.img", 1, 2], [])
+            self.assertIsNone(other_cache.get(ArtifactCache.STUB, 7, [True, False]))
+        self.assertEqual(stub, result)
+        self.assertEqual((1, 2), (cache.hits, cache.lookups))
+
+    def test_function_pointer_stub_entries(self) -> None:
+        dbops = SimpleNamespace(fnidmap={1: {"name": "zeta", "mids": None}, 2: {"name": "alpha", "mids": [1]},
+                                         3: {"name": "alpha", "mids": None}, 4: None},
+                                modidmap={1: "drivers/my-mod.ko"})
+        codegen = CodeGen(dbops, None, None, SimpleNamespace())
+        codegen.function_pointer_stubs = {"s_zeta": 1, "s_alpha": 2, "s_alpha2": 3, "Beta": 4}
+
+        entries = codegen._get_function_pointer_stub_entries()
+
+        # sorted in the strcmp order, the functions with the same name keep the order of the stubs
+        self.assertEqual(['  { "Beta", (void*)0x0, (void**)&Beta },',
+                          '  { "alpha", (const char*[]){"my_mod", (void*)0x0}, (void**)&s_alpha },',
+                          '  { "alpha", (void*)0x0, (void**)&s_alpha2 },',
+                          '  { "zeta", (void*)0x0, (void**)&s_zeta },'], entries)
@@ -0,0 +1,44 @@
+# Auto off-target PoC
+###
+# Copyright Samsung Electronics
+# Samsung Mobile Security Team @ Samsung R&D Poland
+
+import unittest
+from types import SimpleNamespace
+from cutoff import CutOff
+
+
+class _FnIdMap(dict):
+
+    def get_many(self, fids):
+        return [self[fid] for fid in fids]
+
+
+class TestCutOff(unittest.TestCase):
+
+    def test_function_stats_two_passes(self) -> None:
+        # 'drv_init' references the global 'drv_ops' which holds a pointer to 'drv_open',
+        # both functions live in the 'drv' directory
+        fnidmap = _FnIdMap({0: {"id": 0, "name": "drv_init", "funrefs": [], "globalrefs": [10]},
+                            1: {"id": 1, "name": "drv_open", "funrefs": []}})
+        dbops = SimpleNamespace(fnidmap=fnidmap, known_funcs_ids=set(), always_inc_funcs_ids=set(),
+                                all_funcs_with_asm=set(), fpointer_map={}, dir_names=["drv"],
+                                mod_sets=[frozenset()], fid_to_mods_id=[0, 0], fid_to_dir_id=[0, 0],
+                                _get_function_name=lambda fid: fnidmap[fid]["name"])
+        deps = SimpleNamespace(_get_types_in_funcs=lambda fids, internal_defs: set(),
+                               _get_funcs_from_types=lambda types: set(),
+                               _get_globals_from_types=lambda types: set(),
+                               _get_globals_from_globals=lambda globs: set(),
+                               _get_funcs_from_globals=lambda globs: {1} if 10 in globs else set())
+        args = SimpleNamespace(co_funcs=[], co_dirs=["drv"], co_modules=[], co_files=[],
+                               cut_off=CutOff.CUT_OFF_DIRS, include_asm=False,
+                               func_stats=CutOff.FUNC_STATS_BASIC)
+        cutoff = CutOff(dbops, args, deps)
+
+        # the first pass doesn't know where the function pulled in through the global resides yet
+        cutoff._get_function_stats([0], [0])
+        self.assertEqual({1}, cutoff.external_funcs)
+
+        cutoff._get_function_stats([0], [0, 1])
+        self.assertEqual({1}, cutoff.internal_funcs)
+        self.assertEqual(set(), cutoff.external_funcs)
@@ -0,0 +1,138 @@
+# Auto off-target PoC
+###
+# Copyright Samsung Electronics
+# Samsung Mobile Security Team @ Samsung R&D Poland
+
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from deps import Deps
+
+
+class TypeMap(dict):
+
+    def get_many(self, ids):
+        return [self[t_id] for t_id in ids]
+
+
+class TestDeps(unittest.TestCase):
+
+    def _capture_literals(self, max_literals) -> str:
+        literals = {Deps.INT_LITERAL: [0, 256, -2, 2**64], Deps.FLOAT_LITERAL: [1.0],
+                    Deps.CHAR_LITERAL: ["a"], Deps.STRING_LITERAL: ["a\\b", "%d"]}
+        functions = {
+            1: {"name": "f", "literals": literals, "switches": [{"cases": [["256", 0, 0, 0]]}]},
+            2: {"name": "g", "literals": {Deps.INT_LITERAL: [256], Deps.FLOAT_LITERAL: [1.0],
+                                          Deps.CHAR_LITERAL: [], Deps.STRING_LITERAL: []}},
+        }
+        with tempfile.TemporaryDirectory() as out_dir:
+            deps = Deps(SimpleNamespace(output_dir=out_dir, max_literals=max_literals))
+            deps.set_dbops(SimpleNamespace(fnidmap=functions, globalsidmap={}))
+            deps.capture_literals([], [1, 2])
+            with open(os.path.join(out_dir, Deps.AOT_LITERALS_FILE)) as f:
+                return f.read()
+
+    def test_capture_literals(self) -> None:
+        expected = "literal0=\"\\xfe\\xff\\xff\\xff\\xff\\xff\\xff\\xff\"\n" +\
+                   "literal1=\"\\x00\"\n" +\
+                   "literal2=\"\\x00\\x01\"\n" +\
+                   "literal3=\"\\x00\\x00\\x00\\x00\\x00\\x00\\x00\\x00\\x01\"\n" +\
+                   "literal4=\"\\x00\\x00\\x00\\x00\\x00\\x00\\xf0\\x3f\"\n" +\
+                   "literal5=\"a\"\n" +\
+                   "literal6=\"a\\\\\\\\b\"\n"
+        self.assertEqual(expected, self._capture_literals(None))
+
+    def test_capture_literals_limit(self) -> None:
+        # 256 and 1.0 are the most frequently used literals
+        expected = "literal0=\"\\x00\\x01\"\n" +\
+                   "literal1=\"\\x00\\x00\\x00\\x00\\x00\\x00\\xf0\\x3f\"\n"
+        self.assertEqual(expected, self._capture_literals(2))
+
+    def _get_dbops(self, typemap, **kwargs) -> SimpleNamespace:
+        def get_recursive_by_id(collection, items, field, skip_list=None):
+            result = set()
+            to_visit = list(items)
+            while to_visit:
+                t_id = to_visit.pop()
+                if t_id not in result:
+                    result.add(t_id)
+                    to_visit += typemap[t_id][field]
+            return result if skip_list is None else result.difference(skip_list)
+
+        return SimpleNamespace(typemap=typemap, _get_recursive_by_id=get_recursive_by_id, **kwargs)
+
+    def test_types_closure(self) -> None:
+        typemap = TypeMap({
+            1: {"id": 1, "class": "builtin", "refs": []},
+            2: {"id": 2, "class": "record", "refs": [1, 3], "decls": [1]},
+            # defined inside struct 2
+            3: {"id": 3, "class": "record", "refs": [1]},
+            4: {"id": 4, "class": "pointer", "refs": [5]},
+            5: {"id": 5, "class": "record", "refs": [4, 2]},
+            6: {"id": 6, "class": "typedef", "refs": [5]},
+        })
+
+        dbops = self._get_dbops(typemap)
+        deps = Deps(SimpleNamespace(used_types_only=False))
+        deps.set_dbops(dbops)
+        expected_defs = set()
+        expected, _ = deps._get_types_recursive([6], None, expected_defs)
+
+        deps = Deps(SimpleNamespace(used_types_only=False))
+        deps.set_dbops(dbops)
+        internal_defs = set()
+        result = deps._get_types_closure([6], None, internal_defs)
+
+        self.assertEqual({2, 4, 5, 6}, result)
+        self.assertEqual(set(expected), result)
+        self.assertEqual(expected_defs, internal_defs)
+
+    def test_types_closure_dup_types(self) -> None:
+        typemap = TypeMap({
+            1: {"id": 1, "class": "builtin", "refs": []},
+            # the same struct seen in two compilation units
+            2: {"id": 2, "class": "record", "refs": [1]},
+            3: {"id": 3, "class": "record", "refs": [1]},
+            4: {"id": 4, "class": "typedef", "refs": [2]},
+            5: {"id": 5, "class": "typedef", "refs": [3]},
+            6: {"id": 6, "class": "record", "refs": [4, 5]},
+        })
+        dbops = self._get_dbops(typemap, fnidmap={10: {"id": 10, "refs": [6], "types": [1], "globalrefs": []}})
+        cutoff = SimpleNamespace(external_funcs=set())
+
+        deps = Deps(SimpleNamespace(used_types_only=False))
+        deps.set_dbops(dbops)
+        deps.set_cutoff(cutoff)
+        deps.dup_types = {2: [2, 3], 3: [2, 3]}
+        expected_defs = set()
+        expected = deps._get_types_in_funcs([10], expected_defs)
+
+        deps = Deps(SimpleNamespace(used_types_only=False))
+        deps.set_dbops(dbops)
+        deps.set_cutoff(cutoff)
+        deps.dup_types = {2: [2, 3], 3: [2, 3]}
+        internal_defs = set()
+        result = deps._get_types_in_funcs_closure([10], internal_defs)
+
+        self.assertEqual({2, 4, 5, 6}, result)
+        self.assertEqual(set(expected), result)
+        self.assertEqual(expected_defs, internal_defs)
+
+    def test_global_state_def(self) -> None:
+        types = TypeMap({1: {"id": 1, "class": "builtin", "qualifiers": ""},
+                         2: {"id": 2, "class": "builtin", "qualifiers": "c"},
+                         3: {"id": 3, "class": "const_array", "refs": [2]},
+                         4: {"id": 4, "class": "typedef", "refs": [1]}})
+        deps = Deps(SimpleNamespace(snapshot_globals=True, dynamic_init=False, dynamic_init_lazy=False))
+        deps.set_dbops(SimpleNamespace(typemap=types))
+
+        self.assertEqual("int x AOT_GLOBAL_STATE = 1", deps._get_global_state_def({"type": 1}, "int x = 1"))
+        self.assertEqual("my_t y[4] AOT_GLOBAL_STATE", deps._get_global_state_def({"type": 4}, "my_t y[4]"))
+        # const data and globals placed in their own sections are left alone
+        self.assertEqual("const int z[2] = {1, 2}", deps._get_global_state_def({"type": 3}, "const int z[2] = {1, 2}"))
+        self.assertEqual("int w __attribute__((section(\".data\")))",
+                         deps._get_global_state_def({"type": 1}, "int w __attribute__((section(\".data\")))"))
+
+        deps.args.dynamic_init = deps.args.dynamic_init_lazy = True
+        self.assertEqual("int x AOT_KFLAT_GLOBAL = 1", deps._get_global_state_def({"type": 1}, "int x = 1"))
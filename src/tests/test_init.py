@@ -4,7 +4,9 @@
 # Samsung Mobile Security Team @ Samsung R&D Poland
 
 import unittest
-from init import _TreeIterator
+from types import SimpleNamespace
+from codegen import CodeGen
+from init import Init, _TreeIterator
 
 
 class TestInit(unittest.TestCase):
@@ -23,3 +25,72 @@ class TestInit(unittest.TestCase):
 
         self.assertEqual(len(expected_list), result_len, 'Invalid length')
         self.assertSequenceEqual(expected_list, result_list, 'Invalid list')
+
+    def test_tree_iterator_deep(self) -> None:
+        # deeper than the default recursion limit
+        tree = [1]
+        for i in range(2, 5001):
+            tree = [tree, i]
+
+        iterator = _TreeIterator(tree)
+
+        self.assertEqual(5000, iterator.len())
+        self.assertSequenceEqual(list(range(1, 5001)), list(iterator))
+
+    def test_find_type_by_name(self) -> None:
+        types = [
+            {'id': 0, 'class': 'builtin', 'str': 'int', 'qualifiers': ''},
+            {'id': 1, 'class': 'record', 'str': 'foo', 'union': False,
+             'qualifiers': 'c'},
+            {'id': 2, 'class': 'record', 'str': 'foo', 'union': False,
+             'qualifiers': ''},
+            {'id': 3, 'class': 'record', 'str': 'foo', 'union': False,
+             'qualifiers': ''},
+            {'id': 4, 'class': 'pointer', 'refs': [2], 'qualifiers': ''},
+        ]
+        dbops = SimpleNamespace(
+            db={'types': types},
+            typemap={t['id']: t for t in types}
+        )
+        args = SimpleNamespace()
+        codegen = CodeGen(dbops, None, None, args)
+        init = Init(dbops, None, None, codegen, args)
+
+        self.assertEqual(2, init.find_type_by_name('struct foo')['id'])
+        self.assertEqual(4, init.find_type_by_name('struct foo *')['id'])
+        self.assertIsNone(init.find_type_by_name('struct bar'))
+
+        # the index is built only once
+        index = init.typename_to_tid
+        init.find_type_by_name('int')
+        self.assertIs(index, init.typename_to_tid)
+
+    def test_var_init_template(self) -> None:
+        types = [
+            {'id': 0, 'class': 'builtin', 'str': 'int', 'qualifiers': '',
+             'size': 32},
+        ]
+        dbops = SimpleNamespace(
+            db={'types': types},
+            typemap={t['id']: t for t in types},
+            init_data=None,
+            _get_typedef_dst=lambda t: t
+        )
+        args = SimpleNamespace(init=True, debug_vars_init=False)
+        codegen = CodeGen(dbops, None, None, args)
+        init = Init(dbops, None, None, codegen, args)
+        init.used_types_data = {}
+
+        results = []
+        for name in ['x', 'y', 'z']:
+            data = {}
+            pointers = []
+            code, _, _ = init._generate_var_init(name, types[0], pointers,
+                                                 fuse=0, data=data)
+            results.append((code, data))
+
+        self.assertEqual(1, len(init.var_init_cache))
+        self.assertEqual(1, init.var_init_cache_hits)
+        for name, (code, data) in zip(['x', 'y', 'z'], results):
+            self.assertEqual(results[0][0].replace('&x', f'&{name}'), code)
+            self.assertEqual(name, data['name_raw'])
@@ -0,0 +1,58 @@
+# Auto off-target PoC
+###
+# Copyright Samsung Electronics
+# Samsung Mobile Security Team @ Samsung R&D Poland
+
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from otgenerator import OTGenerator
+
+
+class TypeMap(dict):
+
+    def get_many(self, ids):
+        return [self[t_id] for t_id in ids]
+
+
+class TestOTGenerator(unittest.TestCase):
+
+    def test_common_types_include(self) -> None:
+        typemap = TypeMap({
+            1: {"id": 1, "class": "record", "str": "list_head"},
+            2: {"id": 2, "class": "pointer", "str": "*"},
+            3: {"id": 3, "class": "record", "str": "config"},
+            4: {"id": 4, "class": "typedef", "name": "config_t"},
+            # the off-target's own, different struct config
+            5: {"id": 5, "class": "record", "str": "config"},
+            6: {"id": 6, "class": "record", "str": "device"},
+            # a duplicate of list_head
+            7: {"id": 7, "class": "record", "str": "list_head"},
+        })
+        dbops = SimpleNamespace(typemap=typemap)
+        deps = SimpleNamespace(dup_types={1: [1, 7], 7: [1, 7]}, clash_type_to_file={})
+        common_types = [
+            {"id": 2, "defs": [], "refs": [1]},
+            {"id": 1, "defs": [], "refs": [2]},
+            {"id": 3, "defs": [], "refs": []},
+            {"id": 4, "defs": [], "refs": [3]},
+        ]
+        with tempfile.TemporaryDirectory() as out_dir:
+            otgen = OTGenerator(dbops, deps, None, None, None, SimpleNamespace(output_dir=out_dir))
+            otgen.common_types_header = "/shared/common.h"
+            otgen.common_types = common_types
+            types = [7, 6]
+            result = otgen._get_common_types_include(types, set())
+            with open(os.path.join(out_dir, OTGenerator.AOT_COMMON_TYPES_MAKEFILE)) as f:
+                mk = f.read()
+
+            # struct config clashes with the off-target type, the header can't be used
+            clashing_types = [7, 5, 6]
+            clashing_result = otgen._get_common_types_include(clashing_types, set())
+
+        self.assertEqual("\n/* Common types */\n#include \"/shared/common.h\"\n", result)
+        self.assertEqual([6], types)
+        self.assertEqual("AOT_COMMON_TYPES_HEADER := /shared/common.h\n", mk)
+        self.assertEqual("", clashing_result)
+        self.assertEqual([7, 5, 6], clashing_types)
@@ -0,0 +1,27 @@
+# Auto off-target PoC
+###
+# Copyright Samsung Electronics
+# Samsung Mobile Security Team @ Samsung R&D Poland
+
+import os
+import tempfile
+import unittest
+from outsink import OutputSink
+
+
+class TestOutputSink(unittest.TestCase):
+
+    def test_patch_markers(self) -> None:
+        with tempfile.TemporaryDirectory() as out_dir:
+            sink = OutputSink(out_dir)
+            contents = "int a;\n//M1\nvoid f() {\n//M2\n}\n//M1\n"
+            sink.write("file.c", contents, ["//M1", "//M2"])
+            sink.patch("file.c", {"//M2": "\ta = 1;\n\tb = 'ż';"})
+            sink.patch("file.c", {"//M1": ""})
+
+            with open(os.path.join(out_dir, "file.c")) as f:
+                result = f.read()
+
+        expected = contents.replace("//M2", "\ta = 1;\n\tb = 'ż';").replace("//M1", "")
+        self.assertEqual(expected, result)
+        self.assertEqual([], sink.markers["file.c"])